@@ -0,0 +1,194 @@
+"""
+Fuzz cho text_scanner: kiểm tra các message mẫu có kết quả biết trước, so sánh kết quả với các regex cũ
+(bench/regex_reference.py) trên message ngẫu nhiên và kiểm tra giới hạn thời gian trên input đối kháng
+(dòng rất dài, lặp "gán cho", không có điểm kết thúc). Thoát với mã 1 nếu có sai khác hoặc vượt giới hạn.
+
+    python bench/fuzz_scanner.py --cases 50000 --size 200000 --budget 0.5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import regex_reference as reference
+import text_scanner as scanner
+
+WORDS = [
+    'epic', 'EPIC', 'Epic', 'link', 'Link', 'đến', 'ĐẾN', 'to', 'TO', 'for', 'gán', 'GÁN', 'gắn', 'cho', 'task',
+    'này', 'và', 'VÀ', 'and', 'AND', 'assign', 'assignee', 'Assignee', 'tạo', 'hãy', 'mức', 'độ', 'ưu', 'tiên',
+    'priority', 'cao', ':', '-', '=', ',', '.', '!', '?', '(', ')', '()', '(KHN.SBU3.DEV)', '(x', 'y)', '<', '>',
+    '<at>', '</at>', '<at id="0">', '<p>', '</p>', '&nbsp;', '&amp;', '&lt;', '&#10;', 'Lê', 'Đức', 'Anh',
+    'DXAI', 'DX-AI', 'PROJ-123', 'john@example.com', 'x', 'epics', 'linkage', 'tomato', 'android', 'vàng',
+    'chon', 'gánh', 'assigned', 'İ', 'ſ', 'K', 'andy', 'toàn',
+]
+# Cụm instruction, {s} là một khoảng trắng ngẫu nhiên (có thể dài, có '\n')
+PHRASES = [
+    'epic{s}link{s}', 'epic{s}link{s}đến{s}', 'epic{s}link{s}to{s}', 'epic:{s}', 'epic{s}={s}', 'Epic-',
+    'link{s}to{s}epic{s}', 'link{s}đến{s}epic{s}', 'gán{s}cho{s}', 'gắn{s}cho{s}', 'gán{s}task{s}này{s}cho{s}',
+    'tạo{s}task{s}gắn{s}cho{s}', 'assign{s}to{s}', 'assign{s}for{s}', 'assign{s}', 'assignee:{s}', 'assignee{s}={s}',
+    'hãy{s}gán{s}cho{s}', '{s}và{s}', '{s}and{s}', ',{s}ưu{s}tiên{s}cao', '{s}priority{s}', 'mức{s}độ{s}',
+]
+SPACES = [' ', ' ', ' ', '', '  ', '   ', '\t', '\n', ' \n', '\xa0', ' ']
+SEPARATORS = [' ', ' ', ' ', '  ', '', '\t', '\n', '\r\n', ' \n ', '\xa0', ' ', '\x1c', ',', ', ']
+
+# (message đã làm sạch, epic link, assignee, truncated) mong đợi của parse_epic_and_assignee
+KNOWN_CASES = [
+    # bench/corpus.json: "to" trong "Tools" không phải từ nối
+    ('tạo improvement tối ưu thời gian build CI epic link Internal Tools', 'Internal Tools', None, False),
+    ('tạo task cập nhật thư viện bảo mật\ngán cho Nguyễn Văn Hùng epic link Mobile App', 'Mobile App', 'Nguyễn Văn Hùng', False),
+    ('tạo task x epic link Mobile App và gán cho Lê Đức Anh', 'Mobile App', 'Lê Đức Anh', False),
+    ('tạo task x epic link Vàng Bạc', 'Vàng Bạc', None, False),
+    ('tạo task x epic link Android Forms', 'Android Forms', None, False),
+    # Tên có từ nối bị cắt: quick parse hạ confidence để Gemini quyết định
+    ('tạo task x epic link Sales and Marketing', 'Sales', None, True),
+    ('tạo task x gán cho Tom và Jerry', None, 'Tom', True),
+]
+
+def check_known_cases():
+    failures = []
+    for text, *expected in KNOWN_CASES:
+        result = scanner.parse_epic_and_assignee(text)
+        if list(result) != expected:
+            failures.append(f"{text!r}: {result!r}, mong đợi {tuple(expected)!r}")
+    return failures
+
+def random_message(rng):
+    parts = []
+    for _ in range(rng.randint(0, 24)):
+        if rng.random() < 0.3:
+            phrase = rng.choice(PHRASES)
+            while '{s}' in phrase:
+                phrase = phrase.replace('{s}', rng.choice(SPACES), 1)
+            parts.append(phrase)
+        else:
+            parts.append(rng.choice(WORDS))
+        parts.append(rng.choice(SEPARATORS))
+    text = ''.join(parts)
+    if rng.random() < 0.2:
+        text = text.rstrip() + '\n'
+    return text
+
+def compare(text):
+    """Danh sách (tên hàm, kết quả scanner, kết quả regex) bị khác nhau"""
+    first_line = text.split('\n')[0]
+    checks = [
+        ('extract_epic_and_assignee', text),
+        ('find_assignee_in_text', text),
+        ('assign_phrase_span', text),
+        ('has_assign_instruction', text),
+        ('cut_summary_tail', first_line),
+        ('remove_parens', text),
+        ('strip_tags', text),
+        ('iter_mention_tags', text),
+    ]
+    diffs = []
+    for name, arg in checks:
+        new, old = getattr(scanner, name)(arg), getattr(reference, name)(arg)
+        if name == 'iter_mention_tags':
+            new, old = list(new), list(old)
+        if new != old:
+            diffs.append((name, new, old))
+    return diffs
+
+def adversarial_inputs(size):
+    """(tên, text) có độ dài ~size: các dạng làm regex lazy/backtracking chạy bình phương"""
+    def repeat(chunk, tail=''):
+        return chunk * (size // len(chunk)) + tail
+    return [
+        ('lặp "gán cho", không kết thúc', repeat('gán cho ', ',')),
+        ('lặp "gắn cho" trong mention', repeat('gắn cho <at>A</at> ', ',')),
+        ('epic link + dòng dài không kết thúc', 'epic link ' + 'x' * size + ','),
+        ('gán cho + dải khoảng trắng dài', 'gán cho' + ' ' * size + ','),
+        ('assign + dải khoảng trắng dài', 'assign' + ' ' * size + 'to' + ' ' * 3 + ','),
+        ('lặp "epic:"', repeat('epic: ', ',')),
+        ('lặp "link to epic"', repeat('link to epic ', ',')),
+        ('nhiều từ, không từ khóa', repeat('ab ')),
+        ('khoảng trắng dài giữa hai từ', 'a' + ' ' * size + 'b'),
+        ('lặp ", " trong tiêu đề', repeat(' , ') + 'x'),
+        ('ngoặc mở không đóng', repeat(' (')),
+        ('"<" không có ">"', repeat('<')),
+        ('"<at" không có ">"', repeat('<at')),
+        ('mention không đóng', repeat('<at>x')),
+        ('lặp "gán cho" không có điểm kết thúc', repeat('gán cho x, ')),
+        ('"và" dính liền', repeat('gán cho xvà')),
+    ]
+
+# Input gấp SCALE lần: tuyến tính thì thời gian tăng ~SCALE lần, bình phương thì ~SCALE^2 lần
+SCALE = 4
+MAX_GROWTH = 8  # Ngưỡng giữa tuyến tính (4x) và bình phương (16x)
+NOISE_FLOOR = 0.02  # Thời gian ở input lớn dưới 20ms thì không xét tỉ lệ (nhiễu lớn hơn chênh lệch)
+
+def timed(function, arg, repeat=5):
+    """Thời gian nhanh nhất trong repeat lần chạy (bỏ nhiễu GC, scheduler)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(arg)
+        if hasattr(result, '__next__'):
+            list(result)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def check_time_bounds(size, budget):
+    """Mỗi hàm của scanner chạy trong budget giây và tăng gần tuyến tính khi input lớn gấp SCALE lần"""
+    functions = ['extract_epic_and_assignee', 'find_assignee_in_text', 'assign_phrase_span',
+                 'has_assign_instruction', 'cut_summary_tail', 'remove_parens', 'strip_tags', 'iter_mention_tags']
+    failures = []
+    for (name, text), (_, large_text) in zip(adversarial_inputs(size), adversarial_inputs(size * SCALE)):
+        worst = 0.0
+        for function_name in functions:
+            function = getattr(scanner, function_name)
+            elapsed = timed(function, text)
+            elapsed_large = timed(function, large_text)
+            worst = max(worst, elapsed)
+            growth = elapsed_large / max(elapsed, 1e-6)
+            if elapsed > budget or (elapsed_large > NOISE_FLOOR and growth > MAX_GROWTH):
+                failures.append(f"{function_name} / {name}: {elapsed * 1000:.1f}ms "
+                                f"(x{SCALE} input: {elapsed_large * 1000:.1f}ms, tăng {growth:.1f} lần)")
+        print(f"  {name:<40} chậm nhất {worst * 1000:8.1f}ms")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=20000, help='Số message ngẫu nhiên để so sánh với regex cũ')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--size', type=int, default=100000, help='Độ dài input đối kháng (ký tự)')
+    parser.add_argument('--budget', type=float, default=0.5, help='Thời gian tối đa mỗi lần gọi (giây)')
+    args = parser.parse_args()
+
+    print(f"Message mẫu: {len(KNOWN_CASES)} message")
+    known_failures = check_known_cases()
+    for failure in known_failures:
+        print(f"  ❌ {failure}")
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    rng = random.Random(seed)
+    print(f"So sánh với regex cũ: {args.cases} message (seed {seed})")
+    mismatches = 0
+    for _ in range(args.cases):
+        text = random_message(rng)
+        diffs = compare(text)
+        if diffs:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  ❌ {text!r}")
+                for name, new, old in diffs:
+                    print(f"     {name}: scanner={new!r} regex={old!r}")
+
+    print(f"Giới hạn thời gian: input {args.size} ký tự, tối đa {args.budget}s mỗi lần gọi")
+    failures = check_time_bounds(args.size, args.budget)
+    for failure in failures:
+        print(f"  ❌ {failure}")
+
+    if known_failures or mismatches or failures:
+        print(f"FAIL: {len(known_failures)} message mẫu sai, {mismatches} message khác kết quả, "
+              f"{len(failures)} lần vượt giới hạn thời gian")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Load test end-to-end cho /webhook/teams: Gemini và Jira được thay bằng server giả (bench/stub_servers.py)
+
+Khởi động stub servers + app (uvicorn main:app) ở tiến trình riêng, bắn các payload Teams trong
+bench/corpus.json với tốc độ cố định (open loop) và báo cáo throughput, p50/p95/p99, tỉ lệ trả lời
+trong hạn 5s của Teams, kèm p95 từng bước đọc từ /metrics của app.
+
+Với --async-reply app chạy ở chế độ trả lời bất đồng bộ (REPLY_CALLBACK_URL trỏ tới sink của stub):
+webhook chỉ trả "đang xử lý", kết quả thật được đo theo thời điểm sink nhận được.
+
+    python bench/load_test.py --rate 20 --duration 30 --gemini-latency 1.2 --jira-error-rate 0.02
+    python bench/load_test.py --rate 20 --duration 30 --gemini-latency 6 --async-reply
+    python bench/load_test.py --url http://127.0.0.1:8000 --rate 5   # dùng app đang chạy sẵn
+
+Với --cold-start tải được bắn ngay khi app nhận request (không chờ /readyz, không warmup) để đo các request
+đầu tiên sau khi khởi động; chạy hai lần cùng --jira-cache-db để so khởi động lạnh với khởi động có snapshot:
+
+    python bench/load_test.py --cold-start --jira-users 20000 --jira-cache-db /tmp/jira_cache.db --duration 10
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+from stub_servers import add_arguments as add_stub_arguments
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+BUCKET_RE = re.compile(r'^jirabot_stage_duration_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\d+)$', re.MULTILINE)
+
+def percentile(values, q):
+    """Percentile theo nearest-rank (values đã sort)"""
+    if not values:
+        return float('nan')
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+def stage_quantiles(metrics_text, q=0.95):
+    """Ước lượng quantile từng bước từ bucket của histogram (cận trên của bucket chứa quantile)"""
+    buckets = defaultdict(list)
+    for stage, le, count in BUCKET_RE.findall(metrics_text):
+        buckets[stage].append((float(le), int(count)))
+    result = {}
+    for stage, points in buckets.items():
+        total = points[-1][1]
+        if not total:
+            continue
+        result[stage] = (total, next(le for le, count in points if count >= q * total))
+    return result
+
+def make_activity(text):
+    """Payload giống outgoing webhook của Teams (id khác nhau để không dính idempotency)"""
+    return {
+        'type': 'message',
+        'id': uuid.uuid4().hex,
+        'text': text,
+        'from': {'id': f'29:bench-user-{random.randint(1, 20)}', 'name': 'Bench User'},
+        'channelData': {'channel': {'id': '19:bench@thread.tacv2'}},
+    }
+
+async def wait_until_up(client, url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} không phản hồi sau {timeout}s")
+
+def reply_outcome(text):
+    if text.startswith('✅'):
+        return 'created'
+    if text.startswith('🚦'):
+        return 'overloaded'
+    return 'queued' if text.startswith('⏳') else 'error_reply'
+
+async def send(client, url, activity, results):
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, json=activity)
+        elapsed = time.perf_counter() - start
+        text = response.json().get('text', '') if response.status_code == 200 else ''
+        outcome = reply_outcome(text) if response.status_code == 200 else f'http_{response.status_code}'
+    except httpx.HTTPError as e:
+        elapsed = time.perf_counter() - start
+        outcome = type(e).__name__
+    results.append((elapsed, outcome))
+
+async def collect_replies(client, sink_url, sent, timeout):
+    """Chờ sink nhận đủ kết quả cho các activity đã gửi; trả về [(thời gian tới lúc có kết quả, outcome)]"""
+    deadline = time.time() + timeout
+    while True:
+        received = {}
+        for reply in (await client.get(sink_url)).json():
+            reply_to = reply['activity'].get('replyToId')
+            if reply_to in sent and reply_to not in received:
+                received[reply_to] = (reply['received_at'] - sent[reply_to], reply_outcome(reply['activity'].get('text', '')))
+        if len(received) == len(sent) or time.time() > deadline:
+            break
+        await asyncio.sleep(0.5)
+    return list(received.values()) + [(float('inf'), 'no_reply')] * (len(sent) - len(received))
+
+async def replay(base_url, corpus, rate, total, warmup, sink_url=None, reply_timeout=120, cold_start=False):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        await wait_until_up(client, f'{base_url}/healthz' if cold_start else f'{base_url}/readyz')
+        webhook = f'{base_url}/webhook/teams'
+
+        # Warmup: cache epic/user/field được nạp, connection pool tới stub đã mở
+        await asyncio.gather(*(send(client, webhook, make_activity(text), []) for text in corpus[:warmup]))
+
+        results = []
+        tasks = []
+        sent = {}  # activity id -> time.time() lúc gửi (so với thời điểm sink nhận)
+        start = time.perf_counter()
+        for i in range(total):
+            # Open loop: gửi theo lịch cố định, không chờ response trước
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            activity = make_activity(corpus[i % len(corpus)])
+            sent[activity['id']] = time.time()
+            tasks.append(asyncio.create_task(send(client, webhook, activity, results)))
+        await asyncio.gather(*tasks)
+        wall_time = time.perf_counter() - start
+        completions = await collect_replies(client, sink_url, sent, reply_timeout) if sink_url else None
+
+        metrics_text = (await client.get(f'{base_url}/metrics')).text
+    return results, completions, wall_time, metrics_text
+
+def report_completions(completions):
+    """Thời gian từ lúc gửi webhook tới lúc kết quả tới sink (chế độ bất đồng bộ)"""
+    latencies = sorted(elapsed for elapsed, _ in completions)
+    outcomes = Counter(outcome for _, outcome in completions)
+    summary = {
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else float('nan'),
+        'created': outcomes['created'] / len(completions) if completions else 0.0,
+        'outcomes': dict(outcomes),
+    }
+    print(f"Kết quả bất đồng bộ p50/p95/p99/max: {summary['p50']:.3f}s / {summary['p95']:.3f}s / {summary['p99']:.3f}s / {summary['max']:.3f}s")
+    print(f"Tạo được issue:  {summary['created']:.1%}  {dict(outcomes)}")
+    return summary
+
+def report(results, wall_time, metrics_text, deadline, rate):
+    latencies = sorted(elapsed for elapsed, _ in results)
+    outcomes = Counter(outcome for _, outcome in results)
+    within = sum(1 for elapsed in latencies if elapsed < deadline)
+    summary = {
+        'requests': len(results),
+        'target_rate': rate,
+        'throughput': len(results) / wall_time if wall_time else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else float('nan'),
+        'within_deadline': within / len(results) if results else 0.0,
+        'created': outcomes['created'] / len(results) if results else 0.0,
+        'outcomes': dict(outcomes),
+        'stage_p95': {stage: p95 for stage, (_, p95) in stage_quantiles(metrics_text).items()},
+    }
+    print(f"Requests:        {summary['requests']} (target {rate}/s)")
+    print(f"Throughput:      {summary['throughput']:.1f} req/s")
+    print(f"Latency p50/p95/p99/max: {summary['p50']:.3f}s / {summary['p95']:.3f}s / {summary['p99']:.3f}s / {summary['max']:.3f}s")
+    print(f"Trong hạn {deadline}s:   {summary['within_deadline']:.1%}")
+    print(f"Tạo được issue:  {summary['created']:.1%}  {dict(outcomes)}")
+    if summary['stage_p95']:
+        print("p95 từng bước (cận trên bucket, từ /metrics của app):")
+        for stage, (count, p95) in sorted(stage_quantiles(metrics_text).items()):
+            print(f"  {stage:<18} <= {p95:g}s  (n={count})")
+    return summary
+
+def start_processes(args, tmpdir):
+    """Chạy stub servers và app ở tiến trình riêng để load generator không chia event loop với chúng"""
+    stub_cmd = [
+        sys.executable, os.path.join(BENCH_DIR, 'stub_servers.py'),
+        '--host', args.host, '--gemini-port', str(args.gemini_port), '--jira-port', str(args.jira_port),
+        '--sink-port', str(args.sink_port),
+        '--gemini-latency', str(args.gemini_latency), '--gemini-jitter', str(args.gemini_jitter),
+        '--gemini-error-rate', str(args.gemini_error_rate), '--gemini-max-concurrency', str(args.gemini_max_concurrency),
+        '--jira-latency', str(args.jira_latency), '--jira-jitter', str(args.jira_jitter),
+        '--jira-error-rate', str(args.jira_error_rate), '--jira-max-concurrency', str(args.jira_max_concurrency),
+        '--jira-users', str(args.jira_users),
+    ]
+    env = dict(
+        os.environ,
+        REPLY_CALLBACK_URL=f'http://{args.host}:{args.sink_port}/replies' if args.async_reply else '',
+        JIRA_SERVER=f'http://{args.host}:{args.jira_port}',
+        JIRA_API_TOKEN='bench',
+        JIRA_PROJECT_KEY='BENCH',
+        GEMINI_API_KEY='bench',
+        GEMINI_BASE_URL=f'http://{args.host}:{args.gemini_port}',
+        JOB_QUEUE_DB=os.path.join(tmpdir, 'jobs.db'),
+        JIRA_CACHE_DB=args.jira_cache_db or os.path.join(tmpdir, 'jira_cache.db'),
+        IDEMPOTENCY_DB='',
+    )
+    app_cmd = [
+        sys.executable, '-m', 'uvicorn', 'main:app',
+        '--host', args.host, '--port', str(args.app_port), '--log-level', 'warning', '--no-access-log',
+    ]
+    app_log = open(args.app_log, 'w') if args.app_log else subprocess.DEVNULL
+    return [
+        subprocess.Popen(stub_cmd),
+        subprocess.Popen(app_cmd, cwd=REPO_DIR, env=env, stdout=app_log, stderr=subprocess.STDOUT),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=10.0, help='Số request mỗi giây')
+    parser.add_argument('--duration', type=float, default=30.0, help='Thời gian bắn tải (giây)')
+    parser.add_argument('--warmup', type=int, default=5, help='Số request chạy trước, không tính vào kết quả')
+    parser.add_argument('--deadline', type=float, default=5.0, help='Hạn trả lời của Teams (giây)')
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'corpus.json'))
+    parser.add_argument('--url', help='Bắn vào app đang chạy sẵn (không khởi động stub/app)')
+    parser.add_argument('--app-port', type=int, default=8765)
+    parser.add_argument('--app-log', help='Ghi log của app ra file (mặc định bỏ)')
+    parser.add_argument('--output', help='Ghi kết quả JSON ra file (để so sánh giữa các lần chạy)')
+    parser.add_argument('--async-reply', action='store_true', help='Chế độ trả lời bất đồng bộ, đo thời gian tới khi sink nhận kết quả')
+    parser.add_argument('--reply-timeout', type=float, default=120.0, help='Thời gian tối đa chờ sink nhận đủ kết quả (giây)')
+    parser.add_argument('--cold-start', action='store_true', help='Bắn ngay khi app nhận request, không chờ cache tải xong')
+    parser.add_argument('--jira-cache-db', help='File snapshot cache Jira giữ qua các lần chạy (mặc định file tạm, luôn khởi động lạnh)')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = json.load(f)
+    total = max(1, int(args.rate * args.duration))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        processes = [] if args.url else start_processes(args, tmpdir)
+        base_url = args.url or f'http://{args.host}:{args.app_port}'
+        sink_url = f'http://{args.host}:{args.sink_port}/replies' if args.async_reply else None
+        try:
+            results, completions, wall_time, metrics_text = asyncio.run(replay(
+                base_url, corpus, args.rate, total, 0 if args.cold_start else args.warmup, sink_url,
+                args.reply_timeout, args.cold_start))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+    summary = report(results, wall_time, metrics_text, args.deadline, args.rate)
+    if completions is not None:
+        summary['async_reply'] = report_completions(completions)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
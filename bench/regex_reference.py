@@ -0,0 +1,98 @@
+"""
+Các regex cũ của quick_parse_fallback / clean_teams_message, giữ lại làm chuẩn so sánh cho text_scanner
+(chỉ dùng trong bench/fuzz_scanner.py và bench/scanner_bench.py, không dùng trong service)
+"""
+import html
+import re
+
+EPIC_PATTERNS = [
+    re.compile(r'epic\s+link\s+(?:đến|to)\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'epic\s+link\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'epic\s*[:\-=]\s*([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'link\s+(?:đến|to)\s+epic\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'epic\s+link\s+(?:đến|to)\s+([^\n]+?)(?:\n|$)', re.IGNORECASE),
+    re.compile(r'epic\s+link\s+([^\n]+?)(?:\n|$)', re.IGNORECASE),
+]
+ASSIGNEE_PATTERNS = [
+    re.compile(r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'gắn\s+cho\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'tạo\s+task\s+gắn\s+cho\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'gán\s+(?:task\s+này\s+)?cho\s+([^\n]+?)(?:\s+và\b|\s+and\b|\n|$)', re.IGNORECASE),
+    re.compile(r'assign\s+(?:to|for)?\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+    re.compile(r'assignee\s*[:\-=]\s*([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE),
+]
+TRAILING_WORDS_RE = re.compile(r'\s+(?:và|and|cho|to|for)\b.*$', re.IGNORECASE)
+ASSIGNEE_TAIL_RE = re.compile(r'\s+epic(?:\s+link)?\b.*$', re.IGNORECASE)
+EPIC_TAIL_RE = re.compile(r'\s+(?:gán|gắn|assign)\b.*$', re.IGNORECASE)
+PARENS_RE = re.compile(r'\s*\([^)]+\)')
+SUMMARY_TAIL_RE = re.compile(r'(?:\s*,)?\s+(?:(?:hãy\s+)?(?:gán|gắn)\s+(?:task\s+này\s+)?cho|assign(?:ee)?\b|epic\s+link|link\s+(?:đến|to)\s+epic|(?:mức\s+độ|độ\s+ưu\s+tiên|ưu\s+tiên|priority)\b).*$', re.IGNORECASE)
+
+AT_TAG_RE = re.compile(r'<at[^>]*>([^<]+)</at>')
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+ASSIGN_PHRASE_RE = re.compile(r'(?:gắn|gán)\s+(?:cho|task\s+này\s+cho)', re.IGNORECASE)
+ASSIGN_END_RE = re.compile(r'(?:\s+và\b|\s+and\b|epic\s+link|$)', re.IGNORECASE)
+ASSIGNEE_TEXT_PATTERNS = [
+    re.compile(r'tạo\s+task\s+gắn\s+cho\s+([^\n,<]+?)(?:\s+và\b|\s+and\b|epic|$)', re.IGNORECASE),
+    re.compile(r'gắn\s+cho\s+([^\n,<]+?)(?:\s+và\b|\s+and\b|epic|$)', re.IGNORECASE),
+    re.compile(r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,<]+?)(?:\s+và\b|\s+and\b|epic|$)', re.IGNORECASE),
+]
+ASSIGN_IN_CLEAN_RE = re.compile(r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,]+?)(?:\s+và\b|\s+and\b|$)', re.IGNORECASE)
+
+def extract_epic_and_assignee(text):
+    epic_link = None
+    assignee = None
+    for pattern in EPIC_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            epic_link = match.group(1).strip()
+            epic_link = EPIC_TAIL_RE.sub('', epic_link)
+            epic_link = TRAILING_WORDS_RE.sub('', epic_link)
+            epic_link = epic_link.strip('.,;:!?')
+            if epic_link:
+                break
+    for pattern in ASSIGNEE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            assignee = match.group(1).strip()
+            assignee = PARENS_RE.sub('', assignee)
+            assignee = ASSIGNEE_TAIL_RE.sub('', assignee)
+            assignee = TRAILING_WORDS_RE.sub('', assignee)
+            assignee = assignee.strip('.,;:!?')
+            if assignee and len(assignee) > 0:
+                break
+    return epic_link, assignee
+
+def find_assignee_in_text(text):
+    assignee = None
+    for pattern in ASSIGNEE_TEXT_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            assignee = match.group(1).strip()
+            assignee = HTML_TAG_RE.sub('', assignee)
+            assignee = html.unescape(assignee)
+            assignee = PARENS_RE.sub('', assignee).strip()
+            if assignee and len(assignee) > 2:
+                break
+    return assignee
+
+def assign_phrase_span(text):
+    match = ASSIGN_PHRASE_RE.search(text)
+    if not match:
+        return -1, -1
+    return match.end(), ASSIGN_END_RE.search(text, match.end()).start()
+
+def has_assign_instruction(text):
+    return bool(ASSIGN_IN_CLEAN_RE.search(text))
+
+def cut_summary_tail(summary):
+    return SUMMARY_TAIL_RE.sub('', summary)
+
+def remove_parens(value):
+    return PARENS_RE.sub('', value)
+
+def strip_tags(text):
+    return HTML_TAG_RE.sub('', text)
+
+def iter_mention_tags(text):
+    for match in AT_TAG_RE.finditer(text):
+        yield match.start(), match.end(), match.group(1)
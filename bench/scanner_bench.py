@@ -0,0 +1,98 @@
+"""
+Microbenchmark text_scanner so với các regex cũ (bench/regex_reference.py)
+
+- Message thường: text HTML của các payload trong bench/corpus.json
+- Input đối kháng: các dạng trong fuzz_scanner.adversarial_inputs ở nhiều độ dài; regex cũ chạy ở tiến trình con
+  và bị dừng sau --regex-limit giây (một số dạng mất hàng phút ngay với 1000 ký tự), độ dài lớn hơn thì bỏ qua
+
+    python bench/scanner_bench.py --sizes 1000 4000 16000 64000 --repeat 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import regex_reference as reference
+import text_scanner as scanner
+from fuzz_scanner import adversarial_inputs
+
+def run_all(module, text):
+    """Các hàm mà webhook gọi cho một message"""
+    module.extract_epic_and_assignee(text)
+    module.find_assignee_in_text(text)
+    module.assign_phrase_span(text)
+    module.has_assign_instruction(text)
+    module.cut_summary_tail(text.split('\n')[0])
+    module.strip_tags(text)
+    list(module.iter_mention_tags(text))
+
+def best_of(repeat, function, *args):
+    """Thời gian nhỏ nhất trong repeat lần chạy (giây)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_corpus(corpus, repeat):
+    def run_corpus(module):
+        for text in corpus:
+            run_all(module, text)
+    old = best_of(repeat, run_corpus, reference)
+    new = best_of(repeat, run_corpus, scanner)
+    per_message = 1e6 / len(corpus)
+    print(f"Corpus ({len(corpus)} message): regex {old * per_message:.1f}µs/message, scanner {new * per_message:.1f}µs/message")
+
+def _time_regex(text, connection):
+    connection.send(best_of(1, run_all, reference, text))
+
+def time_regex(text, limit):
+    """Thời gian của regex cũ, None nếu quá limit giây (tiến trình con bị dừng)"""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_time_regex, args=(text, sender))
+    process.start()
+    elapsed = receiver.recv() if receiver.poll(limit) else None
+    process.terminate()
+    process.join()
+    return elapsed
+
+def bench_adversarial(sizes, repeat, regex_limit):
+    names = [name for name, _ in adversarial_inputs(sizes[0])]
+    print(f"{'input':<40}" + ''.join(f"{size:>22}" for size in sizes))
+    print(f"{'':<40}" + ''.join(f"{'regex / scanner (ms)':>22}" for _ in sizes))
+    for index, name in enumerate(names):
+        cells = []
+        regex_too_slow = False
+        for size in sizes:
+            text = adversarial_inputs(size)[index][1]
+            new = best_of(repeat, run_all, scanner, text)
+            if regex_too_slow:
+                old_cell = 'skip'
+            else:
+                old = time_regex(text, regex_limit)
+                regex_too_slow = old is None
+                old_cell = f">{regex_limit * 1000:.0f}" if old is None else f"{old * 1000:.1f}"
+            cells.append(f"{old_cell} / {new * 1000:.1f}")
+        print(f"{name:<40}" + ''.join(f"{cell:>22}" for cell in cells), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'corpus.json'))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 16000, 64000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--regex-limit', type=float, default=2.0, help='Thời gian tối đa cho mỗi lần đo regex cũ (giây)')
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = json.load(f)
+    bench_corpus(corpus * 50, args.repeat)
+    bench_adversarial(args.sizes, args.repeat, args.regex_limit)
+
+if __name__ == '__main__':
+    main()
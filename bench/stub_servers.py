@@ -0,0 +1,295 @@
+"""
+Server giả lập Gemini (generateContent) và Jira REST v2 cho benchmark: độ trễ và tỉ lệ lỗi cấu hình được,
+kèm sink thay cho Teams nhận kết quả ở chế độ trả lời bất đồng bộ (REPLY_CALLBACK_URL)
+
+Chạy riêng:
+    python bench/stub_servers.py --gemini-port 9001 --jira-port 9002 --sink-port 9003 --gemini-latency 0.8 --jira-latency 0.15
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+import unicodedata
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+PROJECT_KEY = 'BENCH'
+
+EPICS = [
+    {'id': str(1000 + i), 'key': f'{PROJECT_KEY}-{1000 + i}', 'fields': {'summary': name, 'issuetype': {'name': 'Epic'}}}
+    for i, name in enumerate(['DX-AI', 'Mobile App', 'Payment Gateway', 'Data Platform', 'Internal Tools'])
+]
+
+USERS = [
+    {'name': username, 'key': username, 'displayName': display, 'emailAddress': f'{username}@example.com', 'active': True}
+    for username, display in [
+        ('anhld', 'Lê Đức Anh (KHN.SBU3.DEV)'),
+        ('hungnv', 'Nguyễn Văn Hùng (KHN.SBU3.DEV)'),
+        ('trangpt', 'Phạm Thu Trang (KHN.SBU3.QA)'),
+        ('minhtq', 'Trần Quang Minh (KHN.SBU1.DEV)'),
+        ('lanhnt', 'Nguyễn Thị Lan Hương (KHN.SBU3.BA)'),
+    ]
+]
+
+FIELDS = [
+    {'id': 'summary', 'name': 'Summary', 'schema': {'system': 'summary'}},
+    {'id': 'customfield_10014', 'name': 'Epic Link', 'schema': {'custom': 'com.pyxis.greenhopper.jira:gh-epic-link'}},
+    {'id': 'customfield_10104', 'name': 'Epic Name', 'schema': {'custom': 'com.pyxis.greenhopper.jira:gh-epic-label'}},
+]
+
+def add_filler_users(count):
+    """Danh bạ lớn: user directory của app mất nhiều trang /user/search để tải như với Jira thật"""
+    USERS.extend(
+        {'name': f'user{i:05d}', 'key': f'user{i:05d}', 'displayName': f'Bench User {i:05d} (KHN.BENCH)',
+         'emailAddress': f'user{i:05d}@example.com', 'active': True}
+        for i in range(count)
+    )
+
+PRIORITIES = [{'id': str(i), 'name': name} for i, name in enumerate(['Highest', 'High', 'Medium', 'Low', 'Lowest'], 1)]
+
+def _fold(text):
+    nfd = unicodedata.normalize('NFD', text)
+    return ''.join(c for c in nfd if unicodedata.category(c) != 'Mn').replace('đ', 'd').replace('Đ', 'D').lower()
+
+class Behaviour:
+    """Độ trễ (giây, phân phối chuẩn cắt ở 0), tỉ lệ lỗi 503 và quota đồng thời (429) của một server giả"""
+
+    def __init__(self, latency, jitter, error_rate, max_concurrency=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency  # > 0: request vượt số này đang xử lý đồng thời bị trả 429
+        self.in_flight = 0
+
+    @contextmanager
+    def admit(self):
+        """True nếu request được xử lý, False nếu vượt quota (handler trả 429 ngay)"""
+        self.in_flight += 1
+        try:
+            yield not self.max_concurrency or self.in_flight <= self.max_concurrency
+        finally:
+            self.in_flight -= 1
+
+    def sample(self):
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    async def delay(self):
+        await asyncio.sleep(self.sample())
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+# =============== GEMINI ===============
+EPIC_RE = re.compile(r'epic\s+link\s+(?:đến\s+|to\s+)?([^\n,:]+?)(?=\s+(?:gán|gắn|assign|và|and)\b|[\n,:]|$)', re.IGNORECASE)
+ASSIGN_RE = re.compile(r'(?:gán|gắn|assign)\s+(?:task\s+này\s+)?(?:cho|to)\s+([^\n,:]+?)(?=\s+(?:và|and|epic)\b|[\n,:]|$)', re.IGNORECASE)
+LIST_ITEM_RE = re.compile(r'^[ \t]*(?:[-*•+]|\d+[.)])[ \t]+(\S.*)$', re.MULTILINE)
+
+def fake_parse(text, header=''):
+    """Kết quả parse "giống Gemini" đủ để service đi hết luồng tạo issue"""
+    lowered = (header + ' ' + text).lower()
+    epic = EPIC_RE.search(text) or EPIC_RE.search(header)
+    assignee = ASSIGN_RE.search(text) or ASSIGN_RE.search(header)
+    # Theo propertyOrdering của schema: field ngắn trước, description sau cùng
+    return {
+        'summary': text.split('\n')[0][:100],
+        'issuetype': 'Bug' if ('bug' in lowered or 'lỗi' in lowered) else 'Task',
+        'priority': 'High' if ('gấp' in lowered or 'urgent' in lowered) else 'Medium',
+        'epic_link': epic.group(1) if epic else None,
+        'assignee': assignee.group(1).strip() if assignee else None,
+        'description': text,
+    }
+
+def candidate_response(text, prompt_tokens, model, finish_reason='STOP'):
+    return {
+        'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'finishReason': finish_reason, 'index': 0}],
+        'usageMetadata': {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': 80, 'totalTokenCount': prompt_tokens + 80},
+        'modelVersion': model,
+    }
+
+# Streaming: độ trễ tới token đầu là một phần của tổng độ trễ, phần còn lại chia đều cho từng đoạn
+STREAM_FIRST_TOKEN_SHARE = 0.3
+STREAM_CHUNK_CHARS = 24
+
+def gemini_app(behaviour):
+    app = FastAPI()
+
+    @app.post('/{version}/models/{model_action}')
+    async def generate_content(version: str, model_action: str, request: Request):
+        with behaviour.admit() as admitted:
+            if not admitted:
+                return JSONResponse({'error': {'code': 429, 'message': 'Resource has been exhausted', 'status': 'RESOURCE_EXHAUSTED'}}, status_code=429)
+            return await generate(model_action, await request.json())
+
+    async def generate(model_action, body):
+        streaming = model_action.endswith(':streamGenerateContent')
+        total_delay = behaviour.sample()
+        await asyncio.sleep(total_delay * STREAM_FIRST_TOKEN_SHARE if streaming else total_delay)
+        if behaviour.should_fail():
+            return JSONResponse({'error': {'code': 503, 'message': 'overloaded', 'status': 'UNAVAILABLE'}}, status_code=503)
+        prompt = ''.join(part.get('text', '') for content in body.get('contents', []) for part in content.get('parts', []))
+        text = prompt.rsplit('Text: "', 1)[-1].rstrip().rstrip('"')
+        schema = body.get('generationConfig', {}).get('responseSchema') or {}
+        if str(schema.get('type', '')).upper() == 'ARRAY':
+            header = text.split('\n')[0]
+            result = [fake_parse(item, header) for item in LIST_ITEM_RE.findall(text)] or [fake_parse(text)]
+        else:
+            result = fake_parse(text)
+        output = json.dumps(result, ensure_ascii=False)
+        model = model_action.split(':')[0]
+        if not streaming:
+            return candidate_response(output, len(prompt) // 4, model)
+
+        async def events():
+            chunks = [output[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(output), STREAM_CHUNK_CHARS)]
+            chunk_delay = total_delay * (1 - STREAM_FIRST_TOKEN_SHARE) / len(chunks)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(chunk_delay)
+                finish_reason = 'STOP' if i == len(chunks) - 1 else None
+                response = candidate_response(chunk, len(prompt) // 4, model, finish_reason)
+                yield f"data: {json.dumps(response, ensure_ascii=False)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type='text/event-stream')
+
+    return app
+
+# =============== JIRA ===============
+def jira_app(behaviour):
+    app = FastAPI()
+    counter = itertools.count(1)
+    issues = {epic['key']: epic for epic in EPICS}
+
+    @app.middleware('http')
+    async def latency_and_errors(request, call_next):
+        with behaviour.admit() as admitted:
+            if not admitted:
+                return JSONResponse({'errorMessages': ['Rate limit exceeded'], 'errors': {}}, status_code=429, headers={'Retry-After': '1'})
+            await behaviour.delay()
+            if behaviour.should_fail():
+                return JSONResponse({'errorMessages': ['Service Unavailable'], 'errors': {}}, status_code=503)
+            return await call_next(request)
+
+    def new_issue(fields):
+        number = next(counter)
+        key = f'{PROJECT_KEY}-{number}'
+        issues[key] = {'id': str(number), 'key': key, 'fields': {
+            'summary': fields.get('summary', ''), 'issuetype': fields.get('issuetype', {'name': 'Task'})}}
+        return {'id': str(number), 'key': key, 'self': f'/rest/api/2/issue/{number}'}
+
+    @app.post('/rest/api/2/issue')
+    async def create_issue(request: Request):
+        return JSONResponse(new_issue((await request.json())['fields']), status_code=201)
+
+    @app.post('/rest/api/2/issue/bulk')
+    async def create_issues(request: Request):
+        updates = (await request.json())['issueUpdates']
+        return JSONResponse({'issues': [new_issue(update['fields']) for update in updates], 'errors': []}, status_code=201)
+
+    @app.get('/rest/api/2/issue/{key}')
+    async def get_issue(key: str):
+        if key not in issues:
+            return JSONResponse({'errorMessages': ['Issue Does Not Exist'], 'errors': {}}, status_code=404)
+        return issues[key]
+
+    @app.put('/rest/api/2/issue/{key}')
+    async def update_issue(key: str, request: Request):
+        await request.json()
+        if key not in issues:
+            return JSONResponse({'errorMessages': ['Issue Does Not Exist'], 'errors': {}}, status_code=404)
+        return Response(status_code=204)
+
+    @app.post('/rest/api/2/search')
+    async def search(request: Request):
+        body = await request.json()
+        jql = body.get('jql', '')
+        start_at = body.get('startAt', 0)
+        matched = EPICS
+        term = re.search(r'summary ~ "([^"]*)"', jql) or re.search(r'key = "([^"]*)"', jql)
+        if term:
+            needle = _fold(term.group(1)).replace('-', '')
+            matched = [e for e in EPICS if needle in _fold(e['fields']['summary']).replace('-', '') or needle == _fold(e['key']).replace('-', '')]
+        page = matched[start_at:start_at + body.get('maxResults', 50)]
+        return {'startAt': start_at, 'maxResults': body.get('maxResults', 50), 'total': len(matched), 'issues': page}
+
+    @app.get('/rest/api/2/myself')
+    async def myself():
+        return USERS[0]
+
+    @app.get('/rest/api/2/user/search')
+    async def user_search(username: str, startAt: int = 0, maxResults: int = 50):
+        if username == '.':
+            matched = USERS
+        else:
+            needle = _fold(username)
+            matched = [u for u in USERS if needle in _fold(u['displayName']) or needle in u['name'] or needle in u['emailAddress']]
+        return matched[startAt:startAt + maxResults]
+
+    @app.get('/rest/api/2/field')
+    async def fields():
+        return FIELDS
+
+    @app.get('/rest/api/2/priority')
+    async def priorities():
+        return PRIORITIES
+
+    return app
+
+# =============== TEAMS (REPLY SINK) ===============
+def reply_sink_app():
+    """Nhận activity app POST tới callback URL, GET /replies trả về tất cả kèm thời điểm nhận (time.time())"""
+    app = FastAPI()
+    replies = []
+
+    @app.post('/replies')
+    async def receive(request: Request):
+        replies.append({'received_at': time.time(), 'activity': await request.json()})
+        return Response(status_code=202)
+
+    @app.get('/replies')
+    async def list_replies():
+        return replies
+
+    return app
+
+async def serve(gemini, jira, host, gemini_port, jira_port, sink_port):
+    servers = [
+        uvicorn.Server(uvicorn.Config(gemini_app(gemini), host=host, port=gemini_port, log_level='warning')),
+        uvicorn.Server(uvicorn.Config(jira_app(jira), host=host, port=jira_port, log_level='warning')),
+        uvicorn.Server(uvicorn.Config(reply_sink_app(), host=host, port=sink_port, log_level='warning')),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+def add_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--gemini-port', type=int, default=9001)
+    parser.add_argument('--jira-port', type=int, default=9002)
+    parser.add_argument('--sink-port', type=int, default=9003, help='Port của sink nhận kết quả bất đồng bộ')
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help='Độ trễ trung bình của Gemini (giây)')
+    parser.add_argument('--gemini-jitter', type=float, default=0.3)
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+    parser.add_argument('--gemini-max-concurrency', type=int, default=0, help='Quota đồng thời, vượt thì trả 429 (0 = không giới hạn)')
+    parser.add_argument('--jira-latency', type=float, default=0.15, help='Độ trễ trung bình mỗi request Jira (giây)')
+    parser.add_argument('--jira-jitter', type=float, default=0.05)
+    parser.add_argument('--jira-error-rate', type=float, default=0.0)
+    parser.add_argument('--jira-max-concurrency', type=int, default=0, help='Quota đồng thời, vượt thì trả 429 (0 = không giới hạn)')
+    parser.add_argument('--jira-users', type=int, default=0, help='Thêm user giả vào danh bạ Jira (danh bạ lớn như Jira thật)')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    add_filler_users(args.jira_users)
+    asyncio.run(serve(
+        Behaviour(args.gemini_latency, args.gemini_jitter, args.gemini_error_rate, args.gemini_max_concurrency),
+        Behaviour(args.jira_latency, args.jira_jitter, args.jira_error_rate, args.jira_max_concurrency),
+        args.host, args.gemini_port, args.jira_port, args.sink_port,
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Snapshot cache Jira (epic, user, field metadata) xuống SQLite: khởi động lại thì nạp snapshot và phục vụ ngay,
+đồng bộ với Jira sau ở background thay vì request đầu tiên phải chờ tải cache
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CacheSnapshot:
+    """Mỗi cache một dòng (JSON gọn); snapshot của Jira/project khác hoặc quá max_age giây thì bỏ qua"""
+
+    def __init__(self, db_path, source, max_age):
+        self.source = source  # Jira server + project key lúc ghi snapshot
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cache_snapshot ('
+            'name TEXT PRIMARY KEY, source TEXT NOT NULL, data TEXT NOT NULL, saved_at REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def load(self, name):
+        """Dữ liệu đã ghi của cache, None nếu chưa có hoặc không dùng được"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT source, data, saved_at FROM cache_snapshot WHERE name = ?', (name,)
+            ).fetchone()
+        if not row:
+            return None
+        source, data, saved_at = row
+        if source != self.source:
+            logger.info(f"💾 Bỏ qua snapshot {name}: ghi từ Jira/project khác")
+            return None
+        if time.time() - saved_at >= self.max_age:
+            logger.info(f"💾 Bỏ qua snapshot {name}: đã cũ ({(time.time() - saved_at) / 3600:.0f} giờ)")
+            return None
+        return json.loads(data)
+
+    def save(self, name, data):
+        """Ghi đè snapshot của cache (gọi trong thread riêng, không chặn event loop)"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO cache_snapshot (name, source, data, saved_at) VALUES (?, ?, ?, ?)',
+                (name, self.source, payload, time.time()),
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
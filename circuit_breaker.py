@@ -0,0 +1,111 @@
+"""
+Circuit breaker cho dependency chậm/lỗi (Gemini): khi tỉ lệ lỗi vượt ngưỡng thì ngắt mạch, request dùng
+đường dự phòng ngay thay vì chờ hết timeout; sau một khoảng thời gian cho một lần gọi thử để đóng mạch lại
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}  # Giá trị gauge cho /metrics
+
+class CircuitOpen(Exception):
+    """Mạch đang ngắt: không gọi dependency, caller dùng đường dự phòng"""
+
+    def __init__(self, name):
+        super().__init__(f"{name}: circuit breaker đang mở")
+        self.name = name
+
+class CircuitBreaker:
+    """closed -> open khi tỉ lệ lỗi trong window_size lần gọi gần nhất >= failure_ratio;
+    open -> half_open sau open_duration giây; half_open: một lần gọi thử, thành công thì closed, lỗi thì open lại.
+    Lỗi = exception (trừ các loại trong ignored), hoặc lần gọi kéo dài >= latency_threshold giây: bị hủy (timeout của
+    caller) hay thành công nhưng quá chậm đều tính là lỗi. Caller có ngân sách thời gian lớn hơn (chế độ bất đồng bộ)
+    truyền ngưỡng riêng cho lần gọi đó trong call()"""
+
+    def __init__(self, name, failure_ratio, window_size, min_calls, latency_threshold, open_duration, ignored=()):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.latency_threshold = latency_threshold
+        self.open_duration = open_duration
+        self.ignored = tuple(ignored)  # Exception không phản ánh sức khỏe dependency (ví dụ limiter từ chối)
+        self.state = CLOSED
+        self.opened = 0  # Số lần ngắt mạch (cộng dồn)
+        self.rejected = 0  # Số lần gọi bị chặn khi mạch mở (cộng dồn)
+        self._outcomes = deque(maxlen=window_size)  # True = lỗi
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        """Có được gọi dependency không (half_open: chỉ cho một lần gọi thử tại một thời điểm)"""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probing:
+            return True
+        return False
+
+    def check(self):
+        """Raise CircuitOpen nếu mạch đang mở (kiểm tra trước khi chờ lượt ở limiter)"""
+        if not self.allow():
+            self.rejected += 1
+            raise CircuitOpen(self.name)
+
+    @asynccontextmanager
+    async def call(self, latency_threshold=None):
+        """Bọc một lần gọi dependency; mạch mở thì raise CircuitOpen ngay.
+        Chỉ nên bọc chính lần gọi (không gồm thời gian chờ lượt ở limiter) vì thời gian được tính là độ trễ"""
+        self.check()
+        threshold = self.latency_threshold if latency_threshold is None else latency_threshold
+        probe = self.state == HALF_OPEN
+        if probe:
+            self._probing = True
+        start = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Bị hủy trước ngưỡng (ví dụ race với parser cục bộ) thì không tính là lỗi hay thành công
+            self._record(probe, True if time.monotonic() - start >= threshold else None)
+            raise
+        except self.ignored:
+            self._record(probe, None)
+            raise
+        except Exception:
+            self._record(probe, True)
+            raise
+        self._record(probe, time.monotonic() - start >= threshold)
+
+    def _record(self, probe, failed):
+        if probe:
+            self._probing = False
+            if failed is not None:
+                self._transition(OPEN if failed else CLOSED)
+            return
+        if failed is None or self.state != CLOSED:
+            return
+        self._outcomes.append(failed)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+            self._transition(OPEN)
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        if state == OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+            logger.warning(f"🔌 {self.name}: ngắt mạch {self.open_duration}s, dùng đường dự phòng")
+        elif state == CLOSED:
+            self._outcomes.clear()
+            logger.info(f"🔌 {self.name}: đã phục hồi, đóng mạch")
+        else:
+            logger.info(f"🔌 {self.name}: gọi thử sau khi ngắt mạch")
+        self.state = state
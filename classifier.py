@@ -0,0 +1,133 @@
+"""
+Classifier cục bộ cho issuetype/priority: mô hình tuyến tính (softmax) trên char n-gram đã hash,
+train offline từ output Gemini mà service ghi lại (train_classifier.py), lưu thành một file mảng float32
+"""
+import array
+import json
+import math
+import operator
+import random
+import sys
+import zlib
+
+MAGIC = b'JBCLF1\n'
+
+def _ordered(values):
+    """float32 little-endian trong file, đổi byte order nếu máy là big-endian"""
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+def normalize(text, max_chars):
+    return ' ' + ' '.join(text.lower().split())[:max_chars] + ' '
+
+def feature_indexes(text, dim, ngram_min, ngram_max, max_chars):
+    """Vị trí (đã hash) của các char n-gram xuất hiện trong text, mỗi n-gram tính một lần"""
+    padded = normalize(text, max_chars).encode('utf-8')
+    grams = {padded[i:i + n] for n in range(ngram_min, ngram_max + 1) for i in range(len(padded) - n + 1)}
+    return [zlib.crc32(gram) % dim for gram in grams]
+
+def softmax(scores):
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+class TextClassifier:
+    """Một bộ feature dùng chung cho nhiều head (issuetype, priority), mỗi head một ma trận (class x dim)"""
+
+    def __init__(self, heads, dim=1 << 15, ngram=(2, 4), max_chars=300):
+        self.heads = heads  # head -> danh sách label
+        self.dim = dim
+        self.ngram = tuple(ngram)
+        self.max_chars = max_chars
+        # head -> ([list dim phần tử cho từng class], list bias); trong bộ nhớ dùng list (đọc nhanh hơn array),
+        # trong file là float32
+        self.weights = {
+            head: ([[0.0] * dim for _ in labels], [0.0] * len(labels))
+            for head, labels in heads.items()
+        }
+
+    def features(self, text):
+        return feature_indexes(text, self.dim, self.ngram[0], self.ngram[1], self.max_chars)
+
+    def scores(self, head, indexes, gather=None):
+        if not indexes:
+            return list(self.weights[head][1])
+        rows, bias = self.weights[head]
+        scale = 1 / math.sqrt(len(indexes))
+        gather = gather or operator.itemgetter(*indexes)
+        if len(indexes) == 1:
+            return [b + scale * row[indexes[0]] for row, b in zip(rows, bias)]
+        return [b + scale * sum(gather(row)) for row, b in zip(rows, bias)]
+
+    def predict(self, text):
+        """{head: (label, xác suất)} cho text"""
+        indexes = self.features(text)
+        gather = operator.itemgetter(*indexes) if indexes else None
+        result = {}
+        for head, labels in self.heads.items():
+            probabilities = softmax(self.scores(head, indexes, gather))
+            best = max(range(len(labels)), key=probabilities.__getitem__)
+            result[head] = (labels[best], probabilities[best])
+        return result
+
+    def fit(self, examples, epochs=10, learning_rate=0.5, seed=0):
+        """SGD trên cross-entropy; examples = [(text, {head: label})], label ngoài danh sách thì bỏ qua head đó"""
+        rng = random.Random(seed)
+        prepared = [(self.features(text), labels) for text, labels in examples]
+        for epoch in range(epochs):
+            rng.shuffle(prepared)
+            rate = learning_rate / (1 + epoch)
+            for indexes, labels in prepared:
+                if not indexes:
+                    continue
+                scale = 1 / math.sqrt(len(indexes))
+                for head, head_labels in self.heads.items():
+                    if labels.get(head) not in head_labels:
+                        continue
+                    target = head_labels.index(labels[head])
+                    rows, bias = self.weights[head]
+                    probabilities = softmax(self.scores(head, indexes))
+                    for label_index, (row, probability) in enumerate(zip(rows, probabilities)):
+                        gradient = rate * ((1.0 if label_index == target else 0.0) - probability)
+                        bias[label_index] += gradient
+                        step = gradient * scale
+                        for index in indexes:
+                            row[index] += step
+
+    def save(self, path):
+        header = json.dumps({
+            'heads': self.heads, 'dim': self.dim, 'ngram': list(self.ngram), 'max_chars': self.max_chars,
+        }, ensure_ascii=False).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            for head in self.heads:
+                rows, bias = self.weights[head]
+                for values in [*rows, bias]:
+                    f.write(_ordered(array.array('f', values)).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} không phải file model của classifier")
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            model = cls.__new__(cls)
+            model.heads = header['heads']
+            model.dim = header['dim']
+            model.ngram = tuple(header['ngram'])
+            model.max_chars = header['max_chars']
+            model.weights = {}
+            for head, labels in model.heads.items():
+                rows = []
+                for _ in labels:
+                    row = array.array('f')
+                    row.fromfile(f, model.dim)
+                    rows.append(_ordered(row).tolist())
+                bias = array.array('f')
+                bias.fromfile(f, len(labels))
+                model.weights[head] = (rows, _ordered(bias).tolist())
+        return model
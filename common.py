@@ -3,40 +3,48 @@ Common module chứa messages, prompts và constants
 """
 
 # =============== PROMPTS ===============
-GEMINI_PARSE_PROMPT = """Parse JSON:
-{{
-  "summary": "copy exact title",
-  "issuetype": "Bug|Task|Epic|Improvement",
-  "description": "copy content",
-  "priority": "High|Medium|Low",
-  "epic_link": "epic key (e.g. PROJ-123) or epic name if mentioned in text, null if not",
-  "assignee": "username or email if mentioned in text, null if not"
-}}
-
-IMPORTANT RULES:
-1. issuetype: 
-   - "Epic" ONLY if text explicitly says "tạo Epic" or "create Epic" or "Epic:" at the start
-   - "Bug" if text has "Bug"|"lỗi"|"bug"
-   - "Task" for everything else (including when text says "epic link" or "link to epic" - that's just linking, not creating Epic)
-   
-2. epic_link: 
-   - Extract epic key (format: PROJ-123, DXAI-456) or epic name (e.g. "DXAI", "DX-AI") 
-   - Look for phrases like "epic link", "link to epic", "epic:", "epic=", "gán epic", "epic link đến"
-   - Examples: "epic link DXAI" -> epic_link: "DXAI", "epic link đến PROJ-123" -> epic_link: "PROJ-123"
-   - If epic_link exists, issuetype should be "Task" (not "Epic")
-   
-3. assignee:
-   - Extract when text says "assign to", "gán cho", "assignee:", "assign:", "gán task này cho"
-   - Extract name or email after these phrases
-   - Examples: "gán cho Lê Đức Anh" -> assignee: "Lê Đức Anh", "assign to john@example.com" -> assignee: "john@example.com"
+# Kiểu, enum và field bắt buộc do response schema ràng buộc; prompt chỉ còn các quy tắc schema không diễn tả được
+GEMINI_PARSE_PROMPT = """Extract one Jira issue from this Teams message (Vietnamese or English).
+- issuetype: "Epic" only if the text starts with "tạo Epic", "create Epic" or "Epic:". "epic link"/"link to epic" only links to an existing epic, so use "Task" there. "Bug" if it mentions "bug"/"lỗi", otherwise "Task".
+- epic_link: key or name after "epic link", "epic link đến", "link to epic", "epic:", "epic=". "epic link đến DX-AI và gán cho A" -> "DX-AI".
+- assignee: only the name or email after "gán cho", "gán task này cho", "assign to", "assignee:". Drop "(...)" and trailing words. "gán cho Lê Đức Anh (KHN.SBU3.DEV)" -> "Lê Đức Anh".
+- summary: the title without these instructions. description: the content without instruction lines.
 
 Text: "{text}"
 """
 
+GEMINI_BATCH_PARSE_PROMPT = """This Teams message lists several Jira issues. Return one object per listed item ("-", "*", "•", "1.", "2)"...); do not merge or skip items.
+- The type in the header applies to every item ("tạo 3 bug" -> "Bug"). Otherwise "Bug" if the item mentions "bug"/"lỗi", else "Task". Never "Epic" when epic_link is set.
+- epic_link / assignee written once in the header ("epic link DXAI", "gán cho Lê Đức Anh") apply to every item unless the item has its own. Assignee is only the name or email, without "(...)".
+
+Text: "{text}"
+"""
+
+ISSUE_TYPES = ['Task', 'Bug', 'Epic', 'Improvement']
+PRIORITIES = ['High', 'Medium', 'Low']
+
+# Response schema cho Gemini (OpenAPI subset): output luôn là JSON hợp lệ đúng kiểu, không cần parse/sửa lại
+GEMINI_TASK_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'summary': {'type': 'STRING', 'description': 'Exact title from the text'},
+        'issuetype': {'type': 'STRING', 'enum': ISSUE_TYPES},
+        'description': {'type': 'STRING', 'description': 'Content from the text'},
+        'priority': {'type': 'STRING', 'enum': PRIORITIES},
+        'epic_link': {'type': 'STRING', 'nullable': True, 'description': 'Epic key (PROJ-123) or epic name'},
+        'assignee': {'type': 'STRING', 'nullable': True, 'description': 'Name or email of the assignee'},
+    },
+    'required': ['summary', 'issuetype', 'description', 'priority', 'epic_link', 'assignee'],
+    'propertyOrdering': ['summary', 'issuetype', 'priority', 'epic_link', 'assignee', 'description'],
+}
+GEMINI_TASK_LIST_SCHEMA = {'type': 'ARRAY', 'items': GEMINI_TASK_SCHEMA}
+
 # =============== MESSAGES ===============
 class Messages:
     AI_PARSE_ERROR = "🤖 AI không thể phân tích nội dung."
     PROCESSING = "⏳ Đang xử lý yêu cầu của bạn..."
+    NOT_READY = "⏳ Bot đang kết nối tới Jira, vui lòng thử lại sau ít phút."
+    OVERLOADED = "🚦 Bot đang quá tải, vui lòng thử lại sau ít phút."
     
     @staticmethod
     def success(issue_type, issue_key, issue_url, summary):
@@ -46,6 +54,24 @@ class Messages:
             f"• **Tiêu đề**: {summary}"
         )
     
+    @staticmethod
+    def batch_success(created, failed=None, skipped=0):
+        lines = [f"✅ Đã tạo {len(created)} issue thành công!"]
+        for issue in created:
+            lines.append(f"• **{issue['issuetype']}** [{issue['key']}]({issue['url']}): {issue['summary']}")
+        if failed:
+            lines.append(f"❌ Không tạo được {len(failed)} issue:")
+            for summary, error_msg in failed:
+                lines.append(f"• {summary}: {error_msg}")
+        if skipped:
+            lines.append(Messages.batch_skipped(skipped))
+        return "\n\n".join(lines)
+
+    @staticmethod
+    def batch_skipped(skipped):
+        return (f"⚠️ Bỏ qua {skipped} mục cuối: mỗi message tạo tối đa {Config.BATCH_MAX_ISSUES} issue, "
+                f"hãy gửi các mục còn lại trong message khác.")
+    
     @staticmethod
     def error(error_msg):
         return f"❌ Có lỗi xảy ra: {error_msg}"
@@ -54,4 +80,71 @@ class Messages:
 class Config:
     AI_TIMEOUT = 2.8  # 2.8s cho AI (để dư thời gian cho Jira)
     WEBHOOK_RESPONSE_TIMEOUT = 4.9  # Tổng <5s
+    FAST_PATH_CONFIDENCE = 0.8  # Parser cục bộ đạt ngưỡng này thì bỏ qua Gemini
+    FAST_PATH_MAX_LENGTH = 200  # Message dài hơn coi như không "đúng mẫu"
+    FAST_PATH_RACE = False  # Race Gemini với kết quả cục bộ
+    FAST_PATH_RACE_MIN_CONFIDENCE = 0.5  # Chỉ race khi kết quả cục bộ đủ dùng
+    FAST_PATH_RACE_WINDOW = 1.0  # Thời gian tối đa chờ Gemini khi race
+    CLASSIFIER_MIN_PROBABILITY = 0.6  # Classifier dưới ngưỡng này thì giữ loại/priority theo từ khóa
+    CLASSIFIER_CONFIDENT_PROBABILITY = 0.9  # Classifier trên ngưỡng này thì cộng điểm tin cậy cho fast path
+    STREAM_PARSE = False  # Gemini streaming: tạo issue khi có summary/issuetype/priority/epic link, description/assignee cập nhật sau
+    STREAM_REST_TIMEOUT = 15  # Thời gian tối đa chờ phần còn lại của stream sau khi đã tạo issue
+    STREAM_FOLLOWUP_DRAIN_TIMEOUT = 5  # Lúc tắt: chờ các cập nhật sau stream tối đa 5s rồi hủy
+    ASYNC_AI_TIMEOUT = 25  # Chế độ trả lời bất đồng bộ: AI không bị giới hạn bởi 5s của Teams
+    ASYNC_PROCESS_TIMEOUT = 60  # Tổng thời gian xử lý một message ở chế độ bất đồng bộ
+    REPLY_WORKERS = 16  # Số message xử lý song song ở chế độ bất đồng bộ
+    REPLY_HTTP_TIMEOUT = 10  # Timeout POST kết quả tới callback URL
     BOT_MENTION_NAME = "JiraBot"
+    JIRA_HTTP_TIMEOUT = 10  # Timeout mặc định cho mỗi lần gọi Jira (background)
+    JIRA_MAX_CONNECTIONS = 20  # Số connection keep-alive tối đa tới Jira
+    # Limiter: token bucket + giới hạn đồng thời AIMD (giảm một nửa khi gặp 429/chậm hơn ngưỡng, tăng dần khi ổn định)
+    GEMINI_RATE_LIMIT = 10  # Số lần gọi Gemini tối đa mỗi giây
+    GEMINI_BURST = 20
+    GEMINI_CONCURRENCY = 8  # Giới hạn đồng thời ban đầu, tự điều chỉnh trong [LIMITER_MIN_CONCURRENCY, GEMINI_MAX_CONCURRENCY]
+    GEMINI_MAX_CONCURRENCY = 64
+    GEMINI_LATENCY_TARGET = 8.0  # Chỉ coi là quá tải khi chậm hẳn (timeout 2.8s đã cắt các lần gọi chậm vừa)
+    GEMINI_QUEUE_TIMEOUT = 0.5  # Chờ lượt gọi Gemini tối thiểu 0.5s, quá thì dùng parser cục bộ luôn
+    GEMINI_QUEUE_SHARE = 0.2  # Thời gian chờ lượt tối đa bằng 20% ngân sách AI (bất đồng bộ 25s -> chờ được 5s)
+    JIRA_RATE_LIMIT = 20  # Số lần gọi Jira tối đa mỗi giây
+    JIRA_BURST = 40
+    JIRA_CONCURRENCY = 10  # Giới hạn đồng thời ban đầu, tối đa JIRA_MAX_CONNECTIONS
+    JIRA_LATENCY_TARGET = 3.0
+    # Tải cache nền (epic, user, field) đi qua limiter riêng: trang chậm/429 của nó không làm giảm limit của webhook
+    JIRA_BACKGROUND_RATE_LIMIT = 10  # Các trang tải tuần tự nên hiếm khi chạm giới hạn này
+    JIRA_BACKGROUND_CONCURRENCY = 2
+    JIRA_BACKGROUND_MAX_CONCURRENCY = 4
+    LIMITER_MIN_CONCURRENCY = 1
+    LIMITER_MAX_QUEUE = 200  # Số lần gọi chờ lượt tối đa, quá thì từ chối ngay (trả lời "quá tải")
+    GEMINI_BREAKER_FAILURE_RATIO = 0.5  # Ngắt mạch khi >= 50% số lần gọi gần nhất lỗi/timeout
+    GEMINI_BREAKER_WINDOW = 20  # Số lần gọi gần nhất được xét
+    GEMINI_BREAKER_MIN_CALLS = 5  # Chưa đủ số lần gọi này thì không ngắt mạch
+    GEMINI_BREAKER_LATENCY_THRESHOLD = 2.5  # Lần gọi mất >= 2.5s (bị hủy do timeout hoặc thành công nhưng chậm) tính là lỗi; hủy sớm hơn (race) thì không
+    GEMINI_BREAKER_LATENCY_SHARE = 0.9  # Ngân sách AI lớn hơn (bất đồng bộ 25s): chậm = mất >= 90% ngân sách của caller
+    GEMINI_BREAKER_OPEN_DURATION = 15  # Giây ngắt mạch trước khi cho một lần gọi thử
+    JIRA_CONNECT_TIMEOUT = 5  # Timeout kiểm tra kết nối Jira (GET /myself)
+    JIRA_HEALTH_CHECK_INTERVAL = 30  # Giây giữa hai lần kiểm tra kết nối Jira
+    JIRA_HEALTH_MAX_FAILURES = 3  # Số lần kiểm tra lỗi liên tiếp trước khi tạo lại client Jira
+    RECONNECT_BASE_DELAY = 1  # Giây, nhân đôi sau mỗi lần kết nối lại thất bại
+    RECONNECT_MAX_DELAY = 60  # Tối đa 1 phút giữa hai lần kết nối lại
+    CACHE_RETRY_DELAY = 30  # Tải cache lỗi thì thử lại sau 30s thay vì chờ hết TTL
+    INLINE_RESOLVE_TIMEOUT = 0.5  # Thời gian tối đa tìm epic/assignee trên Jira trước khi tạo issue
+    JIRA_CREATE_RESERVE = 1.5  # Thời gian luôn chừa lại cho create_issue
+    BATCH_MAX_ISSUES = 50  # Số issue tối đa tạo từ một message (giới hạn của Jira bulk create)
+    EPIC_INDEX_TTL = 300  # 5 phút đồng bộ epic mới cập nhật một lần
+    EPIC_INDEX_FULL_RELOAD = 3600  # 1 giờ tải lại toàn bộ (để loại epic đã xóa)
+    USER_DIRECTORY_TTL = 1800  # 30 phút tải lại danh bạ user
+    FIELD_METADATA_TTL = 3600  # 1 giờ tải lại fields/priorities
+    LOOKUP_NEGATIVE_TTL = 60  # Epic/user không tìm thấy trên Jira: 1 phút không tìm lại
+    CACHE_SNAPSHOT_MAX_AGE = 7 * 86400  # Snapshot cache Jira cũ hơn 7 ngày thì bỏ, tải lại từ đầu
+    CACHE_SNAPSHOT_RECONCILE_DELAY = 30  # Snapshot đã quá hạn: đồng bộ với Jira sau 30s kể từ khi khởi động
+    PROFILE_INTERVAL = 0.005  # /admin/profile lấy mẫu stack mỗi 5ms
+    PROFILE_DEFAULT_SECONDS = 10  # Không truyền seconds/requests thì profile 10s
+    PROFILE_MAX_SECONDS = 300  # Profile theo số request dừng sau tối đa 5 phút dù chưa đủ request
+    IDEMPOTENCY_TTL = 86400  # Giữ kết quả webhook 1 ngày để chống Teams gửi lại
+    IDEMPOTENCY_CONTENT_TTL = 600  # Message không có activity id (key hash nội dung): chỉ chống gửi lại trong 10 phút
+    IDEMPOTENCY_PRUNE_INTERVAL = 300  # Dọn kết quả hết hạn trong SQLite mỗi 5 phút
+    IDEMPOTENCY_MAX_ENTRIES = 10000  # Số kết quả tối đa giữ trong bộ nhớ
+    JOB_WORKERS = 4  # Số worker xử lý job cập nhật song song (giới hạn tải lên Jira)
+    JOB_MAX_ATTEMPTS = 6  # Số lần thử tối đa khi Jira lỗi tạm thời (429, 5xx)
+    JOB_RETRY_BASE_DELAY = 2  # Giây, nhân đôi sau mỗi lần thử lại
+    JOB_RETRY_MAX_DELAY = 300  # Tối đa 5 phút giữa hai lần thử
@@ -0,0 +1,140 @@
+"""
+Idempotency cho webhook: Teams gửi lại cùng một message thì không tạo issue lần nữa
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def idempotency_key(activity):
+    """Key theo activity id của Teams, không có thì hash nội dung (channel + người gửi + text)"""
+    activity_id = activity.get('id')
+    if activity_id:
+        return f"activity:{activity_id}"
+    channel_id = (activity.get('channelData') or {}).get('channel', {}).get('id', '')
+    sender_id = (activity.get('from') or {}).get('id', '')
+    digest = hashlib.sha256(f"{channel_id}\n{sender_id}\n{activity.get('text', '')}".encode('utf-8')).hexdigest()
+    return f"content:{digest}"
+
+class IdempotencyStore:
+    """Kết quả đã xử lý theo key: LRU trong bộ nhớ (có giới hạn) + SQLite tùy chọn.
+    Đọc/ghi SQLite chạy trong thread riêng (to_thread), không chặn event loop"""
+
+    def __init__(self, max_entries, ttl, db_path=None, content_ttl=None, prune_interval=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Key hash nội dung chỉ cần chống Teams gửi lại (vài phút): người dùng gửi lại đúng câu đó sau này là yêu cầu mới
+        self.content_ttl = ttl if content_ttl is None else content_ttl
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._entries = OrderedDict()  # key -> (created_at, result)
+        self._inflight = {}  # key -> asyncio.Task của lần xử lý đầu tiên
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS idempotency ('
+                'key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    def _ttl(self, key):
+        return self.content_ttl if key.startswith('content:') else self.ttl
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry:
+            if time.time() - entry[0] < self._ttl(key):
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+        return None
+
+    async def get(self, key):
+        """Kết quả đã lưu cho key (None nếu chưa có hoặc đã hết hạn)"""
+        cached = self._get_memory(key)
+        if cached is not None:
+            return cached
+        return await self._get_stored(key)
+
+    async def _get_stored(self, key):
+        if self._db:
+            now = time.time()
+            row = await asyncio.to_thread(self._load, key)
+            if row and now - row[1] < self._ttl(key):
+                result = json.loads(row[0])
+                self._remember(key, row[1], result)
+                return result
+        return None
+
+    async def put(self, key, result):
+        created_at = time.time()
+        self._remember(key, created_at, result)
+        if self._db:
+            await asyncio.to_thread(self._store, key, json.dumps(result, ensure_ascii=False), created_at)
+
+    def _load(self, key):
+        with self._db_lock:
+            return self._db.execute('SELECT result, created_at FROM idempotency WHERE key = ?', (key,)).fetchone()
+
+    def _store(self, key, payload, created_at):
+        with self._db_lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO idempotency (key, result, created_at) VALUES (?, ?, ?)',
+                (key, payload, created_at),
+            )
+            # Dọn key hết hạn theo chu kỳ thay vì mỗi lần ghi (DELETE quét cả bảng)
+            if created_at - self._last_prune >= self.prune_interval:
+                self._last_prune = created_at
+                self._db.execute(
+                    "DELETE FROM idempotency WHERE created_at < ? OR (key LIKE 'content:%' AND created_at < ?)",
+                    (created_at - self.ttl, created_at - self.content_ttl),
+                )
+            self._db.commit()
+
+    def _remember(self, key, created_at, result):
+        self._entries[key] = (created_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def run(self, key, factory, timeout):
+        """Chạy factory() một lần cho mỗi key; lần gửi lại chờ kết quả của lần đầu hoặc lấy từ cache"""
+        # Kiểm tra bộ nhớ và đăng ký task không qua await nào: lần gửi lại đến giữa chừng luôn thấy một trong hai
+        cached = self._get_memory(key)
+        if cached is not None:
+            logger.info(f"♻️ Message đã xử lý ({key}), trả lại kết quả cũ")
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            # Chạy tách khỏi request: webhook timeout thì lần xử lý vẫn chạy tiếp để lần gửi lại dùng
+            task = asyncio.ensure_future(self._execute(key, factory))
+            self._inflight[key] = task
+        else:
+            logger.info(f"⏳ Message đang được xử lý ({key}), chờ kết quả lần đầu")
+        return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+
+    async def _execute(self, key, factory):
+        try:
+            # Kết quả từ lần chạy trước (SQLite) đọc trong task đã đăng ký ở _inflight
+            cached = await self._get_stored(key)
+            if cached is not None:
+                logger.info(f"♻️ Message đã xử lý ({key}), trả lại kết quả cũ")
+                return cached
+            result = await factory()
+            # Chỉ lưu kết quả thành công, lỗi thì lần gửi lại được xử lý lại
+            if result.get('success'):
+                await self.put(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
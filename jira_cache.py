@@ -0,0 +1,399 @@
+"""
+Cache dữ liệu Jira trong bộ nhớ (epic, user, field metadata) để tránh gọi Jira cho mỗi request
+"""
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+PARENS_RE = re.compile(r'\s*\([^)]+\)')
+WHITESPACE_RE = re.compile(r'\s+')
+TOKEN_SPLIT_RE = re.compile(r'[\s._@-]+')
+
+def remove_accents(text):
+    """Bỏ dấu tiếng Việt (kể cả đ -> d)"""
+    if text.isascii():
+        # Username/email thường không dấu: bỏ qua NFD (nạp danh bạ lớn từ snapshot nhanh hơn)
+        return text
+    nfd = unicodedata.normalize('NFD', text)
+    return ''.join(c for c in nfd if unicodedata.category(c) != 'Mn').replace('đ', 'd').replace('Đ', 'D')
+
+def clean_person_name(text):
+    """Bỏ non-breaking space, phần trong ngoặc đơn (như "(KHN.SBU3.DEV)") và khoảng trắng thừa"""
+    text = text.replace('\xa0', ' ')
+    text = PARENS_RE.sub('', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def normalize_epic_name(text):
+    """Chuẩn hóa tên epic: viết hoa, bỏ '-' và '_' (DX-AI -> DXAI)"""
+    return text.upper().replace('-', '').replace('_', '')
+
+def epic_record(issue):
+    """Chuyển issue JSON của Jira thành record gọn: {id, key, summary}"""
+    return {'id': issue['id'], 'key': issue['key'], 'summary': issue['fields']['summary']}
+
+class EpicIndex:
+    """Index toàn bộ Epic của project theo key, summary và summary chuẩn hóa"""
+    PAGE_SIZE = 100
+
+    def __init__(self, project_key, ttl, full_reload_interval):
+        self.project_key = project_key
+        self.ttl = ttl
+        self.full_reload_interval = full_reload_interval
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_summary = {}
+        self._by_normalized = {}
+        self._last_sync = None
+        self._last_full_sync = None
+
+    @property
+    def loaded(self):
+        return self._last_full_sync is not None
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def add(self, record):
+        """Thêm/cập nhật một epic (gỡ các key cũ nếu epic đã đổi tên)"""
+        with self._lock:
+            self._add_locked(record)
+
+    def _add_locked(self, record):
+        old = self._by_key.get(record['key'].upper())
+        if old and old['summary'] != record['summary']:
+            summary_upper = old['summary'].upper()
+            if self._by_summary.get(summary_upper) is old:
+                del self._by_summary[summary_upper]
+            normalized = normalize_epic_name(old['summary'])
+            if self._by_normalized.get(normalized) is old:
+                del self._by_normalized[normalized]
+        self._by_key[record['key'].upper()] = record
+        self._by_summary[record['summary'].upper()] = record
+        self._by_normalized[normalize_epic_name(record['summary'])] = record
+
+    def lookup(self, identifier):
+        """Tìm epic trong index (không gọi Jira), trả về record hoặc None"""
+        if not identifier:
+            return None
+        identifier_upper = identifier.strip().upper()
+        normalized = normalize_epic_name(identifier_upper)
+
+        record = (self._by_key.get(identifier_upper)
+                  or self._by_summary.get(identifier_upper)
+                  or self._by_normalized.get(normalized))
+        if record or not normalized:
+            return record
+
+        # Không khớp chính xác: lấy epic có summary chứa identifier (ngắn nhất = gần nhất)
+        best = None
+        for summary_normalized, candidate in list(self._by_normalized.items()):
+            if normalized in summary_normalized:
+                if best is None or len(candidate['summary']) < len(best['summary']):
+                    best = candidate
+        return best
+
+    def snapshot(self):
+        """Dữ liệu để ghi snapshot (cache_snapshot.py)"""
+        return {'epics': list(self._by_key.values()), 'last_sync': self._last_sync, 'last_full_sync': self._last_full_sync}
+
+    def restore(self, data):
+        """Nạp lại từ snapshot; lần refresh sau chỉ tải epic cập nhật từ lúc snapshot (hoặc toàn bộ nếu đã quá hạn)"""
+        by_key, by_summary, by_normalized = {}, {}, {}
+        for record in data['epics']:
+            by_key[record['key'].upper()] = record
+            by_summary[record['summary'].upper()] = record
+            by_normalized[normalize_epic_name(record['summary'])] = record
+        with self._lock:
+            self._by_key, self._by_summary, self._by_normalized = by_key, by_summary, by_normalized
+            self._last_sync, self._last_full_sync = data['last_sync'], data['last_full_sync']
+
+    async def refresh(self, jira):
+        """Đồng bộ index: lần đầu (và định kỳ) tải toàn bộ, các lần sau chỉ tải epic mới cập nhật"""
+        started = time.time()
+        full = (self._last_full_sync is None
+                or started - self._last_full_sync >= self.full_reload_interval)
+
+        jql = f'project = {self.project_key} AND issuetype = Epic'
+        if not full:
+            # Dùng thời gian tương đối để không phụ thuộc timezone của Jira, dư 1 phút cho chắc
+            minutes = math.ceil((started - self._last_sync) / 60) + 1
+            jql += f' AND updated >= "-{minutes}m"'
+        jql += ' ORDER BY key'
+
+        records = []
+        start_at = 0
+        while True:
+            page = await jira.search_issues(jql, start_at=start_at, max_results=self.PAGE_SIZE, fields='summary')
+            issues = page.get('issues', [])
+            records.extend(epic_record(issue) for issue in issues)
+            start_at += len(issues)
+            if not issues or start_at >= page.get('total', 0):
+                break
+
+        with self._lock:
+            if full:
+                # Dựng index mới rồi mới thay thế, request đang đọc không thấy index rỗng
+                by_key, by_summary, by_normalized = {}, {}, {}
+                for record in records:
+                    by_key[record['key'].upper()] = record
+                    by_summary[record['summary'].upper()] = record
+                    by_normalized[normalize_epic_name(record['summary'])] = record
+                self._by_key, self._by_summary, self._by_normalized = by_key, by_summary, by_normalized
+                self._last_full_sync = started
+            else:
+                for record in records:
+                    self._add_locked(record)
+            self._last_sync = started
+
+        logger.info(f"📚 Epic index {'tải toàn bộ' if full else 'cập nhật'}: {len(records)} epic (tổng {len(self._by_key)})")
+
+def user_record(user):
+    """Chuyển user JSON của Jira thành record gọn"""
+    return {
+        'name': user.get('name'),
+        'key': user.get('key'),
+        'accountId': user.get('accountId'),
+        'displayName': user.get('displayName'),
+        'emailAddress': user.get('emailAddress'),
+    }
+
+def _user_entry(record):
+    """Tính sẵn các dạng chuẩn hóa của user để so khớp nhanh"""
+    display = clean_person_name(record.get('displayName') or '').lower()
+    email = (record.get('emailAddress') or '').lower()
+    name = (record.get('name') or '').lower()
+    display_folded = remove_accents(display)
+    tokens = set(display_folded.split())
+    tokens.update(t for t in TOKEN_SPLIT_RE.split(remove_accents(name)) if t)
+    tokens.update(t for t in TOKEN_SPLIT_RE.split(email.split('@')[0]) if t)
+    return {
+        'user': record,
+        'display': display,
+        'display_folded': display_folded,
+        'display_tokens': frozenset(display.split()),
+        'email': email,
+        'email_local': email.split('@')[0],
+        'name': name,
+        'name_folded': remove_accents(name),
+        'tokens': frozenset(tokens),
+    }
+
+def _score_user(entry, query, query_folded):
+    """Chấm điểm mức độ khớp giữa query (đã clean, lowercase) và một user"""
+    if not query:
+        return 0
+    if query == entry['display']:
+        return 100
+    if query_folded == entry['display_folded']:
+        return 95
+    if query in (entry['email'], entry['email_local'], entry['name']) or query_folded == entry['name_folded']:
+        return 90
+    if set(query.split()).issubset(entry['display_tokens']):
+        return 85
+    if set(query_folded.split()).issubset(entry['tokens']):
+        return 80
+    if query in entry['display'] or query_folded in entry['display_folded']:
+        return 70
+    if (entry['email'] and query in entry['email']) or (entry['name'] and query in entry['name']):
+        return 60
+    if all(any(token.startswith(q) for token in entry['tokens']) for q in query_folded.split()):
+        return 50
+    return 0
+
+def rank_users(records, query):
+    """Chọn user khớp nhất trong danh sách (dùng cho kết quả search_users của Jira)"""
+    query = clean_person_name(query).lower()
+    query_folded = remove_accents(query)
+    best, best_score = None, 0
+    for record in records:
+        score = _score_user(_user_entry(record), query, query_folded)
+        if score > best_score:
+            best, best_score = record, score
+    return best
+
+class UserDirectory:
+    """Danh bạ user Jira trong bộ nhớ, index theo token và prefix (đã bỏ dấu)"""
+    PAGE_SIZE = 1000
+    MIN_PREFIX = 2
+    CONFIDENT_SCORE = 90
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = []
+        self._prefix_index = {}
+        self._known = set()  # (name, accountId) của các user đã có trong danh bạ
+        self._last_sync = None
+
+    @property
+    def loaded(self):
+        return self._last_sync is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _identity(record):
+        return record.get('name'), record.get('accountId')
+
+    def _prefixes(self, entry):
+        return {token[:end] for token in entry['tokens'] for end in range(min(self.MIN_PREFIX, len(token)), len(token) + 1)}
+
+    def _index_entry(self, entries, prefix_index, entry):
+        entry_id = len(entries)
+        entries.append(entry)
+        for prefix in self._prefixes(entry):
+            prefix_index.setdefault(prefix, set()).add(entry_id)
+
+    def add(self, records):
+        """Thêm user tìm được qua Jira search vào danh bạ (tại chỗ, chỉ tốn theo số user mới)"""
+        with self._lock:
+            for record in records:
+                identity = self._identity(record)
+                if identity in self._known:
+                    continue
+                self._known.add(identity)
+                # Sửa index tại chỗ: add và lookup cùng chạy trên event loop (không xen giữa nhau),
+                # refresh/restore dựng index mới rồi mới thay nên không đụng tới index đang dùng
+                self._index_entry(self._entries, self._prefix_index, _user_entry(record))
+
+    def lookup(self, query):
+        """Tìm user trong danh bạ (không gọi Jira), trả về record hoặc None nếu không chắc chắn"""
+        query = clean_person_name(query or '').lower()
+        query_folded = remove_accents(query)
+        # Email chỉ index phần trước @
+        query_tokens = [t for t in TOKEN_SPLIT_RE.split(query_folded.split('@')[0]) if t]
+        if not query_tokens:
+            return None
+
+        entries, prefix_index = self._entries, self._prefix_index
+        candidates = None
+        for token in query_tokens:
+            ids = prefix_index.get(token, set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return None
+
+        scored = sorted(
+            ((_score_user(entries[i], query, query_folded), len(entries[i]['tokens']), i) for i in candidates),
+            key=lambda item: (-item[0], item[1], item[2]),
+        )
+        if not scored or scored[0][0] == 0:
+            return None
+        best_score = scored[0][0]
+        # Không khớp chính xác mà có nhiều user ngang điểm (ví dụ chỉ "Anh") thì không đoán, để Jira quyết định
+        if best_score < self.CONFIDENT_SCORE and len(scored) > 1 and scored[1][0] == best_score:
+            return None
+        return entries[scored[0][2]]['user']
+
+    def snapshot(self):
+        """Dữ liệu để ghi snapshot, gồm cả user tìm được qua Jira search từ lần tải gần nhất"""
+        return {'users': [entry['user'] for entry in self._entries], 'last_sync': self._last_sync}
+
+    def restore(self, data):
+        entries, prefix_index = [], {}
+        for record in data['users']:
+            self._index_entry(entries, prefix_index, _user_entry(record))
+        with self._lock:
+            self._entries, self._prefix_index = entries, prefix_index
+            self._known = {self._identity(entry['user']) for entry in entries}
+            self._last_sync = data['last_sync']
+
+    async def refresh(self, jira):
+        """Tải lại toàn bộ user active từ Jira (Jira Server: username "." trả về mọi user)"""
+        started = time.time()
+        records = []
+        start_at = 0
+        while True:
+            page = await jira.search_users('.', start_at=start_at, max_results=self.PAGE_SIZE)
+            records.extend(user_record(user) for user in page)
+            start_at += len(page)
+            if len(page) < self.PAGE_SIZE:
+                break
+
+        entries, prefix_index = [], {}
+        for record in records:
+            self._index_entry(entries, prefix_index, _user_entry(record))
+        with self._lock:
+            self._entries, self._prefix_index = entries, prefix_index
+            self._known = {self._identity(entry['user']) for entry in entries}
+            self._last_sync = started
+
+        logger.info(f"👥 User directory: đã tải {len(entries)} user")
+
+class FieldMetadata:
+    """Map tên logic (Epic Link, Epic Name, Parent Link) -> field id và priority name -> id"""
+    # Custom field type của Jira Software / Portfolio, ổn định hơn tên hiển thị (có thể bị dịch)
+    FIELD_SCHEMAS = {
+        'epic_link': 'com.pyxis.greenhopper.jira:gh-epic-link',
+        'epic_name': 'com.pyxis.greenhopper.jira:gh-epic-label',
+        'parent_link': 'com.atlassian.jpo:jpo-custom-field-parent',
+    }
+    FIELD_NAMES = {
+        'epic_link': 'epic link',
+        'epic_name': 'epic name',
+        'parent_link': 'parent link',
+    }
+    # Giá trị dùng khi chưa tải được metadata (field phổ biến nhất)
+    DEFAULT_FIELD_IDS = {
+        'epic_link': 'customfield_10014',
+        'epic_name': 'customfield_10104',
+    }
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._field_ids = {}
+        self._priority_ids = {}
+        self._last_sync = None
+
+    @property
+    def loaded(self):
+        return self._last_sync is not None
+
+    def field_id(self, logical_name):
+        """Field id theo tên logic ('epic_link', 'epic_name', 'parent_link'), None nếu không có"""
+        if logical_name in self._field_ids:
+            return self._field_ids[logical_name]
+        return None if self.loaded else self.DEFAULT_FIELD_IDS.get(logical_name)
+
+    def priority_id(self, name):
+        """Priority id theo tên (không phân biệt hoa thường), None nếu không có"""
+        return self._priority_ids.get((name or '').lower())
+
+    def snapshot(self):
+        return {'field_ids': self._field_ids, 'priority_ids': self._priority_ids, 'last_sync': self._last_sync}
+
+    def restore(self, data):
+        with self._lock:
+            self._field_ids, self._priority_ids = data['field_ids'], data['priority_ids']
+            self._last_sync = data['last_sync']
+
+    async def ensure_loaded(self, jira):
+        """Tải metadata nếu chưa có (dùng khi lúc khởi động Jira chưa sẵn sàng)"""
+        if not self.loaded:
+            await self.refresh(jira)
+
+    async def refresh(self, jira):
+        """Tải lại danh sách fields và priorities từ Jira"""
+        field_ids = {}
+        for field in await jira.fields():
+            custom_type = (field.get('schema') or {}).get('custom')
+            name = (field.get('name') or '').lower()
+            for logical_name, schema in self.FIELD_SCHEMAS.items():
+                if custom_type == schema:
+                    field_ids[logical_name] = field['id']
+                elif name == self.FIELD_NAMES[logical_name]:
+                    field_ids.setdefault(logical_name, field['id'])
+        priority_ids = {priority['name'].lower(): priority['id'] for priority in await jira.priorities()}
+
+        with self._lock:
+            self._field_ids, self._priority_ids = field_ids, priority_ids
+            self._last_sync = time.time()
+
+        logger.info(f"🗂️ Field metadata: {field_ids}, {len(priority_ids)} priorities")
@@ -0,0 +1,138 @@
+"""
+Async Jira REST client (httpx) dùng chung connection pool keep-alive cho toàn service
+"""
+import copy
+import json
+import logging
+import time
+import httpx
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+class JiraError(Exception):
+    """Lỗi khi gọi Jira REST API (status_code = None nếu lỗi mạng/timeout)"""
+
+    def __init__(self, status_code, text, url=None, retry_after=None):
+        super().__init__(text)
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+        self.retry_after = retry_after  # Giây, từ header Retry-After (429/503)
+
+    @property
+    def retryable(self):
+        """Lỗi tạm thời (mạng, timeout, 429, 5xx) - thử lại sau có thể thành công"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+    def __str__(self):
+        return f"JiraError HTTP {self.status_code} url: {self.url}\n\ttext: {self.text}"
+
+class AsyncJira:
+    """Các thao tác Jira mà service dùng: create (đơn/bulk), issue, search, user search, update, fields"""
+
+    def __init__(self, server, token, timeout=10.0, max_connections=20, keepalive_expiry=60.0, limiter=None):
+        self.server = server.rstrip('/')
+        self.limiter = limiter  # limiter.AdaptiveLimiter dùng chung cho mọi lần gọi (None = không giới hạn)
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.server}/rest/api/2",
+            headers={
+                'Authorization': f'Bearer {token}',  # Personal Access Token
+                'Accept': 'application/json',
+            },
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def with_limiter(self, limiter):
+        """Client dùng chung connection pool nhưng gọi qua limiter khác (không cần aclose riêng)"""
+        clone = copy.copy(self)
+        clone.limiter = limiter
+        return clone
+
+    async def _request(self, method, path, timeout=None, **kwargs):
+        if self.limiter is None:
+            return await self._send(method, path, timeout, **kwargs)
+        # Có thời hạn thì chỉ chờ lượt tối đa nửa thời hạn, phần còn lại cho chính lần gọi
+        queued_at = time.monotonic()
+        async with self.limiter.slot(timeout / 2 if timeout is not None else None):
+            if timeout is not None:
+                timeout -= time.monotonic() - queued_at
+            return await self._send(method, path, timeout, **kwargs)
+
+    async def _send(self, method, path, timeout, **kwargs):
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        # Mỗi lần gọi HTTP một span: tìm lần gọi Jira chậm trong trace của request
+        with span('jira_request', method=method, path=path) as attributes:
+            try:
+                response = await self._client.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                raise JiraError(None, f"{type(e).__name__}: {e}", path) from e
+            attributes['status_code'] = response.status_code
+        if response.status_code >= 400:
+            retry_after = response.headers.get('Retry-After')
+            raise JiraError(
+                response.status_code, response.text, str(response.url),
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    async def create_issue(self, fields, timeout=None):
+        """Tạo issue, trả về {id, key, self}"""
+        return await self._request('POST', '/issue', json={'fields': fields}, timeout=timeout)
+
+    async def create_issues(self, fields_list, timeout=None):
+        """Bulk create (/issue/bulk), trả về {issues, errors}; errors có failedElementNumber"""
+        body = {'issueUpdates': [{'fields': fields} for fields in fields_list]}
+        try:
+            return await self._request('POST', '/issue/bulk', json=body, timeout=timeout)
+        except JiraError as e:
+            # Tất cả issue đều lỗi thì Jira trả 400 nhưng body vẫn có danh sách errors
+            if e.status_code == 400:
+                try:
+                    result = json.loads(e.text)
+                except ValueError:
+                    raise e
+                if 'errors' in result:
+                    return {'issues': result.get('issues', []), 'errors': result['errors']}
+            raise
+
+    async def issue(self, key, fields=None, timeout=None):
+        params = {'fields': fields} if fields else None
+        return await self._request('GET', f'/issue/{key}', params=params, timeout=timeout)
+
+    async def update_issue(self, key, fields, timeout=None):
+        await self._request('PUT', f'/issue/{key}', json={'fields': fields}, timeout=timeout)
+
+    async def search_issues(self, jql, start_at=0, max_results=50, fields=None, timeout=None):
+        """Tìm issue theo JQL, trả về {issues, total, ...}"""
+        body = {'jql': jql, 'startAt': start_at, 'maxResults': max_results}
+        if fields:
+            body['fields'] = fields.split(',') if isinstance(fields, str) else list(fields)
+        return await self._request('POST', '/search', json=body, timeout=timeout)
+
+    async def search_users(self, username, start_at=0, max_results=50, timeout=None):
+        """Tìm user (Jira Server/Data Center: tham số username khớp name, displayName, email)"""
+        params = {'username': username, 'startAt': start_at, 'maxResults': max_results}
+        return await self._request('GET', '/user/search', params=params, timeout=timeout)
+
+    async def myself(self, timeout=None):
+        """User của token hiện tại (dùng để kiểm tra kết nối và token)"""
+        return await self._request('GET', '/myself', timeout=timeout)
+
+    async def fields(self, timeout=None):
+        return await self._request('GET', '/field', timeout=timeout)
+
+    async def priorities(self, timeout=None):
+        return await self._request('GET', '/priority', timeout=timeout)
@@ -0,0 +1,159 @@
+"""
+Hàng đợi job bền vững (SQLite) cho các cập nhật sau khi tạo issue: worker pool + retry backoff
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Job lưu trong SQLite nên restart không mất; job đang chạy dở được chạy lại khi khởi động.
+    Mọi lệnh SQLite (và commit/fsync) chạy trong thread riêng (to_thread), không chặn event loop"""
+
+    def __init__(self, db_path, workers, max_attempts, base_delay, max_delay, poll_interval=1.0, table='jobs',
+                 unique_key=None):
+        self.table = table  # Mỗi hàng đợi một bảng: nhiều hàng đợi dùng chung file DB, worker pool riêng
+        # Field của payload: đã có job pending/running cùng giá trị thì enqueue bỏ qua (kể cả job từ lần chạy trước)
+        self.unique_key = unique_key
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._pending = 0  # Số job pending/running, đếm trong bộ nhớ để /metrics không phải query
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            'next_run_at REAL NOT NULL, last_error TEXT, created_at REAL NOT NULL)'
+        )
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_due ON {table} (status, next_run_at)')
+        if unique_key:
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_{unique_key} ON {table} (json_extract(payload, '$.{unique_key}'))"
+            )
+        self._db.commit()
+
+    def register(self, kind, handler):
+        """Đăng ký coroutine xử lý cho một loại job: handler(**payload)"""
+        self._handlers[kind] = handler
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    async def enqueue(self, kind, **payload):
+        """Thêm job vào hàng đợi (ghi xuống SQLite trước khi trả về); trả về id của job,
+        None nếu đã có job chưa xong cùng unique_key"""
+        job_id = await asyncio.to_thread(self._insert, kind, payload)
+        if job_id is not None:
+            self._pending += 1
+            self._wakeup.set()
+        return job_id
+
+    def _insert(self, kind, payload):
+        now = time.time()
+        with self._lock:
+            if self.unique_key and self._db.execute(
+                f"SELECT 1 FROM {self.table} WHERE json_extract(payload, '$.{self.unique_key}') = ? "
+                "AND status IN ('pending', 'running') LIMIT 1", (payload[self.unique_key],)
+            ).fetchone():
+                return None
+            cursor = self._db.execute(
+                f'INSERT INTO {self.table} (kind, payload, next_run_at, created_at) VALUES (?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+            self._db.commit()
+        return cursor.lastrowid
+
+    def pending_count(self):
+        return self._pending
+
+    def _count_pending(self):
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM {self.table} WHERE status IN ('pending', 'running')").fetchone()[0]
+
+    async def start(self):
+        """Chạy lại các job dở dang từ lần chạy trước và khởi động worker pool"""
+        replayed = (await asyncio.to_thread(
+            self._execute, f"UPDATE {self.table} SET status = 'pending' WHERE status = 'running'"
+        )).rowcount
+        pending = self._pending = await asyncio.to_thread(self._count_pending)
+        if pending:
+            logger.info(f"📥 Job queue: {pending} job chờ xử lý ({replayed} job chạy dở từ lần trước)")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _claim(self):
+        """Lấy job đến hạn sớm nhất và đánh dấu running (trả về None nếu không có)"""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT id, kind, payload, attempts FROM {self.table} WHERE status = 'pending' AND next_run_at <= ? "
+                'ORDER BY next_run_at LIMIT 1', (time.time(),)
+            ).fetchone()
+            if row:
+                self._db.execute(f"UPDATE {self.table} SET status = 'running', attempts = attempts + 1 WHERE id = ?", (row[0],))
+                self._db.commit()
+            return row
+
+    async def _worker(self, worker_id):
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if not job:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, kind, payload, attempts = job
+            attempts += 1
+            try:
+                await self._handlers[kind](**json.loads(payload))
+            except asyncio.CancelledError:
+                # Dừng giữa chừng: để job ở trạng thái running, lần khởi động sau chạy lại
+                raise
+            except Exception as e:
+                await self._fail(job_id, kind, attempts, e)
+                continue
+            await asyncio.to_thread(self._execute, f'DELETE FROM {self.table} WHERE id = ?', (job_id,))
+            self._pending -= 1
+
+    async def _fail(self, job_id, kind, attempts, error):
+        retryable = getattr(error, 'retryable', False)
+        if retryable and attempts < self.max_attempts:
+            # Exponential backoff có jitter, ưu tiên Retry-After nếu Jira trả về
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            delay = max(delay, getattr(error, 'retry_after', None) or 0)
+            logger.warning(f"🔁 Job {kind}#{job_id} lỗi (lần {attempts}), thử lại sau {delay:.1f}s: {error}")
+            await asyncio.to_thread(
+                self._execute,
+                f"UPDATE {self.table} SET status = 'pending', next_run_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay, str(error), job_id),
+            )
+        else:
+            logger.error(f"❌ Job {kind}#{job_id} thất bại sau {attempts} lần: {error}")
+            await asyncio.to_thread(
+                self._execute, f"UPDATE {self.table} SET status = 'failed', last_error = ? WHERE id = ?", (str(error), job_id)
+            )
+            self._pending -= 1
@@ -0,0 +1,157 @@
+"""
+Parser JSON tăng dần cho output streaming của Gemini: nhận từng đoạn text, trả về ngay các field top-level
+của object đã hoàn chỉnh (không chờ hết response)
+"""
+import json
+import re
+
+WHITESPACE = ' \t\n\r'
+LITERAL_END = ',}] \t\n\r'
+STRING_SPECIAL = re.compile(r'["\\]')  # Trong string chỉ cần dừng ở dấu đóng và escape
+
+class JsonFieldStream:
+    """Object JSON `{"key": value, ...}` đến theo từng đoạn; feed() trả về các (key, value) vừa hoàn chỉnh.
+    Field đang dở giữ vị trí quét và trạng thái (trong string, escape, độ sâu) giữa các lần feed,
+    nên mỗi ký tự chỉ được quét một lần dù value dài qua nhiều chunk"""
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0  # Đầu field tiếp theo trong buffer
+        self._started = False
+        self._key_start = None  # Field đang dở: vị trí key, value (None = chưa tới)
+        self._key_end = None
+        self._value_start = None
+        self._scan_pos = 0  # Trạng thái quét string/value đang dở
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self._literal = False
+        self.fields = {}
+        self.closed = False  # Đã gặp '}' đóng object
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        completed = []
+        while not self.closed:
+            field = self._next_field()
+            if field is None:
+                break
+            self.fields[field[0]] = field[1]
+            completed.append(field)
+        return completed
+
+    def _skip_whitespace(self, i):
+        while i < len(self._buffer) and self._buffer[i] in WHITESPACE:
+            i += 1
+        return i
+
+    def _expect(self, i, char):
+        """Vị trí sau `char` (bỏ khoảng trắng trước), None nếu buffer chưa đến, ValueError nếu sai cú pháp"""
+        i = self._skip_whitespace(i)
+        if i >= len(self._buffer):
+            return None
+        if self._buffer[i] != char:
+            raise ValueError(f"JSON stream: cần '{char}' tại {i}, gặp {self._buffer[i]!r}")
+        return i + 1
+
+    def _next_field(self):
+        """Parse tiếp field đang dở; None nếu chưa đủ dữ liệu (lần feed sau tiếp tục từ chỗ đã dừng)"""
+        buffer = self._buffer
+        if self._key_start is None:
+            i = self._pos
+            if not self._started:
+                i = self._expect(i, '{')
+                if i is None:
+                    return None
+                self._started = True
+                self._pos = i
+            i = self._skip_whitespace(i)
+            if i >= len(buffer):
+                return None
+            if buffer[i] == '}':
+                self.closed = True
+                self._pos = i + 1
+                return None
+            if self.fields:
+                i = self._expect(i, ',')
+                if i is None:
+                    return None
+            key_start = self._skip_whitespace(i)
+            if key_start >= len(buffer):
+                return None
+            if buffer[key_start] != '"':
+                raise ValueError(f"JSON stream: cần string tại {key_start}, gặp {buffer[key_start]!r}")
+            self._key_start = key_start
+            self._begin_scan(key_start)
+        if self._key_end is None:
+            self._key_end = self._resume_scan()
+            if self._key_end is None:
+                return None
+        if self._value_start is None:
+            i = self._expect(self._key_end, ':')
+            if i is None:
+                return None
+            value_start = self._skip_whitespace(i)
+            if value_start >= len(buffer):
+                return None
+            self._value_start = value_start
+            self._begin_scan(value_start)
+        value_end = self._resume_scan()
+        if value_end is None:
+            return None
+        field = json.loads(buffer[self._key_start:self._key_end]), json.loads(buffer[self._value_start:value_end])
+        # Bỏ phần đã parse: buffer chỉ giữ từ field tiếp theo, feed() không phải nối chuỗi ngày càng dài
+        self._buffer = buffer[value_end:]
+        self._pos = 0
+        self._key_start = self._key_end = self._value_start = None
+        return field
+
+    def _begin_scan(self, i):
+        """Bắt đầu quét value tại i: string, object/array lồng nhau, hoặc số/true/false/null"""
+        self._scan_pos = i
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self._literal = self._buffer[i] not in '"{['
+
+    def _resume_scan(self):
+        """Quét tiếp từ chỗ lần trước dừng; vị trí sau value, None nếu value chưa kết thúc trong buffer"""
+        buffer = self._buffer
+        end = len(buffer)
+        i = self._scan_pos
+        if self._literal:
+            # Số/literal: chỉ biết đã hết khi gặp ký tự kết thúc (số có thể còn chữ số ở đoạn sau)
+            while i < end and buffer[i] not in LITERAL_END:
+                i += 1
+            self._scan_pos = i
+            return i if i < end else None
+        while i < end:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = STRING_SPECIAL.search(buffer, i)
+                if match is None:
+                    i = end
+                    break
+                i = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                    continue
+                self._in_string = False
+                if self._depth == 0:
+                    return i
+                continue
+            char = buffer[i]
+            i += 1
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    return i
+        self._scan_pos = i
+        return None
@@ -0,0 +1,153 @@
+"""
+Giới hạn tải lên Gemini/Jira: token bucket (số lần gọi mỗi giây) + giới hạn đồng thời thích ứng kiểu AIMD
+(tăng dần khi gọi thành công nhanh, giảm một nửa khi gặp 429 hoặc độ trễ vượt ngưỡng)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class Overloaded(Exception):
+    """Không lấy được lượt gọi trong thời hạn (hàng đợi đầy, hết token hoặc chờ quá lâu)"""
+    retryable = True  # Job queue thử lại sau
+
+    def __init__(self, dependency, reason):
+        super().__init__(f"{dependency} quá tải ({reason})")
+        self.dependency = dependency
+        self.reason = reason
+
+def is_rate_limited(error):
+    """HTTP 429 từ Jira (JiraError.status_code) hoặc Gemini (google.genai APIError.code)"""
+    return getattr(error, 'status_code', None) == 429 or getattr(error, 'code', None) == 429
+
+class TokenBucket:
+    """rate token mỗi giây, tối đa burst; token được đặt trước nên người đến sau chờ lâu hơn"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # Retry-After: không phát token trước thời điểm này
+
+    def reserve(self, max_wait):
+        """Đặt một token, trả về thời gian phải chờ; None (không đặt) nếu phải chờ quá max_wait"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max((1 - self.tokens) / self.rate, self.paused_until - now, 0.0)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class AdaptiveLimiter:
+    """Giới hạn số lần gọi đồng thời (limit thay đổi theo AIMD) và tốc độ gọi cho một dependency"""
+
+    def __init__(self, name, rate, burst, initial_limit, min_limit, max_limit, latency_target, max_queue,
+                 max_wait=10.0, backoff=0.5, decrease_interval=1.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target  # Lần gọi chậm hơn ngưỡng này coi như dependency đang quá tải
+        self.max_queue = max_queue
+        self.max_wait = max_wait  # Thời gian chờ tối đa khi caller không truyền timeout
+        self.backoff = backoff
+        self.decrease_interval = decrease_interval  # Các lần 429/chậm trong khoảng này chỉ tính một lần giảm
+        self.in_flight = 0
+        self.throttled = 0  # Số lần gặp 429 (cộng dồn)
+        self.rejected = 0  # Số lần từ chối vì quá tải (cộng dồn)
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def saturated(self):
+        """Hàng đợi đã đầy: request mới sẽ bị từ chối ngay"""
+        return len(self._waiters) >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self, timeout=None):
+        """Chờ lượt gọi (tối đa timeout giây), raise Overloaded nếu không kịp; kết quả lần gọi điều chỉnh limit"""
+        await self._acquire(self.max_wait if timeout is None else timeout)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._release(time.monotonic() - start, e)
+            raise
+        self._release(time.monotonic() - start, None)
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise Overloaded(self.name, reason)
+
+    async def _acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        if self.saturated():
+            self._reject('hàng đợi đầy')
+        # Hết token trong thời hạn thì từ chối ngay, không chiếm chỗ trong hàng đợi
+        wait = self.bucket.reserve(timeout)
+        if wait is None:
+            self._reject('vượt tốc độ cho phép')
+        if wait:
+            await asyncio.sleep(wait)
+
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=max(deadline - time.monotonic(), 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Vừa được nhường lượt đúng lúc hết hạn: trả lại lượt cho người sau
+                self.in_flight -= 1
+                self._wake()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject('chờ quá lâu')
+
+    def _release(self, elapsed, error):
+        self.in_flight -= 1
+        now = time.monotonic()
+        if error is not None and is_rate_limited(error):
+            self.throttled += 1
+            retry_after = getattr(error, 'retry_after', None)
+            if retry_after:
+                self.bucket.pause(retry_after)
+            self._decrease(now, '429')
+        elif elapsed > self.latency_target:
+            self._decrease(now, f'chậm {elapsed:.1f}s')
+        elif error is None:
+            # Tăng thêm khoảng 1 sau mỗi "cửa sổ" limit lần gọi thành công
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _decrease(self, now, reason):
+        # Nhiều lần gọi cùng gặp 429 chỉ tính một lần giảm
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        logger.warning(f"🚦 {self.name}: {reason}, giảm giới hạn đồng thời còn {self.limit:.1f}")
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
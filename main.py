@@ -1,325 +1,754 @@
 import os
+import hmac
 import json
 import logging
 import re
 import html
 import asyncio
-from fastapi import FastAPI, Request, BackgroundTasks
-from jira import JIRA
+import time
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from google import genai
 from dotenv import load_dotenv
-from common import GEMINI_PARSE_PROMPT, Messages, Config
+from common import (
+    GEMINI_PARSE_PROMPT, GEMINI_BATCH_PARSE_PROMPT, GEMINI_TASK_SCHEMA, GEMINI_TASK_LIST_SCHEMA, Messages, Config,
+)
+from jira_client import AsyncJira, JiraError
+from idempotency import IdempotencyStore, idempotency_key
+from job_queue import JobQueue
+from limiter import AdaptiveLimiter, Overloaded
+from single_flight import SingleFlight
+from circuit_breaker import CircuitBreaker, CircuitOpen, STATE_VALUES
+from reply_sender import ReplySender
+from cache_snapshot import CacheSnapshot
+import tracing
+from tracing import span, annotate, current_context
+from profiler import SamplingProfiler, ProfilerBusy
+from metrics import MetricsRegistry
+from json_stream import JsonFieldStream
+from classifier import TextClassifier
+from text_scanner import (
+    parse_epic_and_assignee, cut_summary_tail, assign_phrase_span, iter_mention_tags,
+    find_assignee_in_text, has_assign_instruction, strip_tags,
+)
+from jira_cache import (
+    EpicIndex, UserDirectory, FieldMetadata, epic_record, user_record, rank_users,
+    normalize_epic_name, clean_person_name, remove_accents,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = FastAPI()
 
 # Lấy biến môi trường
 JIRA_SERVER = os.getenv("JIRA_SERVER", "").strip()
 JIRA_API_TOKEN = os.getenv("JIRA_API_TOKEN", "").strip()
 JIRA_PROJECT_KEY = os.getenv("JIRA_PROJECT_KEY", "").strip()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "").strip()  # Để trống = API thật; benchmark trỏ tới server giả
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "").strip()  # Để trống = chỉ lưu trong bộ nhớ
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "jobs.db").strip()
+GEMINI_OUTPUT_LOG = os.getenv("GEMINI_OUTPUT_LOG", "").strip()  # JSON lines kết quả Gemini, dữ liệu train classifier
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "").strip()  # Model từ train_classifier.py, để trống = dùng từ khóa
+REPLY_CALLBACK_URL = os.getenv("REPLY_CALLBACK_URL", "").strip()  # Đặt = trả lời ngay, kết quả POST tới URL này sau
+JIRA_CACHE_DB = os.getenv("JIRA_CACHE_DB", "jira_cache.db").strip()  # Snapshot cache Jira, để trống = không lưu
+TRACE_LOG = os.getenv("TRACE_LOG", "").strip()  # File JSON lines ghi span của từng request, để trống = không ghi
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()  # Bearer token cho /admin/*, để trống = tắt các endpoint admin
 
-# Khởi tạo Jira
+# Jira và Gemini được kết nối trong lifespan (không chặn lúc import), None = chưa kết nối/đang kết nối lại
 jira = None
-try:
-    jira = JIRA(server=JIRA_SERVER, token_auth=JIRA_API_TOKEN)
-    logger.info("✅ Kết nối Jira thành công.")
-except Exception as e:
-    logger.error(f"❌ Lỗi kết nối Jira: {e}")
-
 client_ai = None
-try:
-    client_ai = genai.Client(api_key=GEMINI_API_KEY)
-    logger.info("✅ Kết nối Gemini AI thành công.")
-except Exception as e:
-    logger.error(f"❌ Lỗi kết nối Gemini AI: {e}")
+jira_connected = asyncio.Event()
+warmed_up = set()  # Các cache đã tải xong lần đầu (thành công hoặc lỗi)
+stream_followups = set()  # Task chờ phần còn lại của Gemini stream sau khi đã tạo issue
 
-def clean_teams_message(raw_text):
-    """Làm sạch HTML message từ Teams và parse mention tags"""
-    # Bước 1: Tìm và ghép các mention tags liên tiếp thành tên đầy đủ
-    at_pattern = r'<at[^>]*>([^<]+)</at>'
+# Cache epic, user và field metadata trong bộ nhớ, đồng bộ định kỳ với Jira
+epic_index = EpicIndex(JIRA_PROJECT_KEY, Config.EPIC_INDEX_TTL, Config.EPIC_INDEX_FULL_RELOAD)
+user_directory = UserDirectory(Config.USER_DIRECTORY_TTL)
+field_metadata = FieldMetadata(Config.FIELD_METADATA_TTL)
+# Snapshot của các cache trên để restart không phải chờ tải lại từ Jira
+cache_snapshot = (CacheSnapshot(JIRA_CACHE_DB, f"{JIRA_SERVER}|{JIRA_PROJECT_KEY}", Config.CACHE_SNAPSHOT_MAX_AGE)
+                  if JIRA_CACHE_DB else None)
+jira_caches = {
+    'field metadata': (field_metadata, Config.FIELD_METADATA_TTL),
+    'epic index': (epic_index, Config.EPIC_INDEX_TTL),
+    'user directory': (user_directory, Config.USER_DIRECTORY_TTL),
+}
+
+# Tra cứu Jira cùng tham số đang chạy thì dùng chung (nhiều task cùng epic/assignee gửi một lúc),
+# "không tìm thấy" được nhớ trong thời gian ngắn để không gọi JQL lặp lại
+epic_lookups = SingleFlight('epic', negative_ttl=Config.LOOKUP_NEGATIVE_TTL)
+user_lookups = SingleFlight('user', negative_ttl=Config.LOOKUP_NEGATIVE_TTL)
+field_lookups = SingleFlight('field_metadata')
+lookups = (epic_lookups, user_lookups, field_lookups)
+
+# Kết quả webhook đã xử lý, chống tạo trùng issue khi Teams gửi lại (tạo trong lifespan cùng các hàng đợi job)
+idempotency_store = None
+
+# Hàng đợi bền vững cho các cập nhật sau khi tạo issue (epic link, assignee), tạo trong lifespan (import không tạo file DB)
+job_queue = None
+
+# Chế độ trả lời bất đồng bộ: webhook trả "đang xử lý" ngay, message được xử lý trong hàng đợi riêng
+# (không chung worker với job cập nhật) và kết quả POST tới REPLY_CALLBACK_URL
+reply_sender = ReplySender(REPLY_CALLBACK_URL, timeout=Config.REPLY_HTTP_TIMEOUT) if REPLY_CALLBACK_URL else None
+reply_queue = None  # Chỉ tạo khi đặt REPLY_CALLBACK_URL
+
+# Giới hạn tải lên Gemini/Jira: token bucket + giới hạn đồng thời tự điều chỉnh theo 429 và độ trễ
+gemini_limiter = AdaptiveLimiter(
+    'gemini',
+    rate=Config.GEMINI_RATE_LIMIT,
+    burst=Config.GEMINI_BURST,
+    initial_limit=Config.GEMINI_CONCURRENCY,
+    min_limit=Config.LIMITER_MIN_CONCURRENCY,
+    max_limit=Config.GEMINI_MAX_CONCURRENCY,
+    latency_target=Config.GEMINI_LATENCY_TARGET,
+    max_queue=Config.LIMITER_MAX_QUEUE,
+)
+jira_limiter = AdaptiveLimiter(
+    'jira',
+    rate=Config.JIRA_RATE_LIMIT,
+    burst=Config.JIRA_BURST,
+    initial_limit=Config.JIRA_CONCURRENCY,
+    min_limit=Config.LIMITER_MIN_CONCURRENCY,
+    max_limit=Config.JIRA_MAX_CONNECTIONS,
+    latency_target=Config.JIRA_LATENCY_TARGET,
+    max_queue=Config.LIMITER_MAX_QUEUE,
+)
+# Tải cache nền đi qua limiter riêng (chung connection pool): trang chậm/429 chỉ làm chậm việc tải cache,
+# không giảm limit AIMD của các lần gọi từ webhook
+jira_background_limiter = AdaptiveLimiter(
+    'jira_background',
+    rate=Config.JIRA_BACKGROUND_RATE_LIMIT,
+    burst=Config.JIRA_BACKGROUND_RATE_LIMIT,
+    initial_limit=Config.JIRA_BACKGROUND_CONCURRENCY,
+    min_limit=Config.LIMITER_MIN_CONCURRENCY,
+    max_limit=Config.JIRA_BACKGROUND_MAX_CONCURRENCY,
+    latency_target=Config.JIRA_LATENCY_TARGET,
+    max_queue=Config.LIMITER_MAX_QUEUE,
+)
+limiters = (gemini_limiter, jira_limiter, jira_background_limiter)
+
+# Gemini lỗi/timeout liên tục thì ngắt mạch: request dùng parser cục bộ ngay thay vì chờ hết AI_TIMEOUT
+gemini_breaker = CircuitBreaker(
+    'gemini',
+    failure_ratio=Config.GEMINI_BREAKER_FAILURE_RATIO,
+    window_size=Config.GEMINI_BREAKER_WINDOW,
+    min_calls=Config.GEMINI_BREAKER_MIN_CALLS,
+    latency_threshold=Config.GEMINI_BREAKER_LATENCY_THRESHOLD,
+    open_duration=Config.GEMINI_BREAKER_OPEN_DURATION,
+    ignored=(Overloaded,),
+)
+
+# Metrics cho /metrics (Prometheus): độ trễ từng bước so với ngân sách 5s của Teams
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    'jirabot_request_duration_seconds', 'Thời gian webhook trả lời Teams (ngân sách 5s)')
+stage_seconds = metrics.histogram(
+    'jirabot_stage_duration_seconds',
+    'Thời gian từng bước: clean, gemini_parse, fallback_parse, jira_create, epic_lookup, user_lookup, background_update, '
+    'reply_post, async_reply',
+    ['stage'])
+parse_path_total = metrics.counter('jirabot_parse_path_total', 'Số message theo nhánh parse', ['path'])
+timeouts_total = metrics.counter('jirabot_timeouts_total', 'Số lần hết thời gian theo bước', ['stage'])
+fallbacks_total = metrics.counter('jirabot_fallbacks_total', 'Số lần dùng đường dự phòng theo lý do', ['reason'])
+cache_lookups_total = metrics.counter(
+    'jirabot_cache_lookups_total', 'Số lần tra cache trong bộ nhớ (hit/miss)', ['cache', 'result'])
+shed_total = metrics.counter('jirabot_shed_total', 'Số message trả lời "quá tải" theo dependency', ['dependency'])
+errors_total = metrics.counter('jirabot_errors_total', 'Số lỗi theo bước và loại exception', ['stage', 'type'])
+metrics.gauge('jirabot_job_queue_pending', 'Số job cập nhật đang chờ/đang chạy',
+              lambda: job_queue.pending_count() if job_queue else 0)
+metrics.gauge('jirabot_reply_queue_pending', 'Số message chờ trả lời bất đồng bộ',
+              lambda: reply_queue.pending_count() if reply_queue else 0)
+metrics.gauge('jirabot_limiter_concurrency_limit', 'Giới hạn đồng thời hiện tại (AIMD)',
+              lambda: {(l.name,): l.limit for l in limiters}, ['dependency'])
+metrics.gauge('jirabot_limiter_in_flight', 'Số lần gọi đang chạy', lambda: {(l.name,): l.in_flight for l in limiters}, ['dependency'])
+metrics.gauge('jirabot_limiter_queued', 'Số lần gọi đang chờ lượt', lambda: {(l.name,): l.queued for l in limiters}, ['dependency'])
+metrics.callback_counter('jirabot_limiter_throttled_total', 'Số lần dependency trả về 429',
+                         lambda: {(l.name,): l.throttled for l in limiters}, ['dependency'])
+metrics.callback_counter('jirabot_lookup_coalesced_total', 'Số lần tra cứu Jira dùng chung lần gọi đang chạy',
+                         lambda: {(l.name,): l.coalesced for l in lookups}, ['lookup'])
+metrics.callback_counter('jirabot_lookup_negative_hits_total', 'Số lần tra cứu trả "không tìm thấy" từ negative cache',
+                         lambda: {(l.name,): l.negative_hits for l in lookups}, ['lookup'])
+metrics.gauge('jirabot_circuit_state', 'Trạng thái circuit breaker (0 = closed, 1 = half_open, 2 = open)',
+              lambda: {(gemini_breaker.name,): STATE_VALUES[gemini_breaker.state]}, ['dependency'])
+metrics.callback_counter('jirabot_circuit_opened_total', 'Số lần ngắt mạch',
+                         lambda: {(gemini_breaker.name,): gemini_breaker.opened}, ['dependency'])
+metrics.callback_counter('jirabot_circuit_rejected_total', 'Số lần gọi bị chặn khi mạch đang ngắt',
+                         lambda: {(gemini_breaker.name,): gemini_breaker.rejected}, ['dependency'])
+metrics.callback_counter('jirabot_limiter_rejected_total', 'Số lần gọi bị từ chối vì quá tải (không chờ được lượt)',
+                         lambda: {(l.name,): l.rejected for l in limiters}, ['dependency'])
+
+def record_cache_lookup(cache, found):
+    cache_lookups_total.inc(cache=cache, result='hit' if found else 'miss')
+
+# Sampling profiler cho /admin/profile: chỉ chạy khi được gọi
+profiler = SamplingProfiler()
+
+# Span của từng request ghi ra TRACE_LOG (qua queue, thread riêng ghi file)
+if TRACE_LOG:
+    tracing.configure(TRACE_LOG)
+
+@contextmanager
+def stage(name, parent=None, **attributes):
+    """Một bước xử lý: thời gian vào stage_seconds (/metrics) và span trong trace của request"""
+    with span(name, parent, **attributes) as span_attributes, stage_seconds.time(stage=name):
+        yield span_attributes
+
+# Output Gemini ghi ra file riêng (không lẫn log service) làm dữ liệu train classifier
+gemini_output_log = logging.getLogger('gemini_outputs')
+gemini_output_log.propagate = False
+if GEMINI_OUTPUT_LOG:
+    output_handler = logging.FileHandler(GEMINI_OUTPUT_LOG, encoding='utf-8')
+    output_handler.setFormatter(logging.Formatter('%(message)s'))
+    gemini_output_log.addHandler(output_handler)
+
+def record_gemini_output(text, result):
+    if GEMINI_OUTPUT_LOG:
+        gemini_output_log.info(json.dumps({
+            'ts': time.time(), 'text': text, 'issuetype': result['issuetype'], 'priority': result['priority'],
+        }, ensure_ascii=False))
+
+def load_classifier(path):
+    """Classifier issuetype/priority cho parser cục bộ, None nếu không cấu hình hoặc file lỗi"""
+    if not path:
+        return None
+    try:
+        start = time.time()
+        model = TextClassifier.load(path)
+    except Exception as e:
+        logger.warning(f"⚠️ Không tải được classifier {path}, dùng từ khóa: {e}")
+        return None
+    logger.info(f"✅ Đã tải classifier {path} ({(time.time() - start) * 1000:.1f}ms)")
+    return model
+
+issue_classifier = load_classifier(CLASSIFIER_MODEL)
+
+def create_ai_client():
+    return genai.Client(
+        api_key=GEMINI_API_KEY,
+        http_options={'base_url': GEMINI_BASE_URL} if GEMINI_BASE_URL else None,
+    )
+
+def get_ai_client():
+    """Client Gemini, tạo lại nếu lần khởi tạo trước lỗi"""
+    global client_ai
+    if client_ai is None:
+        client_ai = create_ai_client()
+        logger.info("✅ Kết nối Gemini AI thành công.")
+    return client_ai
+
+async def connect_gemini():
+    try:
+        await asyncio.to_thread(get_ai_client)
+    except Exception as e:
+        logger.error(f"❌ Lỗi kết nối Gemini AI: {e}")
+        errors_total.inc(stage='gemini_connect', type=type(e).__name__)
+
+async def connect_jira():
+    """Tạo client Jira và kiểm tra token bằng GET /myself; lỗi thì đóng client và raise"""
+    client = AsyncJira(
+        JIRA_SERVER, JIRA_API_TOKEN,
+        timeout=Config.JIRA_HTTP_TIMEOUT,
+        max_connections=Config.JIRA_MAX_CONNECTIONS,
+        limiter=jira_limiter,
+    )
+    try:
+        user = await client.myself(timeout=Config.JIRA_CONNECT_TIMEOUT)
+    except BaseException:
+        await client.aclose()
+        raise
+    logger.info(f"✅ Kết nối Jira thành công ({(user or {}).get('name', '?')}).")
+    return client
+
+async def disconnect_jira():
+    global jira
+    client, jira = jira, None
+    jira_connected.clear()
+    if client:
+        await client.aclose()
+
+async def supervise_jira():
+    """Kết nối Jira (thử lại có backoff), kiểm tra định kỳ và tạo lại client khi mất kết nối"""
+    global jira
+    attempt = 0
+    failures = 0
+    while True:
+        if jira is None:
+            try:
+                jira = await connect_jira()
+            except Exception as e:
+                attempt += 1
+                delay = min(Config.RECONNECT_MAX_DELAY, Config.RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+                logger.error(f"❌ Lỗi kết nối Jira (lần {attempt}), thử lại sau {delay}s: {e}")
+                errors_total.inc(stage='jira_connect', type=type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            attempt = failures = 0
+            jira_connected.set()
+
+        await asyncio.sleep(Config.JIRA_HEALTH_CHECK_INTERVAL)
+        try:
+            await jira.myself(timeout=Config.JIRA_CONNECT_TIMEOUT)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logger.warning(f"⚠️ Kiểm tra kết nối Jira lỗi ({failures}/{Config.JIRA_HEALTH_MAX_FAILURES}): {e}")
+            if failures >= Config.JIRA_HEALTH_MAX_FAILURES:
+                logger.error("❌ Mất kết nối Jira, tạo lại client")
+                await disconnect_jira()
+
+async def refresh_cache_loop(name, cache, interval, initial_delay=0):
+    """Tải cache khi Jira kết nối xong (sau initial_delay nếu đã nạp từ snapshot) và đồng bộ lại định kỳ
+    (lỗi thì thử lại sớm); tải xong thì ghi snapshot"""
+    await asyncio.sleep(initial_delay)
+    while True:
+        await jira_connected.wait()
+        delay = interval
+        try:
+            client = jira
+            if client:
+                with span('cache_refresh', cache=name):
+                    await cache.refresh(client.with_limiter(jira_background_limiter))
+                await save_cache_snapshot(name, cache)
+        except Exception as e:
+            logger.warning(f"⚠️ Không thể đồng bộ {name}: {e}")
+            delay = min(interval, Config.CACHE_RETRY_DELAY)
+        warmed_up.add(name)
+        await asyncio.sleep(delay)
+
+def restore_cache_snapshot(name, cache, interval):
+    """Nạp cache từ snapshot, trả về thời gian chờ trước lần đồng bộ đầu tiên với Jira: snapshot còn mới thì
+    đồng bộ khi đến hạn như bình thường, đã quá hạn thì sau CACHE_SNAPSHOT_RECONCILE_DELAY (không tranh lượt
+    gọi Jira với các request đầu tiên); không có snapshot thì đồng bộ ngay"""
+    if not cache_snapshot:
+        return 0
+    start = time.perf_counter()
+    try:
+        data = cache_snapshot.load(name)
+        if data is None:
+            return 0
+        cache.restore(data)
+    except Exception as e:
+        logger.warning(f"⚠️ Không thể nạp snapshot {name}: {e}")
+        errors_total.inc(stage='cache_snapshot', type=type(e).__name__)
+        return 0
+    warmed_up.add(name)
+    age = time.time() - data['last_sync']
+    logger.info(f"💾 Đã nạp snapshot {name} trong {(time.perf_counter() - start) * 1000:.0f}ms (cập nhật {age:.0f}s trước)")
+    return max(interval - age, Config.CACHE_SNAPSHOT_RECONCILE_DELAY)
+
+async def warm_start_cache(name, cache, interval):
+    """Nạp snapshot trong thread riêng (request vẫn được nhận trong lúc dựng index) rồi đồng bộ định kỳ"""
+    delay = await asyncio.to_thread(restore_cache_snapshot, name, cache, interval)
+    await refresh_cache_loop(name, cache, interval, delay)
+
+async def save_cache_snapshot(name, cache):
+    if not cache_snapshot or not cache.loaded:
+        return
+    try:
+        await asyncio.to_thread(cache_snapshot.save, name, cache.snapshot())
+    except Exception as e:
+        logger.warning(f"⚠️ Không thể ghi snapshot {name}: {e}")
+        errors_total.inc(stage='cache_snapshot', type=type(e).__name__)
+
+def create_job_queues():
+    """Mở hàng đợi job (SQLite), idempotency store và đăng ký handler; reply_queue chỉ có ở chế độ bất đồng bộ"""
+    global job_queue, reply_queue, idempotency_store
+    db_path = IDEMPOTENCY_DB
+    if reply_sender and not db_path:
+        # Job trả lời chạy lại sau restart dựa vào idempotency để không tạo issue lần nữa:
+        # kết quả phải lưu bền vững như chính job (chung file với hàng đợi)
+        db_path = JOB_QUEUE_DB
+        logger.info(f"💾 Chế độ bất đồng bộ: lưu idempotency vào {JOB_QUEUE_DB} (IDEMPOTENCY_DB để trống)")
+    idempotency_store = IdempotencyStore(
+        Config.IDEMPOTENCY_MAX_ENTRIES, Config.IDEMPOTENCY_TTL, db_path or None,
+        content_ttl=Config.IDEMPOTENCY_CONTENT_TTL, prune_interval=Config.IDEMPOTENCY_PRUNE_INTERVAL,
+    )
+    job_queue = JobQueue(
+        JOB_QUEUE_DB,
+        workers=Config.JOB_WORKERS,
+        max_attempts=Config.JOB_MAX_ATTEMPTS,
+        base_delay=Config.JOB_RETRY_BASE_DELAY,
+        max_delay=Config.JOB_RETRY_MAX_DELAY,
+    )
+    job_queue.register('update_issue', update_issue_async)
+    if reply_sender:
+        reply_queue = JobQueue(
+            JOB_QUEUE_DB,
+            workers=Config.REPLY_WORKERS,
+            max_attempts=Config.JOB_MAX_ATTEMPTS,
+            base_delay=Config.JOB_RETRY_BASE_DELAY,
+            max_delay=Config.JOB_RETRY_MAX_DELAY,
+            table='reply_jobs',
+            unique_key='key',  # Teams gửi lại message đang chờ (kể cả job từ trước khi restart) thì không thêm job
+        )
+        reply_queue.register('reply_message', reply_async)
+
+def readiness():
+    """Trạng thái từng thành phần cho /readyz"""
+    return {
+        'jira': jira is not None,
+        'gemini': client_ai is not None,
+        'field_metadata': 'field metadata' in warmed_up,
+        'epic_index': 'epic index' in warmed_up,
+        'user_directory': 'user directory' in warmed_up,
+    }
+
+@asynccontextmanager
+async def lifespan(app):
+    # Không chờ kết nối: app nhận request ngay, Jira/Gemini và các cache (nạp từ snapshot nếu có)
+    # khởi tạo song song ở background
+    tasks = [
+        asyncio.create_task(supervise_jira()),
+        asyncio.create_task(connect_gemini()),
+        *(asyncio.create_task(warm_start_cache(name, cache, interval)) for name, (cache, interval) in jira_caches.items()),
+    ]
+    create_job_queues()
+    await job_queue.start()
+    if reply_queue:
+        await reply_queue.start()
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if stream_followups:
+            # Cho các cập nhật sau stream kịp đưa vào job queue trước khi dừng hàng đợi, quá hạn thì hủy
+            _, unfinished = await asyncio.wait(set(stream_followups), timeout=Config.STREAM_FOLLOWUP_DRAIN_TIMEOUT)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        if reply_queue:
+            await reply_queue.stop()
+        await job_queue.stop()
+        if reply_sender:
+            await reply_sender.aclose()
+        await disconnect_jira()
+        # Giữ cả epic/user tìm được qua Jira search từ lần đồng bộ gần nhất
+        for name, (cache, _) in jira_caches.items():
+            await save_cache_snapshot(name, cache)
+        tracing.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# =============== TEAMS MESSAGE PATTERNS ===============
+# Compile một lần ở module level, dùng lại cho mọi request
+# (mention tags, "gán cho X" và HTML tags được tách bằng text_scanner, không dùng regex lazy)
+HTML_BREAK_RE = re.compile(r'</p>|</div>|<br\s*/?>|</li>')
+MULTI_NEWLINE_RE = re.compile(r'\n\n+')
+MENTION_INVALID_RE = re.compile(r'[\[\]※]')
+NAME_PART_INVALID_RE = re.compile(r'[\(\)\[\]※]')
+# Giữ nguyên hành vi cũ: character class (không phải chuỗi "&nbsp;")
+MENTION_NBSP_RE = re.compile(r'[\[\]※&nbsp;]')
+MENTION_NBSP_CHARS_RE = re.compile(r'[&nbsp;\xa0]')
+
+def tokenize_teams_message(raw_text):
+    """Quét HTML message từ Teams một lần, trả về (clean_text, mentions, assignee)"""
+    # Vị trí "gắn cho"/"gán cho" và điểm kết thúc tên ("và", "epic link"...)
+    assign_start, assign_end = assign_phrase_span(raw_text)
+
+    # Một lượt duy nhất qua các mention tags: ghép text mới bằng list thay vì str.replace
     mentions = []
-    for match in re.finditer(at_pattern, raw_text):
-        mention_text = match.group(1).strip()
-        mention_text = html.unescape(mention_text)
-        if len(mention_text) <= 50 and not re.search(r'[\[\]※]', mention_text):
+    name_parts = []
+    all_replaced = []    # Mọi mention tag thay bằng text (để tìm "gán cho X")
+    valid_replaced = []  # Chỉ mention hợp lệ thay bằng text (để làm sạch HTML)
+    last = 0
+    for tag_start, tag_end, tag_text in iter_mention_tags(raw_text):
+        mention_text = html.unescape(tag_text.strip())
+        chunk = raw_text[last:tag_start]
+        all_replaced.append(chunk)
+        all_replaced.append(mention_text)
+        valid_replaced.append(chunk)
+        # Chỉ lấy mention nếu có vẻ là tên người (không quá 50 ký tự, không chứa ký tự đặc biệt)
+        if len(mention_text) <= 50 and not MENTION_INVALID_RE.search(mention_text):
             mentions.append(mention_text)
-    
-    # Tìm các mention tags liên tiếp có vẻ là tên (trước "và" hoặc "epic link")
-    # Tìm vị trí của "gắn cho" hoặc "gán cho"
-    assignee_from_mentions = None
-    gắn_cho_pattern = r'(?:gắn|gán)\s+(?:cho|task\s+này\s+cho)'
-    gắn_match = re.search(gắn_cho_pattern, raw_text, re.IGNORECASE)
-    
-    if gắn_match:
-        # Tìm các mention tags sau "gắn cho" và trước "và" hoặc "epic link"
-        start_pos = gắn_match.end()
-        end_pattern = r'(?:\s+và|\s+and|epic\s+link|$)'
-        end_match = re.search(end_pattern, raw_text[start_pos:], re.IGNORECASE)
-        end_pos = start_pos + (end_match.start() if end_match else len(raw_text))
-        
-        # Lấy phần text giữa "gắn cho" và "và/epic link"
-        text_between = raw_text[start_pos:end_pos]
-        
-        # Tìm tất cả mention tags trong phần này
-        name_parts = []
-        for match in re.finditer(at_pattern, text_between):
-            mention_text = match.group(1).strip()
-            mention_text = html.unescape(mention_text)
+            valid_replaced.append(mention_text)
+        else:
+            valid_replaced.append(raw_text[tag_start:tag_end])
+        last = tag_end
+
+        # Các mention tags nằm giữa "gắn cho" và "và/epic link" ghép thành tên đầy đủ
+        if assign_start <= tag_start and tag_end <= assign_end:
             # Loại bỏ phần trong ngoặc đơn
             if not mention_text.startswith('(') and not mention_text.endswith(')'):
-                if len(mention_text) <= 20 and not re.search(r'[\(\)\[\]※]', mention_text):
+                if len(mention_text) <= 20 and not NAME_PART_INVALID_RE.search(mention_text):
                     name_parts.append(mention_text)
-        
-        if name_parts:
-            # Ghép các phần thành tên đầy đủ
-            assignee_from_mentions = ' '.join(name_parts).strip()
-    
-    # Bước 2: Tìm pattern "gán cho X" trong text (sau khi thay thế mention tags)
-    # Thay thế tất cả mention tags bằng text để dễ tìm pattern
-    text_with_mentions_replaced = raw_text
-    for match in re.finditer(at_pattern, raw_text):
-        mention_text = match.group(1).strip()
-        mention_text = html.unescape(mention_text)
-        # Thay thế bằng text, giữ nguyên khoảng trắng
-        text_with_mentions_replaced = text_with_mentions_replaced.replace(match.group(0), mention_text)
-    
-    # Thay thế &nbsp; bằng space
-    text_with_mentions_replaced = text_with_mentions_replaced.replace('&nbsp;', ' ')
+    all_replaced.append(raw_text[last:])
+    valid_replaced.append(raw_text[last:])
+
+    assignee_from_mentions = ' '.join(name_parts).strip() if name_parts else None
+
+    # Tìm pattern "gán cho X" trong text (sau khi thay thế mention tags)
+    text_with_mentions_replaced = ''.join(all_replaced).replace('&nbsp;', ' ')
     text_with_mentions_replaced = html.unescape(text_with_mentions_replaced)
-    
-    assignee_from_text = None
-    assignee_patterns = [
-        r'tạo\s+task\s+gắn\s+cho\s+([^\n,<]+?)(?:\s+và|\s+and|epic|$)',  # "tạo task gắn cho X"
-        r'gắn\s+cho\s+([^\n,<]+?)(?:\s+và|\s+and|epic|$)',  # "gắn cho X"
-        r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,<]+?)(?:\s+và|\s+and|epic|$)',  # "gán cho X"
-    ]
-    
-    for pattern in assignee_patterns:
-        match = re.search(pattern, text_with_mentions_replaced, re.IGNORECASE)
-        if match:
-            assignee_from_text = match.group(1).strip()
-            # Loại bỏ HTML tags nếu có
-            assignee_from_text = re.sub(r'<[^>]+>', '', assignee_from_text)
-            assignee_from_text = html.unescape(assignee_from_text)
-            # Loại bỏ phần trong ngoặc đơn
-            assignee_from_text = re.sub(r'\s*\([^)]+\)', '', assignee_from_text).strip()
-            if assignee_from_text and len(assignee_from_text) > 2:
-                break
-    
+
+    assignee_from_text = find_assignee_in_text(text_with_mentions_replaced)
+
     # Ưu tiên dùng assignee từ mention tags nếu có (thường chính xác hơn)
-    assignee_from_text = assignee_from_mentions if assignee_from_mentions else assignee_from_text
-    
-    # Parse mention tags (chỉ lấy mention thực sự - tên người)
-    # Teams mention format: <at>Name</at> hoặc <at id="...">Name</at>
-    mentions = []
-    
-    # Tìm tất cả mention tags: <at>Name</at> hoặc <at id="...">Name</at>
-    # Chỉ lấy những mention có vẻ là tên người (không quá dài, không có ký tự đặc biệt nhiều)
-    at_pattern = r'<at[^>]*>([^<]+)</at>'
-    for match in re.finditer(at_pattern, raw_text):
-        mention_text = match.group(1).strip()
-        # Clean HTML entities
-        mention_text = html.unescape(mention_text)
-        # Chỉ lấy mention nếu có vẻ là tên người (không quá 50 ký tự, không chứa nhiều ký tự đặc biệt)
-        if len(mention_text) <= 50 and not re.search(r'[\[\]※]', mention_text):
-            mentions.append(mention_text)
-            # Thay thế bằng text đơn giản để dễ parse
-            raw_text = raw_text.replace(match.group(0), mention_text)
-    
+    assignee = assignee_from_mentions if assignee_from_mentions else assignee_from_text
+
     # Clean HTML
-    clean = re.sub(r'</p>|</div>|<br\s*/?>|</li>', '\n', raw_text)
-    clean = re.sub(r'<[^>]+>', '', clean)
+    clean = HTML_BREAK_RE.sub('\n', ''.join(valid_replaced))
+    clean = strip_tags(clean)
     clean = html.unescape(clean)
     clean = '\n'.join(line.strip() for line in clean.split('\n'))
-    clean = re.sub(r'\n\n+', '\n\n', clean).strip()
-    
+    clean = MULTI_NEWLINE_RE.sub('\n\n', clean).strip()
+
     # Nếu có mentions hợp lệ VÀ chưa tìm thấy assignee từ text gốc
-    if mentions and not assignee_from_text:
-        # Lọc mentions - chỉ lấy những cái có vẻ là tên người (không phải bot, không phải text dài)
-        valid_mentions = [m.strip() for m in mentions if m.lower() != 'jirabot' and len(m.strip()) <= 30 and not m.strip().startswith('[') and not re.search(r'[\[\]※&nbsp;]', m)]
-        
-        # Ghép các từ liên tiếp thành tên đầy đủ (ví dụ: "Trần", "Đức", "Long" -> "Trần Đức Long")
-        if valid_mentions:
-            # Tìm các từ liên tiếp có vẻ là tên (không có ký tự đặc biệt, không quá ngắn)
-            full_names = []
-            current_name_parts = []
-            
-            for mention in valid_mentions:
-                # Clean mention
-                mention_clean = re.sub(r'[&nbsp;\xa0]', ' ', mention).strip()
-                # Nếu là từ đơn (không có space, không có ký tự đặc biệt, độ dài hợp lý)
-                if len(mention_clean) > 0 and len(mention_clean) <= 20 and not re.search(r'[\(\)\[\]※]', mention_clean):
-                    if not mention_clean.startswith('(') and not mention_clean.endswith(')'):
-                        current_name_parts.append(mention_clean)
-                    else:
-                        # Nếu có phần trong ngoặc, kết thúc tên hiện tại
-                        if current_name_parts:
-                            full_names.append(' '.join(current_name_parts))
-                            current_name_parts = []
-                else:
-                    # Nếu không phải từ đơn, kết thúc tên hiện tại
-                    if current_name_parts:
-                        full_names.append(' '.join(current_name_parts))
-                        current_name_parts = []
-                    # Nếu là tên đầy đủ (có space hoặc dài), thêm trực tiếp
-                    if len(mention_clean) > 3 and (' ' in mention_clean or len(mention_clean) > 10):
-                        full_names.append(mention_clean)
-            
-            # Thêm tên cuối cùng nếu còn
+    if mentions and not assignee:
+        best_mention = _pick_mention_name(mentions)
+        # Nếu text không có "gán cho" thì thêm mention vào làm assignee
+        if best_mention and not has_assign_instruction(clean):
+            clean = f"{clean}\ngán cho {best_mention}"
+
+    return clean, mentions, assignee
+
+def _pick_mention_name(mentions):
+    """Ghép các mention liên tiếp thành tên đầy đủ và chọn tên phù hợp nhất"""
+    # Lọc mentions - chỉ lấy những cái có vẻ là tên người (không phải bot, không phải text dài)
+    valid_mentions = [m.strip() for m in mentions if m.lower() != 'jirabot' and len(m.strip()) <= 30 and not m.strip().startswith('[') and not MENTION_NBSP_RE.search(m)]
+
+    # Ghép các từ liên tiếp thành tên đầy đủ (ví dụ: "Trần", "Đức", "Long" -> "Trần Đức Long")
+    full_names = []
+    current_name_parts = []
+    for mention in valid_mentions:
+        mention_clean = MENTION_NBSP_CHARS_RE.sub(' ', mention).strip()
+        # Nếu là từ đơn (không có ký tự đặc biệt, độ dài hợp lý)
+        if len(mention_clean) > 0 and len(mention_clean) <= 20 and not NAME_PART_INVALID_RE.search(mention_clean):
+            current_name_parts.append(mention_clean)
+        else:
+            # Nếu không phải từ đơn, kết thúc tên hiện tại
             if current_name_parts:
                 full_names.append(' '.join(current_name_parts))
-            
-            # Lọc lại - chỉ lấy tên có vẻ hợp lệ (không quá ngắn, không có ký tự đặc biệt)
-            final_mentions = [name for name in full_names if len(name) >= 3 and len(name) <= 50 and not re.search(r'[\[\]※]', name)]
-            
-            if final_mentions:
-                # Ưu tiên dùng assignee từ text gốc nếu có (đã ghép từ mention tags)
-                if assignee_from_text:
-                    # Tìm pattern "gán cho X" hoặc "gắn cho X" trong text để thay thế
-                    assignee_match = re.search(r'(?:gán|gắn)\s+(?:task\s+này\s+)?cho\s+([^\n,]+?)(?:\s+và|\s+and|$)', clean, re.IGNORECASE)
-                    if assignee_match:
-                        # Thay thế bằng tên đầy đủ từ text gốc
-                        old_text = assignee_match.group(0)
-                        new_text = f"gán cho {assignee_from_text}"
-                        clean = clean.replace(old_text, new_text)
-                    else:
-                        # Nếu không tìm thấy, thêm vào
-                        clean = f"{clean}\ngán cho {assignee_from_text}"
-                else:
-                    # Tìm pattern "gán cho X" trong text để lấy tên đầy đủ
-                    assignee_match = re.search(r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,]+?)(?:\s+và|\s+and|$)', clean, re.IGNORECASE)
-                    if not assignee_match:
-                        # Nếu text không có "gán cho" hoặc "assign to", thêm mention vào
-                        # Chỉ thêm nếu tên đủ dài (ít nhất 2 từ)
-                        best_mention = None
-                        for mention in final_mentions:
-                            if len(mention.split()) >= 2:  # Ít nhất 2 từ
-                                best_mention = mention
-                                break
-                        if not best_mention and final_mentions:
-                            best_mention = final_mentions[0]
-                        
-                        if best_mention:
-                            clean = f"{clean}\ngán cho {best_mention}"
-    
+                current_name_parts = []
+            # Nếu là tên đầy đủ (có space hoặc dài), thêm trực tiếp
+            if len(mention_clean) > 3 and (' ' in mention_clean or len(mention_clean) > 10):
+                full_names.append(mention_clean)
+    if current_name_parts:
+        full_names.append(' '.join(current_name_parts))
+
+    # Lọc lại - chỉ lấy tên có vẻ hợp lệ (không quá ngắn, không có ký tự đặc biệt)
+    final_mentions = [name for name in full_names if 3 <= len(name) <= 50 and not MENTION_INVALID_RE.search(name)]
+    if not final_mentions:
+        return None
+    # Ưu tiên tên có ít nhất 2 từ
+    for mention in final_mentions:
+        if len(mention.split()) >= 2:
+            return mention
+    return final_mentions[0]
+
+def clean_teams_message(raw_text):
+    """Làm sạch HTML message từ Teams và parse mention tags"""
+    clean, _mentions, _assignee = tokenize_teams_message(raw_text)
     return clean
 
-def ask_gemini_to_parse_task(text):
-    """Phân tích task với timeout 1s"""
-    try:
-        prompt = GEMINI_PARSE_PROMPT.format(text=text)
+GEMINI_MODEL = 'gemini-2.5-flash'
+# Đủ các field này là tạo được issue (schema sinh chúng trước assignee, description). epic_link sinh ngay sau
+# priority và quyết định kiểu issue (có epic link thì không phải Epic) nên phải có trước khi tạo
+STREAM_CORE_FIELDS = ('summary', 'issuetype', 'priority', 'epic_link')
+
+def gemini_config(schema):
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': schema,  # Model bị ràng buộc sinh đúng schema: không có markdown, JSON lỗi
+        'temperature': 0.1,  # Giảm creativity để nhanh hơn
+    }
+
+def gemini_queue_timeout(ai_timeout):
+    """Thời gian chờ lượt của limiter theo ngân sách AI của caller (chế độ bất đồng bộ chờ được lâu hơn)"""
+    return max(Config.GEMINI_QUEUE_TIMEOUT, ai_timeout * Config.GEMINI_QUEUE_SHARE)
+
+def gemini_latency_threshold(ai_timeout):
+    """Ngưỡng "gọi chậm" của breaker theo ngân sách AI của caller (3-10s là bình thường ở chế độ bất đồng bộ)"""
+    return max(Config.GEMINI_BREAKER_LATENCY_THRESHOLD, ai_timeout * Config.GEMINI_BREAKER_LATENCY_SHARE)
+
+async def generate_json(prompt, schema, ai_timeout=Config.AI_TIMEOUT):
+    """Gọi Gemini (async client, bị hủy ngay khi timeout) với response schema, trả về object đã parse"""
+    # Mạch ngắt thì raise CircuitOpen ngay (không tính vào thời gian gemini_parse)
+    gemini_breaker.check()
+    with stage('gemini_parse'):
+        # Breaker nằm trong slot: thời gian chờ lượt ở limiter không tính là độ trễ của Gemini
+        async with gemini_limiter.slot(gemini_queue_timeout(ai_timeout)):
+            async with gemini_breaker.call(gemini_latency_threshold(ai_timeout)):
+                response = await get_ai_client().aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=prompt,
+                    config=gemini_config(schema),
+                )
+    # SDK parse sẵn theo schema; None chỉ khi output bị cắt (hết token, safety)
+    if response.parsed is None:
+        finish_reason = response.candidates[0].finish_reason if response.candidates else None
+        raise ValueError(f"Gemini không trả về kết quả theo schema (finish_reason={finish_reason})")
+    return response.parsed
+
+def normalize_task_info(result, text):
+    """Điền giá trị mặc định cho một issue (kiểu và enum đã do response schema đảm bảo)"""
+    if not result.get('summary'):
+        result['summary'] = text.split('\n')[0][:100]
+    if not result.get('description'):
+        result['description'] = text
+    result['issuetype'] = result.get('issuetype') or 'Task'
+    result['priority'] = result.get('priority') or 'Medium'
+    result['epic_link'] = (result.get('epic_link') or '').strip() or None
+    result['assignee'] = (result.get('assignee') or '').strip() or None
+    
+    # IMPORTANT: Nếu có epic_link thì phải là Task, không phải Epic
+    # (epic_link = liên kết với epic có sẵn, không phải tạo Epic mới)
+    if result['epic_link'] and result['issuetype'] == 'Epic':
+        logger.warning(f"⚠️ Có epic_link nhưng issuetype là Epic, đổi thành Task")
+        result['issuetype'] = 'Task'
         
-        response = client_ai.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config={
-                'response_mime_type': 'application/json',
-                'temperature': 0.1,  # Giảm creativity để nhanh hơn
-            }
+    logger.info(f"✅ Parsed task: {result['issuetype']} - {result['summary'][:50]}")
+    if result['epic_link']:
+        logger.info(f"   Epic link: {result['epic_link']}")
+    if result['assignee']:
+        logger.info(f"   Assignee: {result['assignee']}")
+    return result
+
+def record_ai_fallback(error, kind=''):
+    """Log và đếm lần dùng parser cục bộ thay cho Gemini (mạch đang ngắt là trạng thái đã biết, không log lỗi)"""
+    if isinstance(error, CircuitOpen):
+        logger.info(f"🔌 Gemini đang ngắt mạch, dùng fallback parsing{kind}")
+        fallbacks_total.inc(reason='breaker_open')
+        return
+    logger.error(f"❌ Gemini Error{kind}: {type(error).__name__}: {error}")
+    logger.warning("⚠️ Dùng fallback parsing do exception")
+    errors_total.inc(stage='gemini_parse', type=type(error).__name__)
+    # Limiter từ chối (không chờ được lượt) hay Gemini lỗi thật
+    fallbacks_total.inc(reason='ai_overloaded' if isinstance(error, Overloaded) else 'ai_error')
+
+async def ask_gemini_to_parse_task(text, ai_timeout=Config.AI_TIMEOUT):
+    """Phân tích task bằng Gemini, lỗi thì dùng quick_parse_fallback"""
+    try:
+        result = normalize_task_info(
+            await generate_json(GEMINI_PARSE_PROMPT.format(text=text), GEMINI_TASK_SCHEMA, ai_timeout), text
         )
-        
-        # Parse JSON an toàn
-        response_text = response.text.strip()
-        
-        # Xóa markdown code block nếu có
-        if response_text.startswith('```'):
-            response_text = re.sub(r'^```(?:json)?\s*', '', response_text)
-            response_text = re.sub(r'\s*```$', '', response_text)
-        
-        # Parse JSON
-        result = json.loads(response_text)
-        
-        # Validate required fields
-        if not result.get('summary'):
-            result['summary'] = text.split('\n')[0][:100]  
-        if not result.get('issuetype'):
-            result['issuetype'] = 'Task'
-        if not result.get('description'):
-            result['description'] = text
-        if not result.get('priority'):
-            result['priority'] = 'Medium'
-        if 'epic_link' not in result:
-            result['epic_link'] = None
-        if 'assignee' not in result:
-            result['assignee'] = None
-        
-        # Clean epic_link và assignee
-        if result.get('epic_link'):
-            epic_link_value = result['epic_link']
-            if isinstance(epic_link_value, str):
-                # Loại bỏ các từ thừa ở cuối
-                epic_link_value = re.sub(r'\s+(?:và|and|cho|to|for).*$', '', epic_link_value, flags=re.IGNORECASE).strip()
-                result['epic_link'] = epic_link_value if epic_link_value else None
-            elif not epic_link_value:
-                result['epic_link'] = None
-        else:
-            result['epic_link'] = None
-        
-        if result.get('assignee'):
-            assignee_value = result['assignee']
-            if isinstance(assignee_value, str):
-                # Loại bỏ phần trong ngoặc đơn (như "(KHN.SBU3.DEV)")
-                assignee_value_after_paren = re.sub(r'\s*\([^)]+\)', '', assignee_value).strip()
-                # Loại bỏ các từ thừa ở cuối
-                assignee_value = re.sub(r'\s+(?:và|and|cho|to|for).*$', '', assignee_value_after_paren, flags=re.IGNORECASE).strip()
-                result['assignee'] = assignee_value if assignee_value else None
-            elif not assignee_value:
-                result['assignee'] = None
-        else:
-            result['assignee'] = None
-        
-        # Clean description: loại bỏ phần instruction về assignee và epic link
-        if result.get('description'):
-            description = result['description']
-            # Loại bỏ các dòng chứa instruction
-            lines = description.split('\n')
-            cleaned_lines = []
-            for line in lines:
-                # Loại bỏ dòng chứa "gán", "assign", "epic link", "hãy gán"
-                if not re.search(r'(gán|assign|epic\s+link|hãy\s+gán)', line, re.IGNORECASE):
-                    cleaned_lines.append(line)
-            result['description'] = '\n'.join(cleaned_lines).strip()
-        
-        # IMPORTANT: Nếu có epic_link thì phải là Task, không phải Epic
-        # (epic_link = liên kết với epic có sẵn, không phải tạo Epic mới)
-        if result.get('epic_link') and result.get('issuetype') == 'Epic':
-            logger.warning(f"⚠️ Có epic_link nhưng issuetype là Epic, đổi thành Task")
-            result['issuetype'] = 'Task'
-            
-        logger.info(f"✅ Parsed task: {result.get('issuetype')} - {result.get('summary')[:50]}")
-        if result.get('epic_link'):
-            logger.info(f"   Epic link: {result.get('epic_link')}")
-        if result.get('assignee'):
-            logger.info(f"   Assignee: {result.get('assignee')}")
+        record_gemini_output(text, result)
         return result
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"❌ JSON Parse Error: {e}")
-        logger.error(f"   Response text: {response.text[:500]}")
-        # Fallback: dùng quick_parse để giữ lại epic link và assignee
-        logger.warning("⚠️ Dùng fallback parsing do JSON error")
-        return quick_parse_fallback(text)
-    except AttributeError as e:
-        logger.error(f"❌ Response Error: {e}")
-        logger.error(f"   Check if response object valid")
-        # Fallback: dùng quick_parse để giữ lại epic link và assignee
-        logger.warning("⚠️ Dùng fallback parsing do AttributeError")
-        return quick_parse_fallback(text)
     except Exception as e:
-        logger.error(f"❌ Gemini Error: {type(e).__name__}: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
         # Fallback: dùng quick_parse để giữ lại epic link và assignee
-        logger.warning("⚠️ Dùng fallback parsing do exception")
+        record_ai_fallback(e)
         return quick_parse_fallback(text)
 
+async def stream_json_fields(prompt, schema, ai_timeout=Config.AI_TIMEOUT, release_after=STREAM_CORE_FIELDS):
+    """Gọi Gemini dạng streaming, yield (key, value) của từng field ngay khi field đó sinh xong.
+    Breaker và lượt của limiter chỉ giữ tới khi đủ các field release_after (lúc caller hết chờ):
+    phần đuôi của stream không chiếm lượt gọi Gemini và không tính vào độ trễ"""
+    parser = JsonFieldStream()
+    gemini_breaker.check()
+    async with AsyncExitStack() as guard:
+        await guard.enter_async_context(gemini_limiter.slot(gemini_queue_timeout(ai_timeout)))
+        await guard.enter_async_context(gemini_breaker.call(gemini_latency_threshold(ai_timeout)))
+        held = True
+        stream = await get_ai_client().aio.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=gemini_config(schema),
+        )
+        async for chunk in stream:
+            for field in parser.feed(chunk.text or ''):
+                yield field
+            if held and all(name in parser.fields for name in release_after):
+                held = False
+                await guard.aclose()
+        if not parser.closed:
+            raise ValueError("Gemini stream kết thúc khi JSON chưa đầy đủ")
+
+async def ask_gemini_to_parse_task_streaming(text, timeout):
+    """Parse bằng Gemini streaming: trả về ngay khi đủ summary/issuetype/priority/epic_link để tạo issue.
+    Trả về (task_info, rest_task); rest_task (None nếu stream đã xong) cho kết quả đầy đủ khi stream kết thúc.
+    Lỗi Gemini thì dùng quick_parse_fallback như ask_gemini_to_parse_task, hết timeout thì raise TimeoutError"""
+    fields = {}
+    core_ready = asyncio.Event()
+
+    async def consume():
+        start = time.time()
+        try:
+            with stage('gemini_parse'):
+                async for key, value in stream_json_fields(GEMINI_PARSE_PROMPT.format(text=text), GEMINI_TASK_SCHEMA, timeout):
+                    fields[key] = value
+                    if not core_ready.is_set() and all(name in fields for name in STREAM_CORE_FIELDS):
+                        stage_seconds.observe(time.time() - start, stage='gemini_core_fields')
+                        core_ready.set()
+        finally:
+            core_ready.set()
+        result = normalize_task_info(dict(fields), text)
+        record_gemini_output(text, result)
+        return result
+
+    task = asyncio.create_task(consume())
+    try:
+        await asyncio.wait_for(core_ready.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        task.cancel()
+        raise
+    if not task.done():
+        # Assignee, description còn đang sinh: tạo issue trước với message gốc làm description
+        core_info = {name: fields[name] for name in STREAM_CORE_FIELDS}
+        return normalize_task_info({**core_info, 'description': text}, text), task
+    try:
+        return task.result(), None
+    except Exception as e:
+        record_ai_fallback(e, ' (stream)')
+        return quick_parse_fallback(text), None
+
+def update_after_stream(issue_key, rest_task, text):
+    """Chờ phần còn lại của stream ở background rồi đưa description, assignee vào job queue
+    (epic link đã có lúc tạo issue, được resolve/cập nhật cùng issue)"""
+    async def follow():
+        try:
+            result = await asyncio.wait_for(rest_task, timeout=Config.STREAM_REST_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ Gemini stream lỗi sau khi tạo {issue_key}, dùng fallback parsing: {type(e).__name__}: {e}")
+            errors_total.inc(stage='gemini_stream_rest', type=type(e).__name__)
+            fallbacks_total.inc(reason='stream_rest_error')
+            result = quick_parse_fallback(text)
+        _, _, assignee = prepare_issue(result)
+        description = result.get('description')
+        if description == text:
+            description = None
+        if assignee or description:
+            logger.info(f"📋 Cập nhật {issue_key} sau stream: assignee={assignee}, description={bool(description)}")
+            await job_queue.enqueue('update_issue', issue_key=issue_key, assignee=assignee, description=description,
+                                    trace=current_context())
+
+    task = asyncio.create_task(follow())
+    stream_followups.add(task)
+    task.add_done_callback(stream_followups.discard)
+
+async def ask_gemini_to_parse_tasks(text, ai_timeout=Config.AI_TIMEOUT):
+    """Phân tích message có nhiều issue bằng một lần gọi Gemini, lỗi thì dùng quick_parse_batch_fallback"""
+    try:
+        result = await generate_json(GEMINI_BATCH_PARSE_PROMPT.format(text=text), GEMINI_TASK_LIST_SCHEMA, ai_timeout)
+        tasks = [normalize_task_info(item, item['summary'] or text) for item in result]
+        return tasks or quick_parse_batch_fallback(text)
+    except Exception as e:
+        record_ai_fallback(e, ' (batch)')
+        return quick_parse_batch_fallback(text)
+
+# =============== QUICK PARSE PATTERNS ===============
+INSTRUCTION_LINE_RE = re.compile(r'(gán|assign|epic\s+link|hãy\s+gán)', re.IGNORECASE)
+# "tạo bug ...", "create task: ..." ở đầu message
+COMMAND_RE = re.compile(r'^\s*(?:tạo|create|thêm|add)\s+(?:một\s+|1\s+|an?\s+)?(bug|task|epic|improvement)\b\s*:?\s*', re.IGNORECASE)
+HIGH_PRIORITY_RE = re.compile(r'(?:ưu\s+tiên|mức\s+độ|nghiêm\s+trọng)\s+(?:rất\s+)?cao|gấp|khẩn|urgent|critical|high\s+priority|priority\s*[:=]?\s*high', re.IGNORECASE)
+LOW_PRIORITY_RE = re.compile(r'(?:ưu\s+tiên|mức\s+độ|nghiêm\s+trọng)\s+thấp|không\s+gấp|low\s+priority|priority\s*[:=]?\s*low', re.IGNORECASE)
+MENTIONS_EPIC_RE = re.compile(r'\bepic\b', re.IGNORECASE)
+MENTIONS_ASSIGN_RE = re.compile(r'gán|gắn|assign', re.IGNORECASE)
+# Message nhiều issue: "tạo 5 task", "tạo các task sau", "create 3 bugs" + các dòng liệt kê
+BATCH_COMMAND_RE = re.compile(r'(?:tạo|create)\s+(?:\d+|các|nhiều|những|multiple)\s+(?:task|bug|issue|improvement|công\s+việc)', re.IGNORECASE)
+LIST_ITEM_RE = re.compile(r'^[ \t]*(?:[-*•+]|\d+[.)])[ \t]+(\S.*)$', re.MULTILINE)
+
 def quick_parse_fallback(text):
-    """Parse nhanh bằng regex khi AI timeout"""
-    summary = text.split('\n')[0][:200] if text else 'No summary'
+    """Parse bằng rules cục bộ (không gọi AI), có đo thời gian"""
+    with stage('fallback_parse'):
+        return _quick_parse(text)
+
+def _quick_parse(text):
+    """Parse nhanh bằng regex (fast path hoặc khi AI timeout), kèm điểm tin cậy 'confidence'"""
+    first_line = text.split('\n')[0] if text else ''
     
     # Detect issue type - cẩn thận với "epic link" vs "tạo Epic"
     text_lower = text.lower()
@@ -332,101 +761,156 @@ def quick_parse_fallback(text):
     else:
         issue_type = 'Task'  
     
-    # Tìm epic link và assignee bằng regex
-    epic_link = None
-    assignee = None
-    
-    # Tìm epic link - lấy toàn bộ text sau "epic link đến" hoặc "epic link"
-    # Thử nhiều pattern để tìm epic link
-    epic_patterns = [
-        r'epic\s+link\s+(?:đến|to)\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "epic link đến X"
-        r'epic\s+link\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "epic link X"
-        r'epic\s*[:\-=]\s*([^\n,]+?)(?:\s+và|\s+and|$)',  # "epic: X"
-        r'link\s+(?:đến|to)\s+epic\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "link đến epic X"
-        r'epic\s+link\s+(?:đến|to)\s+([^\n]+?)(?:\n|$)',  # Lấy đến hết dòng
-        r'epic\s+link\s+([^\n]+?)(?:\n|$)',  # Lấy đến hết dòng
-    ]
-    for pattern in epic_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            epic_link = match.group(1).strip()
-            # Loại bỏ các từ thừa ở cuối
-            epic_link = re.sub(r'\s+(?:và|and|cho|to|for).*$', '', epic_link, flags=re.IGNORECASE)
-            # Loại bỏ các ký tự đặc biệt ở đầu/cuối
-            epic_link = epic_link.strip('.,;:!?')
-            if epic_link:
-                break
+    # Priority theo từ khóa, mặc định Medium
+    if HIGH_PRIORITY_RE.search(text):
+        priority = 'High'
+    elif LOW_PRIORITY_RE.search(text):
+        priority = 'Low'
+    else:
+        priority = 'Medium'
     
-    # Tìm assignee - thử nhiều pattern, ưu tiên lấy tên đầy đủ
-    assignee_patterns = [
-        r'gán\s+(?:task\s+này\s+)?cho\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "gán cho X"
-        r'gắn\s+cho\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "gắn cho X"
-        r'tạo\s+task\s+gắn\s+cho\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "tạo task gắn cho X"
-        r'gán\s+(?:task\s+này\s+)?cho\s+([^\n]+?)(?:\s+và|\s+and|\n|$)',  # "gán cho X" (lấy đến hết dòng)
-        r'assign\s+(?:to|for)?\s+([^\n,]+?)(?:\s+và|\s+and|$)',  # "assign to X"
-        r'assignee\s*[:\-=]\s*([^\n,]+?)(?:\s+và|\s+and|$)',  # "assignee: X"
-    ]
-    for pattern in assignee_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            assignee = match.group(1).strip()
-            # Loại bỏ phần trong ngoặc đơn (như "(KHN.SBU3.DEV)")
-            assignee = re.sub(r'\s*\([^)]+\)', '', assignee)
-            # Loại bỏ các từ thừa ở cuối
-            assignee = re.sub(r'\s+(?:và|and|cho|to|for).*$', '', assignee, flags=re.IGNORECASE)
-            # Loại bỏ các ký tự đặc biệt ở đầu/cuối
-            assignee = assignee.strip('.,;:!?')
-            if assignee and len(assignee) > 0:
-                break
+    # Classifier (train từ output Gemini) thay cho từ khóa khi đủ chắc chắn
+    label_probability = None
+    if issue_classifier:
+        prediction = issue_classifier.predict(text)
+        (predicted_type, type_probability), (predicted_priority, priority_probability) = prediction['issuetype'], prediction['priority']
+        if type_probability >= Config.CLASSIFIER_MIN_PROBABILITY:
+            issue_type = predicted_type
+        if priority_probability >= Config.CLASSIFIER_MIN_PROBABILITY:
+            priority = predicted_priority
+        label_probability = min(type_probability, priority_probability)
+    
+    # Tìm epic link và assignee (text_scanner: thời gian tuyến tính, kết quả như các regex cũ)
+    epic_link, assignee, truncated = parse_epic_and_assignee(text)
     
     # Nếu có epic_link thì phải là Task
     if epic_link and issue_type == 'Epic':
         issue_type = 'Task'
     
+    # Tiêu đề: dòng đầu, bỏ lệnh "tạo bug" và phần instruction phía sau
+    command = COMMAND_RE.match(first_line)
+    summary = first_line[command.end():] if command else first_line
+    summary = cut_summary_tail(summary).strip(' .,;:!?')
+    if not summary:
+        summary = first_line
+    summary = summary[:200] if summary else 'No summary'
+    
     # Clean description: loại bỏ phần instruction về assignee và epic link
     description = text
     if description:
         # Loại bỏ các dòng chứa instruction
         lines = description.split('\n')
-        cleaned_lines = []
-        for line in lines:
-            # Loại bỏ dòng chứa "gán", "assign", "epic link", "hãy gán"
-            if not re.search(r'(gán|assign|epic\s+link|hãy\s+gán)', line, re.IGNORECASE):
-                cleaned_lines.append(line)
+        cleaned_lines = [line for line in lines if not INSTRUCTION_LINE_RE.search(line)]
         description = '\n'.join(cleaned_lines).strip()
     
-    return {
+    result = {
         'summary': summary,
         'issuetype': issue_type,
         'description': description,
-        'priority': 'Medium',
+        'priority': priority,
         'epic_link': epic_link,
         'assignee': assignee
     }
+    result['confidence'] = _quick_parse_confidence(text, result, command, label_probability, truncated)
+    return result
+
+def _quick_parse_confidence(text, result, command, label_probability=None, truncated=False):
+    """Điểm tin cậy 0..1 cho kết quả quick parse: message càng "đúng mẫu" điểm càng cao"""
+    score = 0.3
+    # Classifier chắc chắn về loại/priority thì tin hơn, phân vân thì để Gemini quyết định
+    if label_probability is not None:
+        if label_probability >= Config.CLASSIFIER_CONFIDENT_PROBABILITY:
+            score += 0.1
+        elif label_probability < Config.CLASSIFIER_MIN_PROBABILITY:
+            score -= 0.2
+    # Có lệnh rõ ràng "tạo <loại>" và khớp với loại đã detect
+    if command:
+        if command.group(1).lower() == result['issuetype'].lower():
+            score += 0.3
+        else:
+            score -= 0.3
+    # Message ngắn, gọn (không phải đoạn mô tả dài)
+    lines = [line for line in text.split('\n') if line.strip()]
+    if len(text) <= Config.FAST_PATH_MAX_LENGTH and len(lines) <= 2:
+        score += 0.2
+    if len(result['summary'].split()) >= 2:
+        score += 0.1
+    # Có nhắc đến epic/assignee mà không tách được (hoặc tách ra quá dài) thì không tin
+    if MENTIONS_EPIC_RE.search(text) and result['issuetype'] != 'Epic':
+        if not result['epic_link'] or len(result['epic_link'].split()) > 4:
+            score -= 0.4
+    if MENTIONS_ASSIGN_RE.search(text):
+        if not result['assignee'] or len(result['assignee'].split()) > 5:
+            score -= 0.4
+    # Epic/assignee bị cắt ở từ nối mà sau đó còn chữ ("Sales and Marketing" -> "Sales"): để Gemini quyết định
+    if truncated:
+        score -= 0.4
+    return round(max(0.0, min(score, 1.0)), 2)
+
+def is_batch_message(text):
+    """Message yêu cầu tạo nhiều issue ("tạo 5 task: ...", "tạo các task sau")"""
+    return bool(BATCH_COMMAND_RE.search(text)) and len(LIST_ITEM_RE.findall(text)) >= 2
+
+def quick_parse_batch_fallback(text):
+    """Parse nhanh message nhiều issue: mỗi dòng liệt kê là một issue, epic/assignee ở dòng đầu áp dụng cho tất cả"""
+    header = text.split('\n')[0]
+    header_info = quick_parse_fallback(header)
+    tasks = []
+    for item in LIST_ITEM_RE.findall(text):
+        task_info = quick_parse_fallback(item.strip())
+        # Loại issue ghi ở dòng đầu ("tạo 3 bug") áp dụng cho các dòng không nói rõ
+        if task_info['issuetype'] == 'Task' and header_info['issuetype'] in ('Bug', 'Improvement'):
+            task_info['issuetype'] = header_info['issuetype']
+        task_info['epic_link'] = task_info['epic_link'] or header_info['epic_link']
+        task_info['assignee'] = task_info['assignee'] or header_info['assignee']
+        tasks.append(task_info)
+    return tasks
+
+def is_retryable(error):
+    """Lỗi Jira tạm thời (429, 5xx, mạng) - để job queue thử lại thay vì bỏ qua"""
+    return getattr(error, 'retryable', False)
+
+def _remember_epic(record):
+    """Lưu epic tìm được qua Jira vào index để lần sau không phải gọi Jira"""
+    epic_index.add(record)
+    return record
 
-def find_epic(epic_identifier):
-    """Tìm epic trong Jira theo key hoặc name"""
+async def find_epic(epic_identifier):
+    """Tìm epic theo key hoặc name, trả về record {id, key, summary}"""
     if not epic_identifier or not jira:
         logger.warning("⚠️ Epic identifier rỗng hoặc Jira chưa kết nối")
         return None
     
     epic_identifier = epic_identifier.strip()
-    
+
+    # Tra index trong bộ nhớ trước, chỉ gọi JQL khi không có
+    epic = epic_index.lookup(epic_identifier)
+    record_cache_lookup('epic_index', epic)
+    if epic:
+        logger.info(f"✅ Tìm thấy epic trong index: {epic['key']} - {epic['summary']}")
+        return epic
+    return await epic_lookups.do(epic_identifier, lambda: _find_epic_on_jira(epic_identifier))
+
+async def _find_epic_on_jira(epic_identifier):
+    """Tìm epic qua Jira (theo key, rồi JQL theo name); None nếu không thấy, lỗi tạm thời thì raise"""
     try:
         # Nếu là epic key (format: PROJ-123)
         if re.match(r'^[A-Z]+-\d+$', epic_identifier):
             try:
-                epic = jira.issue(epic_identifier)
-                if epic.fields.issuetype.name == 'Epic':
-                    logger.info(f"✅ Tìm thấy epic theo key: {epic.key} - {epic.fields.summary}")
-                    return epic
+                epic = await jira.issue(epic_identifier, fields='summary,issuetype')
+                epic_type = epic['fields']['issuetype']['name']
+                if epic_type == 'Epic':
+                    logger.info(f"✅ Tìm thấy epic theo key: {epic['key']} - {epic['fields']['summary']}")
+                    return _remember_epic(epic_record(epic))
                 else:
-                    logger.warning(f"⚠️ {epic_identifier} không phải là Epic (type: {epic.fields.issuetype.name})")
+                    logger.warning(f"⚠️ {epic_identifier} không phải là Epic (type: {epic_type})")
             except Exception as e:
+                if is_retryable(e):
+                    raise
                 logger.warning(f"⚠️ Không tìm thấy epic key {epic_identifier}: {e}")
         
         # Chuẩn hóa epic identifier 
-        epic_normalized = epic_identifier.upper().replace('-', '').replace('_', '')
+        epic_normalized = normalize_epic_name(epic_identifier)
         
         # Tìm theo epic name trong project
         # Thử nhiều cách tìm (không dùng ~ với key vì không hỗ trợ)
@@ -441,268 +925,183 @@ def find_epic(epic_identifier):
         
         for jql in search_queries:
             try:
-                epics = jira.search_issues(jql, maxResults=10)
+                result = await jira.search_issues(jql, max_results=10, fields='summary')
+                epics = [epic_record(issue) for issue in result['issues']]
                 
                 if epics:
                     # Tìm exact match trước (theo summary hoặc key)
                     for epic in epics:
-                        epic_summary_upper = epic.fields.summary.upper().replace('-', '').replace('_', '')
-                        epic_key_upper = epic.key.upper().replace('-', '')
+                        epic_summary_upper = normalize_epic_name(epic['summary'])
+                        epic_key_upper = epic['key'].upper().replace('-', '')
                         
                         # So sánh normalized
                         if (epic_normalized in epic_summary_upper or 
                             epic_normalized in epic_key_upper or
-                            epic_identifier.upper() in epic.fields.summary.upper() or
-                            epic_identifier.upper() == epic.key.upper()):
-                            logger.info(f"✅ Tìm thấy epic theo name: {epic.key} - {epic.fields.summary}")
-                            return epic
+                            epic_identifier.upper() in epic['summary'].upper() or
+                            epic_identifier.upper() == epic['key'].upper()):
+                            logger.info(f"✅ Tìm thấy epic theo name: {epic['key']} - {epic['summary']}")
+                            return _remember_epic(epic)
                     
                     # Nếu không có exact match, lấy cái đầu tiên
-                    logger.info(f"✅ Tìm thấy epic (lấy đầu tiên): {epics[0].key} - {epics[0].fields.summary}")
-                    return epics[0]
+                    logger.info(f"✅ Tìm thấy epic (lấy đầu tiên): {epics[0]['key']} - {epics[0]['summary']}")
+                    return _remember_epic(epics[0])
             except Exception as e:
+                if is_retryable(e):
+                    raise
                 logger.warning(f"⚠️ Lỗi khi tìm với JQL {jql}: {e}")
                 continue
         
         logger.warning(f"⚠️ Không tìm thấy epic: {epic_identifier}")
         return None
     except Exception as e:
+        if is_retryable(e):
+            raise
         logger.error(f"❌ Lỗi khi tìm epic: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return None
 
-def find_epic_link_field_id(issue):
-    """Tìm field ID của epic link field"""
+def epic_link_field_id():
+    """Field ID của epic link field theo metadata đã tải (Epic Link, hoặc Parent Link nếu dùng Advanced Roadmaps)"""
+    return field_metadata.field_id('epic_link') or field_metadata.field_id('parent_link')
+
+async def find_epic_link_field_id():
+    """Field ID của epic link field, tải metadata nếu chưa có (các lần gọi đồng thời chỉ tải một lần)"""
     try:
-        # Thử các field ID phổ biến trước (nhanh hơn)
-        common_epic_fields = ['customfield_10014', 'customfield_10011', 'customfield_10016', 'customfield_10020', 'customfield_10104']
-        issue_fields = issue.raw['fields']
-        
-        for field_id in common_epic_fields:
-            if field_id in issue_fields:
-                logger.info(f"✅ Tìm thấy epic link field: {field_id}")
-                return field_id
-        
-        # Nếu không tìm thấy, thử tìm trong danh sách fields của Jira
-        try:
-            fields = jira.fields()
-            for field in fields:
-                if field['name'].lower() in ['epic link', 'parent link', 'epic']:
-                    logger.info(f"✅ Tìm thấy epic link field: {field['name']} ({field['id']})")
-                    return field['id']
-        except:
-            pass
-        
-        logger.warning(f"⚠️ Không tìm thấy epic link field, sẽ thử với field phổ biến nhất")
-        # Trả về field phổ biến nhất để thử
-        return 'customfield_10014'
+        if not field_metadata.loaded:
+            await field_lookups.do('field_metadata', lambda: field_metadata.ensure_loaded(jira))
     except Exception as e:
-        logger.warning(f"⚠️ Không thể tìm epic link field: {e}")
-        return 'customfield_10014'  # Fallback
+        logger.warning(f"⚠️ Không thể tải field metadata: {e}")
+    
+    field_id = epic_link_field_id()
+    if not field_id:
+        logger.warning(f"⚠️ Không tìm thấy epic link field, sẽ thử với field phổ biến nhất")
+        field_id = FieldMetadata.DEFAULT_FIELD_IDS['epic_link']
+    return field_id
+
+def priority_field_value(priority_name):
+    """Giá trị field priority: dùng id nếu biết, không thì dùng tên"""
+    priority_id = field_metadata.priority_id(priority_name)
+    return {'id': priority_id} if priority_id else {'name': priority_name}
+
+async def search_user_on_jira(assignee, assignee_clean):
+    """Tìm user trên Jira bằng nhiều cách search khi danh bạ không có, trả về record"""
+    return await user_lookups.do(assignee, lambda: _search_user_on_jira(assignee, assignee_clean))
+
+async def _search_user_on_jira(assignee, assignee_clean):
+    # Tạo nhiều search queries khác nhau
+    search_queries = [assignee_clean, assignee]  # Tên đầy đủ đã clean, tên gốc
+    
+    # Từng phần của tên (nếu có nhiều từ)
+    name_parts = assignee_clean.split()
+    if len(name_parts) > 1:
+        search_queries.append(f"{name_parts[0]} {name_parts[1]}")  # Họ và tên (2 từ đầu)
+        search_queries.append(name_parts[-1])  # Tên cuối (có thể là username)
+    
+    # Loại bỏ dấu tiếng Việt và lowercase
+    assignee_no_accent = remove_accents(assignee_clean).lower()
+    if assignee_no_accent != assignee_clean.lower():
+        search_queries.append(assignee_no_accent)
+    if len(name_parts) > 1:
+        search_queries.append(remove_accents(name_parts[-1]).lower())
+    
+    users = []
+    for query in dict.fromkeys(search_queries):
+        try:
+            users = await jira.search_users(query, max_results=10)
+            if users:
+                break
+        except Exception as e:
+            if is_retryable(e):
+                raise
+            continue
+    if not users:
+        return None
+    
+    records = [user_record(user) for user in users]
+    user_directory.add(records)
+    
+    # Tìm user phù hợp nhất, nếu không có thì lấy user đầu tiên
+    matched_user = rank_users(records, assignee_clean)
+    if matched_user:
+        logger.info(f"✅ Tìm thấy user: {matched_user['displayName'] or matched_user['name']}")
+    else:
+        matched_user = records[0]
+        logger.info(f"✅ Lấy user đầu tiên: {matched_user['displayName'] or matched_user['name']}")
+    return matched_user
+
+def assignee_field_value(user):
+    """Giá trị field assignee cho user: accountId (Jira Cloud), name/key/email (Jira Server)"""
+    if user.get('accountId'):
+        return {'accountId': user['accountId']}
+    for attr in ('name', 'key', 'emailAddress'):
+        if user.get(attr):
+            return {'name': user[attr]}
+    return None
 
-def update_issue_async(issue_key, epic_link=None, assignee=None):
-    """Cập nhật issue với epic link và assignee trong background"""
+async def resolve_epic_field(epic_link):
+    """Tìm epic, trả về {epic link field: epic key} hoặc {} nếu không tìm thấy"""
+    with stage('epic_lookup'):
+        epic = await find_epic(epic_link)
+    if not epic:
+        logger.error(f"❌ KHÔNG tìm thấy epic '{epic_link}' trên Jira")
+        return {}
+    logger.info(f"✅ Đã tìm thấy epic: {epic['key']} - {epic['summary']}")
+    # Epic Link nhận key của epic dạng string
+    return {await find_epic_link_field_id(): epic['key']}
+
+async def resolve_assignee_field(assignee):
+    """Tìm user (danh bạ trước, Jira sau), trả về {'assignee': ...} hoặc {} nếu không tìm thấy"""
+    assignee_clean = clean_person_name(assignee)
+    matched_user = user_directory.lookup(assignee_clean)
+    record_cache_lookup('user_directory', matched_user)
+    if matched_user:
+        logger.info(f"✅ Tìm thấy user trong danh bạ: {matched_user['displayName'] or matched_user['name']}")
+    else:
+        with stage('user_lookup'):
+            matched_user = await search_user_on_jira(assignee, assignee_clean)
+    
+    if not matched_user:
+        logger.error(f"❌ KHÔNG tìm thấy user '{assignee}' trên Jira")
+        return {}
+    assignee_value = assignee_field_value(matched_user)
+    if not assignee_value:
+        logger.error(f"❌ Không thể set assignee cho user {matched_user}")
+        return {}
+    logger.info(f"✅ Đã set assignee: {matched_user['displayName'] or matched_user['name']}")
+    return {'assignee': assignee_value}
+
+async def update_issue_async(issue_key, epic_link=None, assignee=None, description=None, trace=None):
+    """Cập nhật issue với epic link, assignee và description (job trong job queue).
+    trace = span của webhook đã tạo job (span của job nằm trong trace đó).
+    Lỗi tạm thời của Jira (429, 5xx, mạng) được raise để job queue retry"""
+    if jira is None:
+        # Lỗi tạm thời: job queue thử lại sau khi kết nối lại
+        raise JiraError(None, "Jira chưa kết nối")
+    with stage('background_update', trace, issue_key=issue_key):
+        await _update_issue(issue_key, epic_link, assignee, description)
+
+async def _update_issue(issue_key, epic_link, assignee, description=None):
     logger.info(f"🔄 Bắt đầu cập nhật {issue_key}: epic={epic_link}, assignee={assignee}")
     
     try:
-        issue = jira.issue(issue_key)
         update_fields = {}
         
+        # Description từ Gemini stream (issue được tạo trước với message gốc)
+        if description:
+            update_fields['description'] = description
+        
         # Gắn epic link - PHẢI tìm trên Jira trước
         if epic_link:
-            epic = find_epic(epic_link)
-            if epic:
-                logger.info(f"✅ Đã tìm thấy epic: {epic.key} - {epic.fields.summary}")
-                # Tìm epic link field ID
-                epic_field_id = find_epic_link_field_id(issue)
-                
-                if epic_field_id:
-                    # Thử nhiều format khác nhau
-                    formats_to_try = [
-                        epic.key,  # Format 1: string key
-                        {'key': epic.key},  # Format 2: dict với key
-                        {'id': epic.id},  # Format 3: dict với id
-                    ]
-                    
-                    epic_set = False
-                    for fmt in formats_to_try:
-                        try:
-                            update_fields[epic_field_id] = fmt
-                            epic_set = True
-                            break
-                        except Exception as e:
-                            continue
-                    
-                    if not epic_set:
-                        logger.error(f"❌ Không thể set epic link cho epic {epic.key}")
-            else:
-                logger.error(f"❌ KHÔNG tìm thấy epic '{epic_link}' trên Jira")
+            update_fields.update(await resolve_epic_field(epic_link))
         
-        # Gắn assignee - PHẢI tìm trên Jira trước
+        # Gắn assignee - tra danh bạ trong bộ nhớ trước, chỉ search trên Jira khi không có
         if assignee:
-            # Clean assignee: loại bỏ phần trong ngoặc đơn và thay thế \xa0 bằng space
-            assignee_clean = assignee.replace('\xa0', ' ').replace('\u00a0', ' ')  # Thay non-breaking space
-            assignee_clean = re.sub(r'\s*\([^)]+\)', '', assignee_clean).strip()
-            assignee_clean = re.sub(r'\s+', ' ', assignee_clean)  # Normalize spaces
             try:
-                # Tìm user trên Jira theo nhiều cách
-                users = []
-                
-                # Tạo nhiều search queries khác nhau
-                search_queries = []
-                
-                # 1. Tên đầy đủ đã clean
-                search_queries.append(assignee_clean)
-                
-                # 2. Tên gốc
-                search_queries.append(assignee)
-                
-                # 3. Từng phần của tên (nếu có nhiều từ)
-                name_parts = assignee_clean.split()
-                if len(name_parts) > 1:
-                    # Thử với họ và tên (2 từ đầu)
-                    if len(name_parts) >= 2:
-                        search_queries.append(f"{name_parts[0]} {name_parts[1]}")
-                    # Thử với tên cuối (có thể là username)
-                    search_queries.append(name_parts[-1])
-                
-                # 4. Loại bỏ dấu tiếng Việt và lowercase
-                import unicodedata
-                def remove_accents(text):
-                    nfd = unicodedata.normalize('NFD', text)
-                    return ''.join(c for c in nfd if unicodedata.category(c) != 'Mn')
-                
-                assignee_no_accent = remove_accents(assignee_clean).lower()
-                if assignee_no_accent != assignee_clean.lower():
-                    search_queries.append(assignee_no_accent)
-                
-                # 5. Chỉ tên cuối (có thể là username)
-                if len(name_parts) > 1:
-                    last_name_no_accent = remove_accents(name_parts[-1]).lower()
-                    search_queries.append(last_name_no_accent)
-                
-                # Loại bỏ duplicates
-                search_queries = list(dict.fromkeys(search_queries))
-                
-                # Thử từng query
-                for query in search_queries:
-                    try:
-                        users = jira.search_users(query, maxResults=10)
-                        if users:
-                            break
-                    except Exception as e:
-                        continue
-                
-                if users:
-                    # Tìm user phù hợp nhất (exact match hoặc partial match)
-                    matched_user = None
-                    assignee_lower = assignee_clean.lower().strip()
-                    
-                    # Import để loại bỏ dấu
-                    import unicodedata
-                    def remove_accents(text):
-                        nfd = unicodedata.normalize('NFD', text)
-                        return ''.join(c for c in nfd if unicodedata.category(c) != 'Mn')
-                    
-                    assignee_no_accent = remove_accents(assignee_lower)
-                    
-                    for user in users:
-                        # Kiểm tra displayName - ưu tiên exact match
-                        if hasattr(user, 'displayName') and user.displayName:
-                            user_display = user.displayName
-                            # Loại bỏ phần trong ngoặc đơn khi so sánh
-                            user_display_clean = re.sub(r'\s*\([^)]+\)', '', user_display).strip()
-                            user_display_clean = user_display_clean.replace('\xa0', ' ').replace('\u00a0', ' ')
-                            user_display_clean = re.sub(r'\s+', ' ', user_display_clean)
-                            user_display_lower = user_display_clean.lower()
-                            user_display_no_accent = remove_accents(user_display_lower)
-                            
-                            # So sánh với nhiều cách
-                            match_reasons = []
-                            if assignee_lower == user_display_lower:
-                                match_reasons.append("exact match")
-                            elif assignee_no_accent == user_display_no_accent:
-                                match_reasons.append("exact match (no accent)")
-                            elif assignee_lower in user_display_lower:
-                                match_reasons.append("assignee in displayName")
-                            elif assignee_no_accent in user_display_no_accent:
-                                match_reasons.append("assignee in displayName (no accent)")
-                            else:
-                                # So sánh từng từ: nếu tất cả từ trong assignee đều có trong displayName
-                                assignee_words = set(assignee_lower.split())
-                                display_words = set(user_display_lower.split())
-                                if assignee_words and assignee_words.issubset(display_words):
-                                    match_reasons.append("all words match")
-                            
-                            if match_reasons:
-                                matched_user = user
-                                logger.info(f"✅ Tìm thấy user: {user.displayName}")
-                                break
-                        
-                        # Kiểm tra emailAddress
-                        if not matched_user and hasattr(user, 'emailAddress') and user.emailAddress:
-                            if assignee_lower in user.emailAddress.lower():
-                                matched_user = user
-                                logger.info(f"✅ Tìm thấy user theo email: {user.emailAddress}")
-                                break
-                        
-                        # Kiểm tra name
-                        if not matched_user and hasattr(user, 'name') and user.name:
-                            user_name_lower = user.name.lower()
-                            user_name_no_accent = remove_accents(user_name_lower)
-                            
-                            if (assignee_lower == user_name_lower or
-                                assignee_no_accent == user_name_no_accent or
-                                assignee_lower in user_name_lower):
-                                matched_user = user
-                                logger.info(f"✅ Tìm thấy user theo name: {user.name}")
-                                break
-                    
-                    # Nếu không có exact match, lấy user đầu tiên
-                    if not matched_user and users:
-                        matched_user = users[0]
-                        logger.info(f"✅ Lấy user đầu tiên: {matched_user.displayName if hasattr(matched_user, 'displayName') else matched_user.name}")
-                    
-                    if matched_user:
-                        # Thử nhiều format để gắn assignee
-                        assignee_formats = []
-                        
-                        # Format 1: accountId (Jira Cloud)
-                        if hasattr(matched_user, 'accountId') and matched_user.accountId:
-                            assignee_formats.append({'accountId': matched_user.accountId})
-                        
-                        # Format 2: name (Jira Server)
-                        if hasattr(matched_user, 'name') and matched_user.name:
-                            assignee_formats.append({'name': matched_user.name})
-                        
-                        # Format 3: key
-                        if hasattr(matched_user, 'key') and matched_user.key:
-                            assignee_formats.append({'name': matched_user.key})
-                        
-                        # Format 4: emailAddress
-                        if hasattr(matched_user, 'emailAddress') and matched_user.emailAddress:
-                            assignee_formats.append({'name': matched_user.emailAddress})
-                        
-                        # Thử từng format
-                        assignee_set = False
-                        for fmt in assignee_formats:
-                            try:
-                                update_fields['assignee'] = fmt
-                                assignee_set = True
-                                logger.info(f"✅ Đã set assignee: {matched_user.displayName if hasattr(matched_user, 'displayName') else matched_user.name}")
-                                break
-                            except Exception as e:
-                                continue
-                        
-                        if not assignee_set:
-                            logger.error(f"❌ Không thể set assignee cho user {matched_user}")
-                    else:
-                        logger.error(f"❌ KHÔNG tìm thấy user '{assignee_clean}' trên Jira")
-                else:
-                    logger.error(f"❌ KHÔNG tìm thấy user '{assignee}' trên Jira")
-                        
+                update_fields.update(await resolve_assignee_field(assignee))
             except Exception as e:
+                if is_retryable(e):
+                    raise
                 logger.error(f"❌ Lỗi khi tìm/gắn assignee: {e}")
                 import traceback
                 logger.error(traceback.format_exc())
@@ -711,9 +1110,12 @@ def update_issue_async(issue_key, epic_link=None, assignee=None):
         if update_fields:
             logger.info(f"📝 Cập nhật {issue_key} với fields: {update_fields}")
             try:
-                issue.update(fields=update_fields)
+                with span('jira_update', issue_key=issue_key, fields=sorted(update_fields)):
+                    await jira.update_issue(issue_key, update_fields)
                 logger.info(f"✅ Đã cập nhật thành công {issue_key}")
             except Exception as e:
+                if is_retryable(e):
+                    raise
                 logger.error(f"❌ Lỗi khi update issue: {e}")
                 import traceback
                 logger.error(traceback.format_exc())
@@ -721,29 +1123,192 @@ def update_issue_async(issue_key, epic_link=None, assignee=None):
             logger.info(f"ℹ️ Không có gì để cập nhật cho {issue_key}")
             
     except Exception as e:
+        errors_total.inc(stage='background_update', type=type(e).__name__)
+        if is_retryable(e):
+            raise
         logger.error(f"❌ Lỗi khi cập nhật issue {issue_key}: {e}")
         import traceback
         logger.error(traceback.format_exc())
 
-async def process_with_timeout(message_text, background_tasks: BackgroundTasks):
-    """Xử lý với timeout để đảm bảo response trong <5s"""
-    import time
+async def resolve_fields_before_create(epic_link, assignee, timeout):
+    """Resolve epic/assignee trước khi tạo issue để gửi luôn trong create_issue.
+    Trả về (fields, epic_link còn lại, assignee còn lại) - phần còn lại cập nhật trong background"""
+    fields = {}
+    # Chưa biết field id của Epic Link thì không đoán, để background cập nhật
+    epic_field_id = epic_link_field_id() if field_metadata.loaded else None
+    inline_epic = epic_link if epic_field_id else None
+    
+    # Tra cache trong bộ nhớ trước (không tốn round trip)
+    if inline_epic:
+        epic = epic_index.lookup(inline_epic)
+        record_cache_lookup('epic_index', epic)
+        if epic:
+            fields[epic_field_id] = epic['key']
+            epic_link = inline_epic = None
+    if assignee:
+        user = user_directory.lookup(clean_person_name(assignee))
+        record_cache_lookup('user_directory', user)
+        assignee_value = assignee_field_value(user) if user else None
+        if assignee_value:
+            fields['assignee'] = assignee_value
+            assignee = None
+    
+    # Cache không có: thử tìm trên Jira trong thời gian cho phép, quá hạn thì để background
+    lookups = {}
+    if inline_epic:
+        lookups['epic_link'] = asyncio.ensure_future(resolve_epic_field(inline_epic))
+    if assignee:
+        lookups['assignee'] = asyncio.ensure_future(resolve_assignee_field(assignee))
+    if lookups and timeout > 0:
+        done, pending = await asyncio.wait(lookups.values(), timeout=timeout)
+        for task in pending:
+            task.cancel()
+            timeouts_total.inc(stage='inline_resolve')
+        for name, task in lookups.items():
+            if task in done and not task.exception():
+                # Đã tìm xong (kể cả không thấy) thì background không cần tìm lại
+                fields.update(task.result())
+                if name == 'epic_link':
+                    epic_link = None
+                else:
+                    assignee = None
+    else:
+        for task in lookups.values():
+            task.cancel()
+    return fields, epic_link, assignee
+
+def is_field_error(error_str):
+    """Lỗi do screen không cho phép set field (hoặc user không được assign)"""
+    return ('cannot be set' in error_str or 'not on the appropriate screen' in error_str
+            or 'cannot be assigned' in error_str)
+
+async def create_issue_with_fallback(issue_dict, timeout):
+    """Tạo issue; nếu một số fields không được phép thì tạo với minimal fields rồi update sau"""
+    try:
+        return await jira.create_issue(issue_dict, timeout=timeout)
+    except Exception as e:
+        if not is_field_error(str(e)):
+            raise
+        logger.warning(f"⚠️ Một số fields không được phép, thử với minimal fields...")
+        fallbacks_total.inc(reason='minimal_fields')
+    
+    minimal_dict = {
+        'project': issue_dict['project'],
+        'issuetype': issue_dict['issuetype']
+    }
+    try:
+        new_issue = await jira.create_issue(minimal_dict)
+    except Exception as e2:
+        logger.error(f"❌ Lỗi khi tạo issue với minimal fields: {e2}")
+        raise
+    # Sau đó update với các field khác
+    update_fields = {field: issue_dict[field] for field in ('summary', 'description') if issue_dict.get(field)}
+    if update_fields:
+        try:
+            await jira.update_issue(new_issue['key'], update_fields)
+        except Exception as e2:
+            logger.warning(f"⚠️ Không thể update fields sau khi tạo: {e2}")
+    return new_issue
+
+def prepare_issue(task_info):
+    """Dựng fields cho create_issue từ kết quả parse, trả về (issue_dict, epic_link, assignee)"""
+    summary = task_info.get('summary', 'No summary')
+    issue_type = task_info.get('issuetype', 'Task')
+    
+    # Tạo issue dict với minimal fields trước
+    issue_dict = {
+        'project': {'key': JIRA_PROJECT_KEY},
+        'issuetype': {'name': issue_type}
+    }
+    
+    # Thêm các field khác (có thể bị lỗi nếu screen không cho phép)
+    try:
+        issue_dict['summary'] = summary
+        issue_dict['description'] = task_info.get('description', 'No description')
+        issue_dict['priority'] = priority_field_value(task_info.get('priority', 'Medium'))
+    except Exception as e:
+        logger.warning(f"⚠️ Không thể thêm một số fields: {e}")
+
+    # Nếu là Epic, bắt buộc phải có Epic Name
+    epic_name_field = field_metadata.field_id('epic_name')
+    if issue_type == 'Epic' and epic_name_field:
+        issue_dict[epic_name_field] = summary
+
+    epic_link = task_info.get('epic_link')
+    assignee = task_info.get('assignee')
+    
+    # Normalize: nếu epic_link là empty string hoặc None, set thành None
+    if epic_link and isinstance(epic_link, str) and epic_link.strip():
+        epic_link = epic_link.strip()
+    else:
+        epic_link = None
+        
+    if assignee and isinstance(assignee, str) and assignee.strip():
+        # Clean non-breaking space và normalize
+        assignee = assignee.replace('\xa0', ' ').replace('\u00a0', ' ')
+        assignee = re.sub(r'\s+', ' ', assignee).strip()
+    else:
+        assignee = None
+    return issue_dict, epic_link, assignee
+
+def record_parse_path(path):
+    """Đếm nhánh parse được dùng (rules = fast path, race_* = bên thắng khi race)"""
+    parse_path_total.inc(path=path)
+    annotate(parse_path=path)
+    logger.info(f"📊 Parse path: {path} ({parse_path_total.value(path=path)} lần)")
+
+async def process_with_timeout(message_text, budget=Config.WEBHOOK_RESPONSE_TIMEOUT, ai_budget=Config.AI_TIMEOUT):
+    """Xử lý với timeout để đảm bảo response trong <5s (chế độ bất đồng bộ truyền budget/ai_budget lớn hơn)"""
     start_time = time.time()
+    stream_rest = None
     
     try:
-        # Wrap blocking call trong thread executor
-        loop = asyncio.get_event_loop()
+        if jira is None:
+            # Chưa kết nối xong hoặc đang kết nối lại: trả lời ngay, không lưu vào idempotency để Teams gửi lại được
+            logger.warning("⚠️ Jira chưa kết nối, bỏ qua message")
+            return {"success": False, "message": Messages.NOT_READY}
+        if jira_limiter.saturated():
+            # Hàng đợi Jira đã đầy: từ chối ngay thay vì gọi Gemini rồi mới hết hạn ở bước tạo issue
+            logger.warning("🚦 Jira quá tải, từ chối message")
+            shed_total.inc(dependency='jira')
+            return {"success": False, "message": Messages.OVERLOADED}
+        if is_batch_message(message_text):
+            return await process_batch(message_text, start_time, budget, ai_budget)
         
-        # 1. AI phân tích (KHÔNG timeout riêng, để tổng timeout quản lý)
+        # 1. Parser cục bộ trước: đủ tự tin thì tạo issue luôn, không gọi Gemini
         ai_start = time.time()
-        try:
-            task_info = await asyncio.wait_for(
-                loop.run_in_executor(None, ask_gemini_to_parse_task, message_text),
-                timeout=Config.AI_TIMEOUT  # 2.8s cho AI
-            )
-        except asyncio.TimeoutError:
-            logger.warning("⚠️ AI timeout, dùng fallback parsing")
-            task_info = quick_parse_fallback(message_text)
+        local_info = quick_parse_fallback(message_text)
+        confidence = local_info['confidence']
+        if confidence >= Config.FAST_PATH_CONFIDENCE:
+            logger.info(f"⚡ Fast path (confidence {confidence:.2f}), bỏ qua Gemini")
+            task_info = local_info
+            record_parse_path('rules')
+        elif not gemini_breaker.allow():
+            # Gemini đang ngắt mạch: dùng kết quả cục bộ ngay, không chờ timeout
+            task_info = local_info
+            record_parse_path('breaker_open')
+            fallbacks_total.inc(reason='breaker_open')
+        else:
+            # Chế độ race: chỉ chờ Gemini một khoảng ngắn, quá thì dùng kết quả cục bộ
+            race = Config.FAST_PATH_RACE and confidence >= Config.FAST_PATH_RACE_MIN_CONFIDENCE
+            ai_timeout = Config.FAST_PATH_RACE_WINDOW if race else ai_budget
+            # Hết timeout thì request tới Gemini bị hủy (không giữ thread nào)
+            try:
+                if Config.STREAM_PARSE:
+                    # Tạo issue ngay khi stream có đủ summary/issuetype/priority, phần còn lại cập nhật sau
+                    task_info, stream_rest = await ask_gemini_to_parse_task_streaming(message_text, ai_timeout)
+                else:
+                    task_info = await asyncio.wait_for(
+                        ask_gemini_to_parse_task(message_text, ai_timeout),
+                        timeout=ai_timeout
+                    )
+                record_parse_path('race_gemini' if race else 'gemini_stream' if Config.STREAM_PARSE else 'gemini')
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ AI timeout, dùng fallback parsing")
+                task_info = local_info
+                record_parse_path('race_rules' if race else 'timeout_fallback')
+                timeouts_total.inc(stage='gemini_parse')
+                fallbacks_total.inc(reason='ai_timeout')
         
         ai_time = time.time() - ai_start
         logger.info(f"⏱️ AI processing time: {ai_time:.2f}s")
@@ -751,128 +1316,199 @@ async def process_with_timeout(message_text, background_tasks: BackgroundTasks):
         if not task_info:
             task_info = quick_parse_fallback(message_text)
 
-        # 2. Tạo Jira issue nhanh (chỉ với thông tin cơ bản để tránh timeout)
-        summary = task_info.get('summary', 'No summary')
-        issue_type = task_info.get('issuetype', 'Task')
+        # 2. Chuẩn bị fields của Jira issue, chuẩn hóa epic link và assignee
+        issue_dict, epic_link, assignee = prepare_issue(task_info)
+        summary = issue_dict['summary']
+        issue_type = issue_dict['issuetype']['name']
         
-        # Tạo issue dict với minimal fields trước
-        issue_dict = {
-            'project': {'key': JIRA_PROJECT_KEY},
-            'issuetype': {'name': issue_type}
-        }
+        def remaining_time():
+            return max(budget - (time.time() - start_time), 0.1)
         
-        # Thêm các field khác (có thể bị lỗi nếu screen không cho phép)
-        try:
-            issue_dict['summary'] = summary
-            issue_dict['description'] = task_info.get('description', 'No description')
-            issue_dict['priority'] = {'name': task_info.get('priority', 'Medium')}
-        except Exception as e:
-            logger.warning(f"⚠️ Không thể thêm một số fields: {e}")
-
-        # Nếu là Epic, bắt buộc phải có Epic Name
-        if issue_type == 'Epic':
-            try:
-                issue_dict['customfield_10104'] = summary
-            except:
-                pass
+        # Resolve được nhanh (cache hoặc Jira trong thời hạn) thì gửi luôn trong create_issue
+        resolve_timeout = min(Config.INLINE_RESOLVE_TIMEOUT, remaining_time() - Config.JIRA_CREATE_RESERVE)
+        inline_fields, pending_epic, pending_assignee = await resolve_fields_before_create(
+            epic_link, assignee, resolve_timeout
+        )
 
-        # Tạo issue ngay lập tức
+        # 3. Tạo issue, timeout riêng cho lần gọi này = thời gian còn lại của webhook
         jira_start = time.time()
-        try:
-            new_issue = await loop.run_in_executor(
-                None, 
-                lambda: jira.create_issue(fields=issue_dict)
-            )
-        except Exception as e:
-            # Nếu lỗi do fields không được phép, thử với minimal fields
-            error_str = str(e)
-            if 'cannot be set' in error_str or 'not on the appropriate screen' in error_str:
-                logger.warning(f"⚠️ Một số fields không được phép, thử với minimal fields...")
-                minimal_dict = {
-                    'project': {'key': JIRA_PROJECT_KEY},
-                    'issuetype': {'name': issue_type}
-                }
+        new_issue = None
+        with stage('jira_create') as create_span:
+            if inline_fields:
                 try:
-                    new_issue = await loop.run_in_executor(
-                        None,
-                        lambda: jira.create_issue(fields=minimal_dict)
-                    )
-                    # Sau đó update với các field khác trong background
-                    update_fields = {}
-                    if summary:
-                        update_fields['summary'] = summary
-                    if task_info.get('description'):
-                        update_fields['description'] = task_info.get('description')
-                    if update_fields:
-                        try:
-                            new_issue.update(fields=update_fields)
-                        except Exception as e2:
-                            logger.warning(f"⚠️ Không thể update fields sau khi tạo: {e2}")
-                except Exception as e2:
-                    logger.error(f"❌ Lỗi khi tạo issue với minimal fields: {e2}")
-                    raise
-            else:
-                raise
+                    new_issue = await jira.create_issue({**issue_dict, **inline_fields}, timeout=remaining_time())
+                    logger.info(f"✅ Đã gắn luôn khi tạo: {inline_fields}")
+                except Exception as e:
+                    if not is_field_error(str(e)):
+                        raise
+                    logger.warning(f"⚠️ Không set được epic/assignee khi tạo, sẽ cập nhật trong background: {e}")
+                    fallbacks_total.inc(reason='inline_fields_rejected')
+                    pending_epic, pending_assignee = epic_link, assignee
+            if new_issue is None:
+                new_issue = await create_issue_with_fallback(issue_dict, timeout=remaining_time())
+            create_span['issue_key'] = new_issue['key']
         
         jira_time = time.time() - jira_start
         logger.info(f"⏱️ Jira create time: {jira_time:.2f}s")
         
-        issue_url = f"{JIRA_SERVER}/browse/{new_issue.key}"
-        
-        # 3. Thêm background task để cập nhật epic link và assignee
-        epic_link = task_info.get('epic_link')
-        assignee = task_info.get('assignee')
-        
-        # Normalize: nếu epic_link là empty string hoặc None, set thành None
-        if epic_link and isinstance(epic_link, str) and epic_link.strip():
-            epic_link = epic_link.strip()
-        else:
-            epic_link = None
-            
-        if assignee and isinstance(assignee, str) and assignee.strip():
-            # Clean non-breaking space và normalize
-            assignee = assignee.replace('\xa0', ' ').replace('\u00a0', ' ')
-            assignee = re.sub(r'\s+', ' ', assignee).strip()
-        else:
-            assignee = None
+        issue_url = f"{JIRA_SERVER}/browse/{new_issue['key']}"
         
-        if epic_link or assignee:
-            logger.info(f"📋 Sẽ cập nhật {new_issue.key} trong background: epic={epic_link}, assignee={assignee}")
-            # FastAPI BackgroundTasks có thể chạy sync function trực tiếp
-            background_tasks.add_task(update_issue_async, new_issue.key, epic_link, assignee)
+        # 4. Phần chưa resolve được thì đưa vào job queue để cập nhật trong background
+        if stream_rest:
+            update_after_stream(new_issue['key'], stream_rest, message_text)
+            stream_rest = None  # Đã giao cho task cập nhật sau
+        if pending_epic or pending_assignee:
+            logger.info(f"📋 Sẽ cập nhật {new_issue['key']} trong background: epic={pending_epic}, assignee={pending_assignee}")
+            await job_queue.enqueue('update_issue', issue_key=new_issue['key'], epic_link=pending_epic, assignee=pending_assignee,
+                                    trace=current_context())
         else:
-            logger.info(f"ℹ️ Không có epic_link hoặc assignee để cập nhật cho {new_issue.key}")
+            logger.info(f"ℹ️ Không có epic_link hoặc assignee cần cập nhật thêm cho {new_issue['key']}")
         
         total_time = time.time() - start_time
-        logger.info(f"⏱️ Total processing time: {total_time:.2f}s")
+        annotate(issue_key=new_issue['key'])
+        logger.info(f"⏱️ Total processing time: {total_time:.2f}s (trace {tracing.trace_id()})")
         
         return {
             "success": True,
-            "message": Messages.success(issue_type, new_issue.key, issue_url, summary),
-            "issue_key": new_issue.key
+            "message": Messages.success(issue_type, new_issue['key'], issue_url, summary),
+            "issue_key": new_issue['key']
         }
         
     except asyncio.TimeoutError:
         elapsed = time.time() - start_time
         logger.error(f"❌ Timeout khi xử lý request sau {elapsed:.2f}s")
+        timeouts_total.inc(stage='process')
         return {"success": False, "message": Messages.error("Quá thời gian xử lý (>5s)")}
+    except Overloaded as e:
+        logger.warning(f"🚦 {e}, từ chối message")
+        shed_total.inc(dependency=e.dependency)
+        return {"success": False, "message": Messages.OVERLOADED}
     except Exception as e:
         logger.error(f"❌ Lỗi: {e}")
+        errors_total.inc(stage='process', type=type(e).__name__)
         return {"success": False, "message": Messages.error(str(e))}
+    finally:
+        if stream_rest:
+            # Không tạo được issue (lỗi, timeout, bị hủy): dừng phần còn lại của stream
+            stream_rest.cancel()
+
+async def process_batch(message_text, start_time, budget, ai_budget):
+    """Message nhiều issue: một lần gọi Gemini, một lần bulk create, một reply liệt kê mọi key"""
+    ai_start = time.time()
+    try:
+        tasks = await asyncio.wait_for(ask_gemini_to_parse_tasks(message_text, ai_budget), timeout=ai_budget)
+        record_parse_path('batch_gemini')
+    except asyncio.TimeoutError:
+        logger.warning("⚠️ AI timeout, dùng fallback parsing cho batch")
+        tasks = quick_parse_batch_fallback(message_text)
+        record_parse_path('batch_timeout_fallback')
+        timeouts_total.inc(stage='gemini_parse')
+        fallbacks_total.inc(reason='ai_timeout')
+    logger.info(f"⏱️ AI processing time: {time.time() - ai_start:.2f}s ({len(tasks)} issue)")
+    
+    # Quá giới hạn của Jira bulk create: tạo BATCH_MAX_ISSUES mục đầu, báo số mục bị bỏ qua trong reply
+    skipped = max(len(tasks) - Config.BATCH_MAX_ISSUES, 0)
+    if skipped:
+        logger.warning(f"⚠️ Batch có {len(tasks)} mục, bỏ qua {skipped} mục vượt giới hạn {Config.BATCH_MAX_ISSUES}")
+        annotate(batch_skipped=skipped)
+    tasks = tasks[:Config.BATCH_MAX_ISSUES]
+    prepared = [prepare_issue(task_info) for task_info in tasks]
+    
+    def remaining_time():
+        return max(budget - (time.time() - start_time), 0.1)
+    
+    # Resolve epic/assignee cho tất cả issue song song, trong cùng một thời hạn
+    resolve_timeout = min(Config.INLINE_RESOLVE_TIMEOUT, remaining_time() - Config.JIRA_CREATE_RESERVE)
+    resolved = await asyncio.gather(*[
+        resolve_fields_before_create(epic_link, assignee, resolve_timeout)
+        for _, epic_link, assignee in prepared
+    ])
+    
+    jira_start = time.time()
+    with stage('jira_create', issues=len(prepared)):
+        result = await jira.create_issues(
+            [{**issue_dict, **inline_fields} for (issue_dict, _, _), (inline_fields, _, _) in zip(prepared, resolved)],
+            timeout=remaining_time()
+        )
+        new_issues = [None] * len(prepared)
+        for issue, index in zip(result.get('issues', []), successful_indexes(len(prepared), result.get('errors', []))):
+            new_issues[index] = issue
+    
+        # Issue bulk create lỗi (thường do field không được phép): tạo lại từng cái, epic/assignee để background
+        failed = []
+        retry_indexes = [i for i, issue in enumerate(new_issues) if issue is None]
+        if retry_indexes:
+            logger.warning(f"⚠️ Bulk create lỗi {len(retry_indexes)} issue, tạo lại từng issue")
+            fallbacks_total.inc(len(retry_indexes), reason='bulk_create_retry')
+            retried = await asyncio.gather(
+                *[create_issue_with_fallback(prepared[i][0], timeout=remaining_time()) for i in retry_indexes],
+                return_exceptions=True
+            )
+            for i, issue in zip(retry_indexes, retried):
+                if isinstance(issue, Exception):
+                    failed.append((prepared[i][0]['summary'], str(issue)))
+                else:
+                    new_issues[i] = issue
+                    resolved[i] = ({}, prepared[i][1], prepared[i][2])
+    logger.info(f"⏱️ Jira bulk create time: {time.time() - jira_start:.2f}s")
+    
+    created = []
+    for (issue_dict, _, _), (_, pending_epic, pending_assignee), new_issue in zip(prepared, resolved, new_issues):
+        if new_issue is None:
+            continue
+        created.append({
+            'issuetype': issue_dict['issuetype']['name'],
+            'key': new_issue['key'],
+            'url': f"{JIRA_SERVER}/browse/{new_issue['key']}",
+            'summary': issue_dict['summary'],
+        })
+        if pending_epic or pending_assignee:
+            await job_queue.enqueue('update_issue', issue_key=new_issue['key'], epic_link=pending_epic, assignee=pending_assignee,
+                                    trace=current_context())
+    
+    annotate(issue_keys=[issue['key'] for issue in created])
+    logger.info(f"⏱️ Total processing time: {time.time() - start_time:.2f}s (trace {tracing.trace_id()})")
+    return {
+        "success": bool(created),
+        "message": (Messages.batch_success(created, failed, skipped) if created
+                    else Messages.error(failed[0][1] if failed else "Không tạo được issue nào")),
+        "issue_keys": [issue['key'] for issue in created],
+    }
+
+def successful_indexes(total, errors):
+    """Vị trí (trong request) của các issue bulk create thành công, theo thứ tự Jira trả về"""
+    failed_indexes = {error.get('failedElementNumber') for error in errors}
+    return [i for i in range(total) if i not in failed_indexes]
 
 @app.post("/webhook/teams")
-async def teams_webhook(request: Request, background_tasks: BackgroundTasks):
+async def teams_webhook(request: Request):
+    # Mỗi webhook một trace: span của các bước (kể cả job cập nhật chạy sau) nằm dưới span này
+    with request_seconds.time(), span('webhook'):
+        if profiler.running:
+            # Đang profile theo số request: đếm webhook để dừng đúng lúc
+            with profiler.request():
+                return await handle_teams_message(request)
+        return await handle_teams_message(request)
+
+async def handle_teams_message(request):
     try:
         data = await request.json()
         raw_text = data.get("text", "")
-        message_text = clean_teams_message(raw_text)
+        annotate(activity_id=data.get('id'))
+        with stage('clean'):
+            message_text = clean_teams_message(raw_text)
         
         # Bỏ tag mention của bot
         message_text = message_text.replace(Config.BOT_MENTION_NAME, "").strip()
 
-        # Xử lý với timeout tổng 4s (để đảm bảo response <5s)
-        result = await asyncio.wait_for(
-            process_with_timeout(message_text, background_tasks),
+        if reply_sender:
+            return await enqueue_reply(data, message_text)
+
+        # Xử lý với timeout tổng 4.9s (để đảm bảo response <5s).
+        # Teams gửi lại cùng message thì chờ/lấy kết quả lần đầu, không gọi AI/Jira lần nữa
+        result = await idempotency_store.run(
+            idempotency_key(data),
+            lambda: process_with_timeout(message_text),
             timeout=Config.WEBHOOK_RESPONSE_TIMEOUT
         )
         
@@ -883,17 +1519,119 @@ async def teams_webhook(request: Request, background_tasks: BackgroundTasks):
         
     except asyncio.TimeoutError:
         logger.error("❌ Webhook timeout")
+        timeouts_total.inc(stage='webhook')
         return {
             "type": "message",
             "text": Messages.error("Webhook timeout (>5s)")
         }
     except Exception as e:
         logger.error(f"❌ Lỗi webhook: {e}")
+        errors_total.inc(stage='webhook', type=type(e).__name__)
         return {
             "type": "message",
             "text": Messages.error(str(e))
         }
 
+async def enqueue_reply(activity, message_text):
+    """Chế độ bất đồng bộ: đưa message vào reply_queue và trả lời Teams ngay bằng Messages.PROCESSING"""
+    key = idempotency_key(activity)
+    cached = await idempotency_store.get(key)
+    if cached is not None:
+        logger.info(f"♻️ Message đã xử lý ({key}), trả lại kết quả cũ")
+        return {"type": "message", "text": cached["message"]}
+    job_id = await reply_queue.enqueue(
+        'reply_message', key=key, message_text=message_text,
+        reply_to=activity.get('id'), conversation=activity.get('conversation'), received_at=time.time(),
+        trace=current_context(),
+    )
+    if job_id is None:
+        logger.info(f"⏳ Message đang chờ xử lý ({key}), không thêm job")
+    return {"type": "message", "text": Messages.PROCESSING}
+
+async def reply_async(key, message_text, reply_to, conversation, received_at, trace=None):
+    """Job của reply_queue: xử lý message với ngân sách đầy đủ rồi POST kết quả tới callback URL.
+    trace = span của webhook đã nhận message"""
+    with span('reply_job', trace, key=key):
+        await _reply_async(key, message_text, reply_to, conversation, received_at)
+
+async def _reply_async(key, message_text, reply_to, conversation, received_at):
+    if jira is None:
+        # Job chờ kết nối Jira (thử lại có backoff) thay vì trả về NOT_READY như webhook đồng bộ
+        raise JiraError(None, "Jira chưa kết nối")
+    # Chung idempotency với webhook: job chạy lại sau lỗi POST (hay sau restart) không tạo issue lần nữa
+    process = lambda: process_with_timeout(message_text, Config.ASYNC_PROCESS_TIMEOUT, Config.ASYNC_AI_TIMEOUT)
+    try:
+        result = await idempotency_store.run(key, process, timeout=Config.ASYNC_PROCESS_TIMEOUT)
+    except asyncio.TimeoutError:
+        # Lần xử lý vẫn chạy tiếp (có thể vẫn tạo được issue): chờ kết quả thật thay vì báo lỗi cho người dùng
+        logger.warning(f"⏳ Xử lý {key} quá {Config.ASYNC_PROCESS_TIMEOUT}s, chờ kết quả thật")
+        timeouts_total.inc(stage='async_process')
+        result = await idempotency_store.run(key, process, timeout=None)
+
+    reply = {"type": "message", "text": result["message"]}
+    if reply_to:
+        reply["replyToId"] = reply_to
+    if conversation:
+        reply["conversation"] = conversation
+    with stage('reply_post'):
+        await reply_sender.send(reply)
+    stage_seconds.observe(time.time() - received_at, stage='async_reply')
+    logger.info(f"📨 Đã gửi kết quả {key} sau {time.time() - received_at:.2f}s")
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: process đang chạy và event loop còn phản hồi"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 khi Jira, Gemini đã kết nối và các cache đã tải lần đầu, ngược lại 503"""
+    components = readiness()
+    ready = all(components.values())
+    return JSONResponse(
+        {"status": "ready" if ready else "not_ready", "components": components},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Metrics theo Prometheus text format (histogram p95/p99 từng bước, timeout, fallback, cache, lỗi)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def is_admin(request):
+    authorization = request.headers.get('authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(authorization.encode(), f'Bearer {ADMIN_TOKEN}'.encode())
+
+@app.post("/admin/profile")
+async def profile_endpoint(request: Request, seconds: float = None, requests: int = None, format: str = 'collapsed'):
+    """Profile event loop trong seconds giây hoặc trong requests webhook tiếp theo (tối đa PROFILE_MAX_SECONDS),
+    trả về collapsed stacks (text) hoặc pstats (file cho python -m pstats / snakeviz)"""
+    if not ADMIN_TOKEN:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    if not is_admin(request):
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    if format not in ('collapsed', 'pstats') or (seconds is not None and seconds <= 0) or (requests is not None and requests <= 0):
+        return JSONResponse({"detail": "format phải là collapsed/pstats, seconds và requests phải > 0"}, status_code=400)
+    if seconds is None:
+        seconds = Config.PROFILE_MAX_SECONDS if requests else Config.PROFILE_DEFAULT_SECONDS
+    logger.info(f"🔬 Bắt đầu profile: {f'{requests} request, ' if requests else ''}tối đa {seconds}s")
+    try:
+        profile = await profiler.run(Config.PROFILE_INTERVAL, min(seconds, Config.PROFILE_MAX_SECONDS), requests)
+    except ProfilerBusy:
+        return JSONResponse({"detail": "Đang có một lần profile khác"}, status_code=409)
+    logger.info(f"🔬 Profile xong: {profile.samples} mẫu, {profile.idle} mẫu rảnh, {profile.requests} request "
+                f"trong {profile.duration:.1f}s")
+    headers = {
+        'X-Profile-Samples': str(profile.samples),
+        'X-Profile-Idle-Samples': str(profile.idle),
+        'X-Profile-Requests': str(profile.requests),
+        'X-Profile-Duration': f'{profile.duration:.3f}',
+    }
+    if format == 'pstats':
+        headers['Content-Disposition'] = 'attachment; filename="jirabot.pstats"'
+        return Response(profile.pstats(), media_type='application/octet-stream', headers=headers)
+    return PlainTextResponse(profile.collapsed(), headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
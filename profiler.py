@@ -0,0 +1,150 @@
+"""
+Sampling profiler bật theo yêu cầu (endpoint admin): thread riêng lấy mẫu stack của thread event loop mỗi
+interval giây, gộp thành collapsed stacks (flamegraph.pl, speedscope) hoặc file pstats.
+Không dùng sys.setprofile nên request không chậm đi; khi không profile thì không có thread nào chạy
+"""
+import asyncio
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Lá của stack khi event loop đang chờ I/O (không tốn CPU): không tính vào kết quả
+IDLE_FRAMES = {('selectors.py', 'select')}
+# Phần stack từ uvicorn tới event loop giống nhau ở mọi mẫu: cắt đi, stack bắt đầu từ callback/task đang chạy
+LOOP_FRAME = (os.path.join('asyncio', 'events.py'), '_run')
+
+class ProfilerBusy(Exception):
+    """Đang có một lần profile khác"""
+
+def frame_label(key):
+    filename, lineno, name = key
+    return f"{name} ({os.sep.join(filename.split(os.sep)[-2:])}:{lineno})"
+
+class Profile:
+    """Kết quả một lần profile: số mẫu theo stack (tuple (filename, firstlineno, name), từ gốc tới lá)"""
+
+    def __init__(self, stacks, idle, interval, duration, requests):
+        self.stacks = stacks
+        self.idle = idle  # Số mẫu event loop đang rảnh
+        self.interval = interval
+        self.duration = duration
+        self.requests = requests  # Số webhook hoàn thành trong lúc profile
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        """Mỗi dòng "gốc;...;lá số_mẫu", nhiều mẫu nhất trước"""
+        return ''.join(
+            f"{';'.join(frame_label(key) for key in stack)} {count}\n"
+            for stack, count in self.stacks.most_common()
+        )
+
+    def pstats(self):
+        """Dữ liệu cho pstats.Stats (marshal): thời gian = số mẫu x interval, số lần gọi = số mẫu"""
+        stats = {}
+        for stack, count in self.stacks.items():
+            seconds = count * self.interval
+            counted = set()
+            for depth in range(len(stack) - 1, -1, -1):
+                key = stack[depth]
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                leaf = depth == len(stack) - 1
+                if leaf:
+                    entry[2] += seconds
+                if key not in counted:
+                    # Hàm đệ quy xuất hiện nhiều lần trong một stack chỉ tính thời gian tích lũy một lần
+                    counted.add(key)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth:
+                    caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[3] += seconds
+                    if leaf:
+                        caller[2] += seconds
+        return marshal.dumps({
+            key: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+            for key, (cc, nc, tt, ct, callers) in stats.items()
+        })
+
+class SamplingProfiler:
+    """Mỗi lần chỉ một profile: trong seconds giây, hoặc tới khi requests webhook hoàn thành (chỉ lấy mẫu lúc
+    có webhook đang xử lý; task khác chạy cùng lúc trên event loop cũng được tính)"""
+
+    def __init__(self):
+        self.running = False  # Webhook chỉ kiểm tra cờ này khi không profile
+        self.in_flight = 0  # Webhook đang xử lý (chỉ đếm các webhook bắt đầu lúc đang profile)
+        self.completed = 0
+        self._target = None
+        self._done = None
+
+    @contextmanager
+    def request(self):
+        """Bọc một webhook trong lúc profile"""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            if self._done and self._target and self.completed >= self._target:
+                self._done.set()
+
+    async def run(self, interval, seconds=None, requests=None):
+        """Profile thread event loop hiện tại; requests=None thì lấy mẫu suốt seconds giây,
+        có requests thì dừng khi đủ requests webhook (tối đa seconds giây)"""
+        if self.running:
+            raise ProfilerBusy()
+        self.running = True
+        self.completed = 0
+        self._target = requests
+        self._done = asyncio.Event()
+        stacks, idle = Counter(), Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), interval, requests is not None, stacks, idle, stop),
+            name='profiler', daemon=True,
+        )
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self.running = False
+            self._done = None
+        return Profile(stacks, idle['idle'], interval, time.perf_counter() - start, self.completed)
+
+    def _sample(self, thread_id, interval, only_requests, stacks, idle, stop):
+        while not stop.wait(interval):
+            if only_requests and not self.in_flight:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if not stack:
+                continue
+            if (os.path.basename(stack[0][0]), stack[0][2]) in IDLE_FRAMES:
+                idle['idle'] += 1
+                continue
+            for depth, (filename, _, name) in enumerate(stack):
+                if name == LOOP_FRAME[1] and filename.endswith(LOOP_FRAME[0]):
+                    del stack[depth:]
+                    break
+            if stack:
+                stack.reverse()
+                stacks[tuple(stack)] += 1
@@ -0,0 +1,42 @@
+"""
+Gửi kết quả xử lý về Teams (callback URL) ở chế độ trả lời bất đồng bộ
+"""
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class ReplyError(Exception):
+    """Lỗi khi POST kết quả tới callback URL (status_code = None nếu lỗi mạng/timeout)"""
+
+    def __init__(self, status_code, text, url=None):
+        super().__init__(text)
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+    @property
+    def retryable(self):
+        """Lỗi tạm thời (mạng, timeout, 429, 5xx) - job queue thử lại có backoff"""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+    def __str__(self):
+        return f"ReplyError HTTP {self.status_code} url: {self.url}\n\ttext: {self.text}"
+
+class ReplySender:
+    """POST activity `{"type": "message", "text": ...}` tới callback URL, dùng chung connection pool"""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(timeout))
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def send(self, activity):
+        try:
+            response = await self._client.post(self.url, json=activity)
+        except httpx.HTTPError as e:
+            raise ReplyError(None, f"{type(e).__name__}: {e}", self.url) from e
+        if response.status_code >= 400:
+            raise ReplyError(response.status_code, response.text, self.url)
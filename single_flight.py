@@ -0,0 +1,49 @@
+"""
+Single-flight cho các lần tra cứu Jira: các lần gọi đồng thời cùng key dùng chung một lần gọi và kết quả,
+kèm negative cache ngắn cho kết quả "không tìm thấy" (None)
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+class SingleFlight:
+    def __init__(self, name, negative_ttl=0, max_negative_entries=1000):
+        self.name = name
+        self.negative_ttl = negative_ttl  # 0 = không nhớ kết quả None
+        self.max_negative_entries = max_negative_entries
+        self.coalesced = 0  # Số lần dùng chung lần gọi đang chạy (cộng dồn)
+        self.negative_hits = 0  # Số lần trả None từ negative cache (cộng dồn)
+        self._inflight = {}  # key -> asyncio.Task
+        self._negative = OrderedDict()  # key -> thời điểm hết hạn
+
+    async def do(self, key, factory):
+        """Kết quả của factory() cho key; đang có lần gọi cùng key thì chờ lần đó.
+        Caller bị hủy (timeout) thì lần gọi vẫn chạy tiếp cho các caller khác và để điền cache"""
+        expires_at = self._negative.get(key)
+        if expires_at is not None:
+            if time.monotonic() < expires_at:
+                self.negative_hits += 1
+                return None
+            del self._negative[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, factory))
+            # Không còn ai chờ thì lỗi của lần gọi cũng không bị báo "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _run(self, key, factory):
+        try:
+            result = await factory()
+            if result is None and self.negative_ttl:
+                self._negative[key] = time.monotonic() + self.negative_ttl
+                self._negative.move_to_end(key)
+                while len(self._negative) > self.max_negative_entries:
+                    self._negative.popitem(last=False)
+            return result
+        finally:
+            self._inflight.pop(key, None)
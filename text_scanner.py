@@ -0,0 +1,327 @@
+"""
+Tách epic link, assignee và phần instruction trong message mà không backtracking (thời gian gần tuyến tính)
+
+Các regex cũ dạng `gán\\s+cho\\s+([^\\n,]+?)(?:\\s+và|\\s+and|$)` được engine thử lại ở mọi vị trí bắt đầu và
+nới group lazy từng ký tự, nên dòng dài không có điểm kết thúc hoặc lặp lại "gán cho" tốn thời gian bình phương
+độ dài. Ở đây regex chỉ dùng để khớp neo tại một vị trí (từ khóa, một dải khoảng trắng); điểm kết thúc gần nhất
+và ký tự dừng gần nhất được tra bằng bisect trên danh sách vị trí tính một lần cho cả message.
+Kết quả giữ đúng như các regex cũ (bench/fuzz_scanner.py so sánh hai cách trên corpus ngẫu nhiên).
+"""
+import bisect
+import html
+import re
+
+WS_RUN_RE = re.compile(r'\s+')
+# \b theo Unicode (str pattern): "và" không khớp trong "vàng", "and" không khớp trong "Android"
+AND_RE = re.compile(r'(?:và|and)\b', re.IGNORECASE)
+TO_FOR_RE = re.compile(r'to|for', re.IGNORECASE)
+END_MARK_RES = {
+    'newline': re.compile(r'\n'),
+    'epic': re.compile(r'epic', re.IGNORECASE),
+    'epic_link': re.compile(r'epic\s+link', re.IGNORECASE),
+}
+
+# Điểm kết thúc group (phần đuôi của regex cũ); `$` luôn được tính
+END_AND = ('and',)  # (?:\s+và\b|\s+and\b|$)
+END_AND_NEWLINE = ('and', 'newline')  # (?:\s+và\b|\s+and\b|\n|$)
+END_LINE = ('newline',)  # (?:\n|$)
+END_AND_EPIC = ('and', 'epic')  # (?:\s+và\b|\s+and\b|epic|$)
+END_AND_EPIC_LINK = ('and', 'epic_link')  # (?:\s+và\b|\s+and\b|epic\s+link|$)
+
+class Rule:
+    """Regex cũ `<tiền tố>\\s+([^<stop_chars>]+?)<end>`; tiền tố ở đây kết thúc bằng group khoảng trắng"""
+
+    def __init__(self, prefix, stop_chars, end, min_space=1):
+        self.prefix = re.compile(prefix, re.IGNORECASE)
+        self.stop_chars = stop_chars
+        self.end = end
+        self.min_space = min_space  # 1 cho \s+, 0 cho \s*
+
+    def starts(self, text, match):
+        """Vị trí bắt đầu group theo thứ tự regex thử: \\s+ tham lam rồi nhả dần từng ký tự"""
+        space_start, space_end = match.span(1)
+        return range(space_end, space_start + self.min_space - 1, -1)
+
+class AssignToRule(Rule):
+    """`assign\\s+(?:to|for)?\\s+`: sau nhánh có "to/for", group còn có thể bắt đầu trong dải khoảng trắng đầu"""
+
+    def starts(self, text, match):
+        space_start, space_end = match.span(1)
+        word = TO_FOR_RE.match(text, space_end)
+        if word:
+            space = WS_RUN_RE.match(text, word.end())
+            if space:
+                yield from range(space.end(), space.start(), -1)
+        # Bỏ qua "to/for": hai \s+ chia nhau dải khoảng trắng đầu (mỗi bên ít nhất 1 ký tự)
+        yield from range(space_end, space_start + 1, -1)
+
+EPIC_RULES = [
+    Rule(r'epic\s+link\s+(?:đến|to)(\s+)', '\n,', END_AND),  # "epic link đến X"
+    Rule(r'epic\s+link(\s+)', '\n,', END_AND),  # "epic link X"
+    Rule(r'epic\s*[:\-=](\s*)', '\n,', END_AND, min_space=0),  # "epic: X"
+    Rule(r'link\s+(?:đến|to)\s+epic(\s+)', '\n,', END_AND),  # "link đến epic X"
+    Rule(r'epic\s+link\s+(?:đến|to)(\s+)', '\n', END_LINE),  # Lấy đến hết dòng
+    Rule(r'epic\s+link(\s+)', '\n', END_LINE),  # Lấy đến hết dòng
+]
+ASSIGNEE_RULES = [
+    Rule(r'gán\s+(?:task\s+này\s+)?cho(\s+)', '\n,', END_AND),  # "gán cho X"
+    Rule(r'gắn\s+cho(\s+)', '\n,', END_AND),  # "gắn cho X"
+    Rule(r'tạo\s+task\s+gắn\s+cho(\s+)', '\n,', END_AND),  # "tạo task gắn cho X"
+    Rule(r'gán\s+(?:task\s+này\s+)?cho(\s+)', '\n', END_AND_NEWLINE),  # "gán cho X" (lấy đến hết dòng)
+    AssignToRule(r'assign(\s+)', '\n,', END_AND),  # "assign to X"
+    Rule(r'assignee\s*[:\-=](\s*)', '\n,', END_AND, min_space=0),  # "assignee: X"
+]
+# "gán cho X" trong message Teams (sau khi thay mention tags bằng tên)
+MENTION_ASSIGNEE_RULES = [
+    Rule(r'tạo\s+task\s+gắn\s+cho(\s+)', '\n,<', END_AND_EPIC),
+    Rule(r'gắn\s+cho(\s+)', '\n,<', END_AND_EPIC),
+    Rule(r'gán\s+(?:task\s+này\s+)?cho(\s+)', '\n,<', END_AND_EPIC),
+]
+ASSIGN_INSTRUCTION_RULE = Rule(r'gán\s+(?:task\s+này\s+)?cho(\s+)', '\n,', END_AND)
+ASSIGN_PHRASE_RE = re.compile(r'(?:gắn|gán)\s+(?:cho|task\s+này\s+cho)', re.IGNORECASE)
+
+# Từ khóa đứng sau một dải khoảng trắng thì cắt bỏ từ đó đến hết (thay cho `\s+(?:...).*$`)
+EPIC_TAIL_RE = re.compile(r'(?:gán|gắn|assign)\b', re.IGNORECASE)
+ASSIGNEE_TAIL_RE = re.compile(r'epic(?:\s+link)?\b', re.IGNORECASE)
+INSTRUCTION_WORD_RE = re.compile(r'(?:gán|gắn|assign|epic|link)\b', re.IGNORECASE)
+TRAILING_WORDS_RE = re.compile(r'(?:và|and|cho|to|for)\b', re.IGNORECASE)  # "to" trong "Tools" không phải từ nối
+SUMMARY_TAIL_RE = re.compile(
+    r'(?:hãy\s+)?(?:gán|gắn)\s+(?:task\s+này\s+)?cho|assign(?:ee)?\b|epic\s+link|link\s+(?:đến|to)\s+epic'
+    r'|(?:mức\s+độ|độ\s+ưu\s+tiên|ưu\s+tiên|priority)\b',
+    re.IGNORECASE,
+)
+
+class TextScan:
+    """Bảng tra của một đoạn text (dải khoảng trắng, vị trí ký tự dừng, điểm kết thúc), dùng chung cho mọi rule"""
+
+    def __init__(self, text):
+        self.text = text
+        self._stops = {}
+        self._ends = {}
+
+    def next_stop(self, i, stop_chars):
+        """Vị trí đầu tiên >= i là một trong stop_chars (len(text) nếu không có)"""
+        positions = self._stops.get(stop_chars)
+        if positions is None:
+            pattern = '[' + re.escape(stop_chars) + ']'
+            positions = self._stops[stop_chars] = [m.start() for m in re.finditer(pattern, self.text)]
+        k = bisect.bisect_left(positions, i)
+        return positions[k] if k < len(positions) else len(self.text)
+
+    def next_end(self, i, end):
+        """Vị trí e >= i nhỏ nhất mà điểm kết thúc khớp tại e (None nếu không có)"""
+        starts, stops = self._ends.get(end) or self._build_ends(end)
+        k = bisect.bisect_right(starts, i) - 1
+        if k >= 0 and stops[k] > i:
+            return i
+        return starts[k + 1] if k + 1 < len(starts) else None
+
+    def _build_ends(self, end):
+        text = self.text
+        n = len(text)
+        spans = [(n, n + 1)]  # $
+        if text.endswith('\n'):
+            spans.append((n - 1, n))  # $ khớp cả trước '\n' cuối cùng
+        if 'and' in end:
+            # \s+và / \s+and khớp tại mọi vị trí trong dải khoảng trắng đứng ngay trước "và"/"and"
+            for word in AND_RE.finditer(text):
+                a = space_start(text, word.start())
+                if a < word.start():
+                    spans.append((a, word.start()))
+        for name in end:
+            if name in END_MARK_RES:
+                spans.extend((m.start(), m.start() + 1) for m in END_MARK_RES[name].finditer(text))
+        spans.sort()
+        starts, stops = [], []
+        for a, b in spans:
+            if stops and a <= stops[-1]:
+                stops[-1] = max(stops[-1], b)
+            else:
+                starts.append(a)
+                stops.append(b)
+        self._ends[end] = (starts, stops)
+        return starts, stops
+
+    def capture(self, rule):
+        """Group của match đầu tiên (trái nhất) của rule như re.search, None nếu không khớp"""
+        span = self.capture_span(rule)
+        return self.text[span[0]:span[1]] if span else None
+
+    def capture_span(self, rule):
+        """(start, end) của group như capture(), None nếu không khớp"""
+        text = self.text
+        pos = 0
+        while True:
+            match = rule.prefix.search(text, pos)
+            if not match:
+                return None
+            for start in rule.starts(text, match):
+                # Group lazy dừng ở điểm kết thúc gần nhất, miễn là chưa gặp ký tự dừng
+                end = self.next_end(start + 1, rule.end)
+                if end is not None and end <= self.next_stop(start, rule.stop_chars):
+                    return start, end
+            pos = match.start() + 1
+
+def space_start(text, i):
+    """Đầu dải khoảng trắng kết thúc tại i (bằng i nếu text[i - 1] không phải khoảng trắng)"""
+    while i > 0 and text[i - 1].isspace():
+        i -= 1
+    return i
+
+def cut_before_word(value, word_re):
+    """Như re.sub(r'\\s+(?:word).*$', '', value) cho value một dòng: cắt từ dải khoảng trắng đứng trước word"""
+    word = word_re.search(value)
+    while word:
+        start = space_start(value, word.start())
+        if start < word.start():
+            return value[:start]
+        word = word_re.search(value, word.start() + 1)
+    return value
+
+def joins_more_words(tail):
+    """tail (phần bị cắt sau giá trị) là "và/and" rồi tới chữ không phải instruction ("and Marketing"):
+    giá trị có thể là tên có từ nối ("Sales and Marketing") bị cắt mất phần sau"""
+    words = tail.split(None, 2)
+    return len(words) > 1 and bool(AND_RE.fullmatch(words[0])) and not INSTRUCTION_WORD_RE.match(words[1])
+
+def line_rest(text, i):
+    """Phần còn lại của dòng từ i (group dừng ở "và/and" thì phần này bắt đầu bằng từ nối đó)"""
+    end = text.find('\n', i)
+    return text[i:] if end == -1 else text[i:end]
+
+def cut_trailing_words(value):
+    """cut_before_word(value, TRAILING_WORDS_RE) kèm cờ truncated (xem joins_more_words)"""
+    cut = cut_before_word(value, TRAILING_WORDS_RE)
+    return cut, joins_more_words(value[len(cut):])
+
+def remove_parens(value):
+    """Như re.sub(r'\\s*\\([^)]+\\)', '', value): bỏ "(...)" cùng khoảng trắng phía trước"""
+    parts = []
+    last = 0
+    i = value.find('(')
+    while i != -1:
+        close = value.find(')', i + 1)
+        if close == -1:
+            break
+        if close == i + 1:
+            # "()" không khớp [^)]+
+            i = value.find('(', close)
+            continue
+        start = i
+        while start > last and value[start - 1].isspace():
+            start -= 1
+        parts.append(value[last:start])
+        last = close + 1
+        i = value.find('(', last)
+    parts.append(value[last:])
+    return ''.join(parts)
+
+def strip_tags(text):
+    """Như re.sub(r'<[^>]+>', '', text) nhưng không quét lại phần đuôi cho mỗi '<' thiếu '>'"""
+    parts = []
+    last = 0
+    i = text.find('<')
+    while i != -1:
+        close = text.find('>', i + 1)
+        if close == -1:
+            break
+        if close == i + 1:
+            i = text.find('<', close)
+            continue
+        parts.append(text[last:i])
+        last = close + 1
+        i = text.find('<', last)
+    parts.append(text[last:])
+    return ''.join(parts)
+
+def iter_mention_tags(text):
+    """Như AT_TAG_RE.finditer (r'<at[^>]*>([^<]+)</at>'), trả về (start, end, tên trong tag)"""
+    pos = 0
+    gt = lt = -1
+    while True:
+        i = text.find('<at', pos)
+        if i == -1:
+            return
+        if gt < i + 3:
+            gt = text.find('>', i + 3)
+            if gt == -1:
+                return
+            lt = text.find('<', gt + 1)
+        if lt == -1:
+            return
+        if lt > gt + 1 and text.startswith('</at>', lt):
+            yield i, lt + 5, text[gt + 1:lt]
+            pos = lt + 5
+        else:
+            pos = i + 1
+
+def extract_epic_and_assignee(text):
+    """Epic link và assignee cho quick parse (các rule thử theo thứ tự, rule đầu cho giá trị khác rỗng thắng)"""
+    epic_link, assignee, _ = parse_epic_and_assignee(text)
+    return epic_link, assignee
+
+def parse_epic_and_assignee(text):
+    """Như extract_epic_and_assignee, thêm cờ truncated: giá trị bị cắt ở từ nối mà sau đó còn chữ"""
+    scan = TextScan(text)
+    truncated = False
+    epic_link = None
+    for rule in EPIC_RULES:
+        span = scan.capture_span(rule)
+        if span is not None:
+            # Loại bỏ các từ thừa ở cuối và ký tự đặc biệt ở đầu/cuối
+            epic_link = cut_before_word(text[span[0]:span[1]].strip(), EPIC_TAIL_RE)
+            epic_link, cut = cut_trailing_words(epic_link)
+            epic_link = epic_link.strip('.,;:!?')
+            if epic_link:
+                truncated = cut or joins_more_words(line_rest(text, span[1]))
+                break
+
+    assignee = None
+    for rule in ASSIGNEE_RULES:
+        span = scan.capture_span(rule)
+        if span is not None:
+            # Loại bỏ phần trong ngoặc đơn (như "(KHN.SBU3.DEV)") và các từ thừa ở cuối
+            assignee = remove_parens(text[span[0]:span[1]].strip())
+            assignee = cut_before_word(assignee, ASSIGNEE_TAIL_RE)
+            assignee, cut = cut_trailing_words(assignee)
+            assignee = assignee.strip('.,;:!?')
+            if assignee:
+                truncated = truncated or cut or joins_more_words(line_rest(text, span[1]))
+                break
+    return epic_link, assignee, truncated
+
+def find_assignee_in_text(text):
+    """Tên sau "gán cho"/"gắn cho" trong message Teams đã thay mention tags bằng tên"""
+    scan = TextScan(text)
+    assignee = None
+    for rule in MENTION_ASSIGNEE_RULES:
+        value = scan.capture(rule)
+        if value is not None:
+            assignee = remove_parens(html.unescape(value.strip())).strip()
+            if assignee and len(assignee) > 2:
+                break
+    return assignee
+
+def assign_phrase_span(text):
+    """(đầu, cuối) của phần tên sau "gắn cho"/"gán cho" (đến "và", "and", "epic link" hoặc hết), (-1, -1) nếu không có"""
+    match = ASSIGN_PHRASE_RE.search(text)
+    if not match:
+        return -1, -1
+    return match.end(), TextScan(text).next_end(match.end(), END_AND_EPIC_LINK)
+
+def has_assign_instruction(text):
+    """Text đã có "gán cho X" chưa"""
+    return TextScan(text).capture(ASSIGN_INSTRUCTION_RULE) is not None
+
+def cut_summary_tail(summary):
+    """Như re.sub(r'(?:\\s*,)?\\s+(?:<từ khóa instruction>).*$', '', summary) cho summary một dòng"""
+    # Từ khóa đầu tiên có khoảng trắng đứng trước cho vị trí cắt trái nhất (từ khóa bắt đầu bằng chữ cái)
+    keyword = SUMMARY_TAIL_RE.search(summary)
+    while keyword:
+        start = space_start(summary, keyword.start())
+        if start < keyword.start():
+            if start > 0 and summary[start - 1] == ',':
+                start = space_start(summary, start - 1)
+            return summary[:start]
+        keyword = SUMMARY_TAIL_RE.search(summary, keyword.start() + 1)
+    return summary
@@ -0,0 +1,67 @@
+"""
+Đọc file span (TRACE_LOG) và in các request chậm nhất kèm cây span, cùng thời gian các lần gọi Jira theo endpoint
+
+    python trace_report.py traces.jsonl --slowest 5
+"""
+import argparse
+import json
+import re
+from collections import defaultdict
+
+# /issue/BUILDEE-123 -> /issue/{key} để gộp theo endpoint
+ISSUE_KEY_RE = re.compile(r'/issue/(?!bulk\b)[^/]+')
+
+def read_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def trace_end(span, children):
+    """Thời điểm span cuối cùng trong cây kết thúc (job chạy sau webhook vẫn tính vào request)"""
+    return max([span['start'] + span['duration_ms'] / 1000] + [trace_end(child, children) for child in children[span['span_id']]])
+
+def print_tree(span, children, depth=0):
+    attributes = ', '.join(f'{k}={v}' for k, v in span['attributes'].items())
+    status = '' if span['status'] == 'ok' else f" [{span['status']}]"
+    print(f"  {'  ' * depth}{span['name']:<{24 - 2 * depth}} {span['duration_ms']:>9.1f}ms{status}  {attributes}")
+    for child in sorted(children[span['span_id']], key=lambda s: s['start']):
+        print_tree(child, children, depth + 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traces', nargs='+', help='File JSON lines do service ghi (TRACE_LOG)')
+    parser.add_argument('--root', default='webhook', help='Tên span gốc của request')
+    parser.add_argument('--slowest', type=int, default=5, help='Số request chậm nhất in cây span')
+    args = parser.parse_args()
+
+    spans = read_spans(args.traces)
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+
+    roots = sorted(((trace_end(s, children) - s['start'], s) for s in spans if s['name'] == args.root),
+                   key=lambda item: -item[0])
+    print(f"{len(roots)} request, {len(spans)} span")
+    for total, root in roots[:args.slowest]:
+        print(f"\ntrace {root['trace_id']}: {total * 1000:.1f}ms")
+        print_tree(root, children)
+
+    jira_calls = defaultdict(list)
+    for span in spans:
+        if span['name'] == 'jira_request':
+            endpoint = f"{span['attributes']['method']} {ISSUE_KEY_RE.sub('/issue/{key}', span['attributes']['path'])}"
+            jira_calls[endpoint].append(span['duration_ms'])
+    if jira_calls:
+        print("\nJira theo endpoint (ms):")
+        for endpoint, durations in sorted(jira_calls.items(), key=lambda item: -percentile(item[1], 0.95)):
+            print(f"  {endpoint:<28} n={len(durations):<6} p50 {percentile(durations, 0.5):>8.1f}  "
+                  f"p95 {percentile(durations, 0.95):>8.1f}  max {max(durations):>8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Tracing nhẹ trong process: mỗi webhook một trace id, mỗi bước (clean, Gemini, fallback, Jira...) một span.
+Span được ghi thành JSON lines ra file qua queue: request chỉ đưa dict của span vào queue, việc tạo log record,
+serialize và ghi file chạy ở thread của QueueListener
+"""
+import contextvars
+import json
+import logging
+import queue
+import random
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueListener
+
+_current = contextvars.ContextVar('trace_span', default=None)  # Span đang chạy trong task hiện tại
+_queue = None  # None = không ghi span
+_listener = None
+
+class _Span:
+    __slots__ = ('trace_id', 'span_id', 'attributes')
+
+    def __init__(self, trace_id, span_id, attributes):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.attributes = attributes
+
+class _SpanListener(QueueListener):
+    def prepare(self, record):
+        # Trong queue chỉ là dict (không tạo LogRecord, không findCaller ở thread của request)
+        return logging.makeLogRecord({'msg': record})
+
+class _SpanFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+def configure(path):
+    """Bật ghi span ra file JSON lines; không gọi thì span chỉ giữ trace id trong context, không ghi gì"""
+    global _queue, _listener
+    file_handler = logging.FileHandler(path, encoding='utf-8')
+    file_handler.setFormatter(_SpanFormatter())
+    _queue = queue.SimpleQueue()
+    _listener = _SpanListener(_queue, file_handler)
+    _listener.start()
+
+def shutdown():
+    """Ghi nốt các span còn trong queue"""
+    global _queue, _listener
+    if _listener:
+        _queue = None
+        _listener.stop()
+        _listener = None
+
+def new_id(bits=64):
+    # Chỉ cần không trùng, không cần bí mật: random nhanh hơn nhiều so với os.urandom (syscall)
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+def current_context():
+    """[trace_id, span_id] của span đang chạy (để job chạy sau nối lại với trace này), None nếu không có"""
+    span_ = _current.get()
+    return [span_.trace_id, span_.span_id] if span_ else None
+
+def trace_id():
+    span_ = _current.get()
+    return span_.trace_id if span_ else '-'
+
+def annotate(**attributes):
+    """Thêm thuộc tính cho span đang chạy (ví dụ issue key, nhánh parse)"""
+    span_ = _current.get()
+    if span_:
+        span_.attributes.update(attributes)
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """Một bước trong trace, con của span đang chạy trong context (task con tạo bằng create_task kế thừa span).
+    parent=[trace_id, span_id] nối với trace khác (job trong hàng đợi chạy sau webhook); không có span cha
+    thì bắt đầu trace mới"""
+    if parent is None:
+        parent_span = _current.get()
+        parent = (parent_span.trace_id, parent_span.span_id) if parent_span else None
+    span_ = _Span(parent[0] if parent else new_id(128), new_id(), attributes)
+    token = _current.set(span_)
+    start = time.time()
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield span_.attributes
+    except BaseException as e:
+        status = type(e).__name__  # CancelledError = bị hủy do timeout/race
+        raise
+    finally:
+        _current.reset(token)
+        if _queue is not None:
+            _queue.put_nowait({
+                'trace_id': span_.trace_id,
+                'span_id': span_.span_id,
+                'parent_id': parent[1] if parent else None,
+                'name': name,
+                'start': round(start, 6),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'status': status,
+                'attributes': span_.attributes,
+            })
@@ -0,0 +1,83 @@
+"""
+Train classifier issuetype/priority (classifier.py) từ output Gemini mà service ghi lại (GEMINI_OUTPUT_LOG)
+
+    python train_classifier.py gemini_outputs.jsonl --output classifier.bin
+
+Đánh giá trên phần giữ lại (--holdout) so với việc luôn đoán label phổ biến nhất, rồi train lại trên toàn bộ
+dữ liệu và ghi model. Service dùng model khi đặt CLASSIFIER_MODEL=classifier.bin.
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter
+
+from classifier import TextClassifier
+from common import ISSUE_TYPES, PRIORITIES
+
+HEADS = {'issuetype': ISSUE_TYPES, 'priority': PRIORITIES}
+
+def read_examples(paths):
+    """[(text, {head: label})], mỗi text lấy lần ghi cuối cùng"""
+    examples = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('text'):
+                    examples[record['text']] = {head: record.get(head) for head in HEADS}
+    return list(examples.items())
+
+def evaluate(model, examples):
+    correct = Counter()
+    for text, labels in examples:
+        for head, (label, _) in model.predict(text).items():
+            correct[head] += label == labels[head]
+    return {head: correct[head] / len(examples) for head in HEADS}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help='File JSON lines do service ghi (GEMINI_OUTPUT_LOG)')
+    parser.add_argument('--output', default='classifier.bin')
+    parser.add_argument('--dim', type=int, default=1 << 15, help='Số chiều sau khi hash n-gram')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--learning-rate', type=float, default=0.5)
+    parser.add_argument('--holdout', type=float, default=0.2, help='Tỉ lệ dữ liệu giữ lại để đánh giá')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    examples = read_examples(args.logs)
+    if not examples:
+        raise SystemExit("Không có dữ liệu để train")
+    random.Random(args.seed).shuffle(examples)
+    print(f"{len(examples)} message, issuetype {dict(Counter(l['issuetype'] for _, l in examples))}, "
+          f"priority {dict(Counter(l['priority'] for _, l in examples))}")
+
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+    if test:
+        model = TextClassifier(HEADS, dim=args.dim)
+        model.fit(train, epochs=args.epochs, learning_rate=args.learning_rate, seed=args.seed)
+        accuracy = evaluate(model, test)
+        for head in HEADS:
+            majority = Counter(labels[head] for _, labels in train).most_common(1)[0][0]
+            baseline = sum(labels[head] == majority for _, labels in test) / len(test)
+            print(f"  {head:<10} accuracy {accuracy[head]:.1%} (luôn đoán {majority}: {baseline:.1%}), {len(test)} message giữ lại")
+
+    model = TextClassifier(HEADS, dim=args.dim)
+    model.fit(examples, epochs=args.epochs, learning_rate=args.learning_rate, seed=args.seed)
+    model.save(args.output)
+
+    start = time.perf_counter()
+    loaded = TextClassifier.load(args.output)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for text, _ in examples:
+        loaded.predict(text)
+    predict_time = (time.perf_counter() - start) / len(examples)
+    print(f"Đã ghi {args.output}: load {load_time * 1000:.1f}ms, predict {predict_time * 1e6:.0f}µs/message")
+
+if __name__ == '__main__':
+    main()